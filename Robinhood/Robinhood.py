@@ -15,6 +15,7 @@ import getpass
 import requests
 import six
 import dateutil
+import dateutil.parser
 import time
 import random
 import hmac, base64, struct, hashlib
@@ -22,6 +23,11 @@ import hmac, base64, struct, hashlib
 #Application-specific imports
 from . import exceptions as RH_exception
 from . import endpoints
+from .orders import OpenOrderTracker, OrderWatcher
+from .perf import OrderPerfStore
+from .pretrade import PreTradeChecker, intent_order
+from .quotes import QuotePoller
+from .ratelimit import RateLimiter, dispatch
 
 class Bounds(Enum):
     """Enum for bounds in `historicals` endpoint """
@@ -44,6 +50,8 @@ class Robinhood:
     headers = None
     auth_token = None
     refresh_token = None
+    account_url = None
+    perf = None
 
     logger = logging.getLogger('Robinhood')
     logger.addHandler(logging.NullHandler())
@@ -70,6 +78,16 @@ class Robinhood:
         self.device_token = ""
         self.challenge_id = ""
 
+        # Shared by every call that fans out concurrently
+        self.rate_limiter = RateLimiter()
+        # Bulk order POSTs and cancels, None leaves them unthrottled
+        self.order_rate_limiter = self.rate_limiter
+
+        # Offline order checks, fed by instrument, quote and account calls
+        self.pretrade = PreTradeChecker()
+        # Open orders, synced incrementally by `get_open_orders`
+        self.order_tracker = OpenOrderTracker(self)
+
     def login_required(function):  # pylint: disable=E0213
         """ Decorator function that prompts user for login if they are not logged in already. Can be applied to any function using the @ notation. """
         def wrapper(self, *args, **kwargs):
@@ -126,6 +144,7 @@ class Robinhood:
         self.refresh_token  = res["refresh_token"]
         self.mfa_code       = res["mfa_code"]
         self.scope          = res["scope"]
+        self.headers['Authorization'] = 'Bearer ' + self.auth_token
 
     def login(self,
               username,
@@ -167,6 +186,7 @@ class Robinhood:
                     self.auth_token = data['access_token']
                     self.refresh_token = data['refresh_token']
                     self.headers['Authorization'] = 'Bearer ' + self.auth_token
+                    self.prewarm()
                     return True
 
             except requests.exceptions.HTTPError:
@@ -192,6 +212,7 @@ class Robinhood:
                     self.auth_token = res_data['access_token']
                     self.refresh_token = res_data['refresh_token']
                     self.headers['Authorization'] = 'Bearer ' + self.auth_token
+                    self.prewarm()
                     return True
 
                 print("No 2FA Given")
@@ -222,6 +243,7 @@ class Robinhood:
                     self.auth_token = data['access_token']
                     self.refresh_token = data['refresh_token']
                     self.headers['Authorization'] = 'Bearer ' + self.auth_token
+                    self.prewarm()
                     return True
 
             except requests.exceptions.HTTPError:
@@ -249,6 +271,7 @@ class Robinhood:
                     self.auth_token = data['access_token']
                     self.refresh_token = data['refresh_token']
                     self.headers['Authorization'] = 'Bearer ' + self.auth_token
+                    self.prewarm()
                     return True
 
             except requests.exceptions.HTTPError:
@@ -274,6 +297,7 @@ class Robinhood:
                     self.auth_token = data['access_token']
                     self.refresh_token = data['refresh_token']
                     self.headers['Authorization'] = 'Bearer ' + self.auth_token
+                    self.prewarm()
                     return True
 
             except requests.exceptions.HTTPError:
@@ -281,6 +305,19 @@ class Robinhood:
 
         return False
 
+    def prewarm(self):
+        """Cache the account URL and open the API connection
+
+            Orders need the account URL, fetching it here keeps that round
+            trip off the order path and leaves a kept-alive connection in
+            the session pool for the order POST.
+        """
+
+        try:
+            self.get_account()
+        except requests.exceptions.RequestException as err_msg:
+            warnings.warn('Failed to prewarm order path ' + repr(err_msg))
+
     def logout(self):
         """Logout from Robinhood
 
@@ -301,6 +338,7 @@ class Robinhood:
 
         self.headers['Authorization'] = None
         self.auth_token = None
+        self.account_url = None
 
         return req
 
@@ -338,6 +376,7 @@ class Robinhood:
         res = self.session.get(endpoints.instruments(), params={'query': stock.upper()}, timeout=15)
         res.raise_for_status()
         res = res.json()
+        self.pretrade.add_instruments(res['results'])
 
         # if requesting all, return entire object so may paginate with ['next']
         if (stock == ""):
@@ -363,8 +402,27 @@ class Robinhood:
         except requests.exceptions.HTTPError:
             raise RH_exception.InvalidInstrumentId()
 
+        self.pretrade.add_instruments(data['results'][:1])
         return data['results'][0]
 
+    def get_instruments(self, urls):
+        """Fetch many instruments with one `instruments/?ids=` call
+
+            Args:
+                urls (list): instrument URLs
+
+            Returns:
+                (:obj:`list`): instrument dicts, None for unknown ones
+        """
+
+        ids = [url.rstrip('/').rsplit('/', 1)[-1] for url in urls]
+        res = self.session.get(endpoints.instruments(), params={'ids': ','.join(ids)}, timeout=15)
+        res.raise_for_status()
+        results = res.json()['results']
+        self.pretrade.add_instruments([instrument for instrument in results if instrument])
+
+        return results
+
     def quote_data(self, stock=''):
         """Fetch stock quote
 
@@ -393,6 +451,7 @@ class Robinhood:
         except requests.exceptions.HTTPError:
             raise RH_exception.InvalidTickerSymbol()
 
+        self.pretrade.observe([data])
         return data
 
     # We will keep for compatibility until next major release
@@ -416,6 +475,7 @@ class Robinhood:
         except requests.exceptions.HTTPError:
             raise RH_exception.InvalidTickerSymbol()
 
+        self.pretrade.observe(data["results"])
         return data["results"]
 
     def get_quote_list(self,
@@ -500,6 +560,7 @@ class Robinhood:
         historicals = endpoints.historicals() + "/?symbols=" + ','.join(stock).upper() + "&interval=" + interval + "&span=" + span + "&bounds=" + bounds.name.lower()
 
         res = self.session.get(historicals, timeout=15)
+        res.raise_for_status()
         return res.json()
 
     def get_news(self, stock):
@@ -725,8 +786,22 @@ class Robinhood:
         res.raise_for_status()  # auth required
         res = res.json()
 
+        self.account_url = res['results'][0]['url']
+        self.pretrade.set_account(res['results'][0])
         return res['results'][0]
 
+    def get_account_url(self):
+        """Account URL for order payloads, fetched once and cached
+
+            Returns:
+                (str): `url` of the account
+        """
+
+        if self.account_url is None:
+            self.get_account()
+
+        return self.account_url
+
     def get_url(self, url):
         """
             Flat wrapper for fetching URL directly
@@ -762,7 +837,16 @@ class Robinhood:
                 (List): a list of Ticker strings
         """
         instrument_list = self.get_url(endpoints.tags(tag))["instruments"]
-        return [self.get_url(instrument)["symbol"] for instrument in instrument_list]
+
+        # one `instruments/?ids=` call per 50 instruments
+        symbols = {}
+        for i in range(0, len(instrument_list), 50):
+            for instrument in self.get_instruments(instrument_list[i:i + 50]):
+                if instrument:
+                    symbols[instrument['id']] = instrument['symbol']
+
+        return [symbols[url.rstrip('/').rsplit('/', 1)[-1]] for url in instrument_list
+                if url.rstrip('/').rsplit('/', 1)[-1] in symbols]
 
     ###########################################################################
     #                           GET OPTIONS INFO
@@ -870,6 +954,22 @@ class Robinhood:
 
         return data
 
+    def get_fundamentals_list(self, stocks):
+        """Fetch fundamentals for multiple stocks with one `fundamentals/?symbols=` call
+
+            Args:
+                stocks (list<str>): stock tickers
+
+            Returns:
+                (:obj:`list` of :obj:`dict`): contents of `fundamentals`
+                    endpoint, in the order of `stocks`, None for unknown ones
+        """
+
+        req = self.session.get(endpoints.fundamentals(), params={'symbols': ','.join(stocks)}, timeout=15)
+        req.raise_for_status()
+
+        return req.json()['results']
+
     def fundamentals(self, stock=''):
         """Wrapper for get_fundamentlals function """
 
@@ -994,6 +1094,13 @@ class Robinhood:
 
         return self.session.get(endpoints.dividends(), timeout=15).json()
 
+    def dividend_page(self, url=None, params=None):
+        """Fetch one page of dividends, see `order_page` """
+
+        res = self.session.get(url or endpoints.dividends(), params=params, timeout=15)
+        res.raise_for_status()
+        return res.json()
+
     ###########################################################################
     #                           POSITIONS DATA
     ###########################################################################
@@ -1268,7 +1375,7 @@ class Robinhood:
                                  price=price,
                                  quantity=quantity))
 
-    def submit_sell_order(self,
+    def submit_order(self,
                      instrument_URL=None,
                      symbol=None,
                      order_type=None,
@@ -1293,113 +1400,79 @@ class Robinhood:
                     place_stop_loss_sell_order()
                     place_stop_limit_sell_order()
 
+                Every check in `pretrade` runs before the first network call.
+
             Args:
                 instrument_URL (str): the RH URL for the instrument
                 symbol (str): the ticker symbol for the instrument
-                order_type (str): 'MARKET' or 'LIMIT'
-                time_in_force (:enum:`TIME_IN_FORCE`): GFD or GTC (day or
+                order_type (str): 'market' or 'limit', defaults to 'limit'
+                                  with a price and 'market' without
+                time_in_force (:enum:`TIME_IN_FORCE`): 'gfd' or 'gtc' (day or
                                                        until cancelled)
-                trigger (str): IMMEDIATE or STOP enum
+                trigger (str): 'immediate' or 'stop' enum
                 price (float): The share price you'll accept
                 stop_price (float): The price at which the order becomes a
                                     market or limit order
                 quantity (int): The number of shares to buy/sell
-                side (str): BUY or sell
+                side (str): 'buy' or 'sell'
 
             Returns:
                 (:obj:`requests.request`): result from `orders` put command
-        """
 
-        # Used for default price input
-        # Price is required, so we use the current bid price if it is not specified
-        current_quote = self.get_quote(symbol)
-        if (current_quote['bid_price'] == 0) or (current_quote['bid_price'] == None):
-            current_bid_price = current_quote['last_trade_price']
-        else:
-            current_bid_price = current_quote['bid_price']
-
-        # Start with some parameter checks. I'm paranoid about $.
-        if(instrument_URL is None):
-            if(symbol is None):
-                raise(ValueError('Neither instrument_URL nor symbol were passed to submit_sell_order'))
-            raise(ValueError('Instrument_URL not passed to submit_sell_order'))
-
-        if(symbol is None):
-            raise(ValueError('Symbol not passed to submit_sell_order'))
-
-        if(side is None):
-            raise(ValueError('Order is neither buy nor sell in call to submit_sell_order'))
-
-        if(order_type is None):
-            if(price is None):
-                if(stop_price is None):
-                    order_type = 'market'
-                else:
-                    order_type = 'limit'
-
-        symbol = str(symbol).upper()
-        order_type = str(order_type).lower()
-        time_in_force = str(time_in_force).lower()
-        trigger = str(trigger).lower()
-        side = str(side).lower()
-
-        if(order_type != 'market') and (order_type != 'limit'):
-            raise(ValueError('Invalid order_type in call to submit_sell_order'))
-
-        if(order_type == 'limit'):
-            if(price is None):
-                raise(ValueError('Limit order has no price in call to submit_sell_order'))
-            if(price <= 0):
-                raise(ValueError('Price must be positive number in call to submit_sell_order'))
-
-        if(trigger == 'stop'):
-            if(stop_price is None):
-                raise(ValueError('Stop order has no stop_price in call to submit_sell_order'))
-            if(price <= 0):
-                raise(ValueError('Stop_price must be positive number in call to submit_sell_order'))
-
-        if(stop_price is not None):
-            if(trigger != 'stop'):
-                raise(ValueError('Stop price set for non-stop order in call to submit_sell_order'))
-
-        if(price is None):
-            if(order_type == 'limit'):
-                raise(ValueError('Limit order has no price in call to submit_sell_order'))
-
-        if(price is not None):
-            if(order_type.lower() == 'market'):
-                raise(ValueError('Market order has price limit in call to submit_sell_order'))
-            price = float(price)
-        else:
-            price = current_bid_price # default to current bid price
-
-        if(quantity is None):
-            raise(ValueError('No quantity specified in call to submit_sell_order'))
+            Raises:
+                ValueError: the order failed a pre-trade check
+        """
 
-        quantity = int(quantity)
+        if instrument_URL is None:
+            raise ValueError('Instrument_URL not passed to submit_order')
 
-        if(quantity <= 0):
-            raise(ValueError('Quantity must be positive number in call to submit_sell_order'))
+        if order_type is None:
+            order_type = 'market' if price is None else 'limit'
 
-        payload = {}
+        if price is not None and str(order_type).lower() == 'market':
+            raise ValueError('Market order has price limit')
 
+        order = self.pretrade.check({
+            'symbol': symbol,
+            'instrument': instrument_URL,
+            'side': side,
+            'type': order_type,
+            'trigger': trigger,
+            'price': price,
+            'stop_price': stop_price,
+            'quantity': quantity,
+            'time_in_force': time_in_force,
+        })
+
+        price = order['price']
+        current_quote = None
+        if price is None:
+            # Price is required, so market orders take the current ask (buys)
+            # or bid (sells). Only fetched here, once every local check has passed.
+            current_quote = self.get_quote(order['symbol'])
+            side_price = current_quote['ask_price' if order['side'] == 'buy' else 'bid_price']
+            if (side_price == 0) or (side_price == None):
+                price = current_quote['last_trade_price']
+            else:
+                price = side_price
+
+        payload = {'account': self.get_account_url()}
         for field, value in [
-                ('account', self.get_account()['url']),
                 ('instrument', instrument_URL),
-                ('symbol', symbol),
-                ('type', order_type),
-                ('time_in_force', time_in_force),
-                ('trigger', trigger),
+                ('symbol', order['symbol']),
+                ('type', order['type']),
+                ('time_in_force', order['time_in_force']),
+                ('trigger', order['trigger']),
                 ('price', price),
-                ('stop_price', stop_price),
-                ('quantity', quantity),
-                ('side', side)
+                ('stop_price', order['stop_price']),
+                ('quantity', order['quantity']),
+                ('side', order['side'])
             ]:
             if(value is not None):
                 payload[field] = value
 
         try:
-            res = self.session.post(endpoints.orders(), data=payload, timeout=15)
+            res = self.post_order(payload, current_quote)
             res.raise_for_status()
 
             return res
@@ -1410,6 +1483,21 @@ class Robinhood:
             except:
                 print(ex)
 
+    def submit_sell_order(self,
+                     instrument_URL=None,
+                     symbol=None,
+                     order_type=None,
+                     time_in_force=None,
+                     trigger=None,
+                     price=None,
+                     stop_price=None,
+                     quantity=None,
+                     side='sell'):
+        """Submits sell order to Robinhood, see `submit_order` """
+
+        return self.submit_order(instrument_URL, symbol, order_type, time_in_force,
+                                 trigger, price, stop_price, quantity, side)
+
     def submit_buy_order(self,
                      instrument_URL=None,
                      symbol=None,
@@ -1419,173 +1507,147 @@ class Robinhood:
                      price=None,
                      stop_price=None,
                      quantity=None,
-                     side=None):
-        """Submits buy order to Robinhood
+                     side='buy'):
+        """Submits buy order to Robinhood, see `submit_order` """
 
-            Notes:
-                This is normally not called directly.  Most programs should use
-                one of the following instead:
+        return self.submit_order(instrument_URL, symbol, order_type, time_in_force,
+                                 trigger, price, stop_price, quantity, side)
 
-                    place_market_buy_order()
-                    place_limit_buy_order()
-                    place_stop_loss_buy_order()
-                    place_stop_limit_buy_order()
-                    place_market_sell_order()
-                    place_limit_sell_order()
-                    place_stop_loss_sell_order()
-                    place_stop_limit_sell_order()
+    def record_perf(self, path='orders_perf.db', watcher=None):
+        """Record latency and slippage of every order into a local store
 
             Args:
-                instrument_URL (str): the RH URL for the instrument
-                symbol (str): the ticker symbol for the instrument
-                order_type (str): 'market' or 'limit'
-                time_in_force (:enum:`TIME_IN_FORCE`): 'gfd' or 'gtc' (day or
-                                                       until cancelled)
-                trigger (str): 'immediate' or 'stop' enum
-                price (float): The share price you'll accept
-                stop_price (float): The price at which the order becomes a
-                                    market or limit order
-                quantity (int): The number of shares to buy/sell
-                side (str): BUY or sell
+                path (str): SQLite file of the `perf.OrderPerfStore`
+                watcher (:obj:`orders.OrderWatcher`, optional): watcher to
+                    take fill times from, a new one is started otherwise
 
             Returns:
-                (:obj:`requests.request`): result from `orders` put command
+                (:obj:`perf.OrderPerfStore`): the store
         """
 
-        # Used for default price input
-        # Price is required, so we use the current ask price if it is not specified
-        current_quote = self.get_quote(symbol)
-        if (current_quote['ask_price'] == 0) or (current_quote['ask_price'] == None):
-            current_ask_price = current_quote['last_trade_price']
-        else:
-            current_ask_price = current_quote['ask_price']
-
-        # Start with some parameter checks. I'm paranoid about $.
-        if(instrument_URL is None):
-            if(symbol is None):
-                raise(ValueError('Neither instrument_URL nor symbol were passed to submit_buy_order'))
-            raise(ValueError('Instrument_URL not passed to submit_buy_order'))
-
-        if(symbol is None):
-            raise(ValueError('Symbol not passed to submit_buy_order'))
-
-        if(side is None):
-            raise(ValueError('Order is neither buy nor sell in call to submit_buy_order'))
-
-        if(order_type is None):
-            if(price is None):
-                if(stop_price is None):
-                    order_type = 'market'
-                else:
-                    order_type = 'limit'
-
-        symbol = str(symbol).upper()
-        order_type = str(order_type).lower()
-        time_in_force = str(time_in_force).lower()
-        trigger = str(trigger).lower()
-        side = str(side).lower()
-
-        if(order_type != 'market') and (order_type != 'limit'):
-            raise(ValueError('Invalid order_type in call to submit_buy_order'))
-
-        if(order_type == 'limit'):
-            if(price is None):
-                raise(ValueError('Limit order has no price in call to submit_buy_order'))
-            if(price <= 0):
-                raise(ValueError('Price must be positive number in call to submit_buy_order'))
-
-        if(trigger == 'stop'):
-            if(stop_price is None):
-                raise(ValueError('Stop order has no stop_price in call to submit_buy_order'))
-            if(price <= 0):
-                raise(ValueError('Stop_price must be positive number in call to submit_buy_order'))
-
-        if(stop_price is not None):
-            if(trigger != 'stop'):
-                raise(ValueError('Stop price set for non-stop order in call to submit_buy_order'))
-
-        if(price is None):
-            if(order_type == 'limit'):
-                raise(ValueError('Limit order has no price in call to submit_buy_order'))
-
-        if(price is not None):
-            if(order_type.lower() == 'market'):
-                raise(ValueError('Market order has price limit in call to submit_buy_order'))
-            price = float(price)
-        else:
-            price = current_ask_price # default to current ask price
+        watcher = watcher or OrderWatcher(self)
+        self.perf = OrderPerfStore(path)
+        self.perf.follow(watcher)
+        self.pretrade.follow(watcher)
+        return self.perf
 
-        if(quantity is None):
-            raise(ValueError('No quantity specified in call to submit_buy_order'))
+    def post_order(self, payload, quote=None):
+        """POST an order payload, recording it when `record_perf` is on
 
-        quantity = int(quantity)
+            Args:
+                quote (dict, optional): quote the order was priced from,
+                    recorded as the reference for slippage
 
-        if(quantity <= 0):
-            raise(ValueError('Quantity must be positive number in call to submit_buy_order'))
+            Returns:
+                (:obj:`requests.request`): result from `orders` post command
+        """
 
-        payload = {}
+        start = time.time()
+        res = self.send_order(payload)
+        if self.perf is not None:
+            self.perf.submitted(res, payload, start, time.time(), quote)
+        if res.status_code in (200, 201):
+            try:
+                order_id = res.json().get('id')
+            except ValueError:
+                order_id = None
+            self.pretrade.record(payload, order_id=order_id)
 
-        for field, value in [
-                ('account', self.get_account()['url']),
-                ('instrument', instrument_URL),
-                ('symbol', symbol),
-                ('type', order_type),
-                ('time_in_force', time_in_force),
-                ('trigger', trigger),
-                ('price', price),
-                ('stop_price', stop_price),
-                ('quantity', quantity),
-                ('side', side)
-            ]:
-            if(value is not None):
-                payload[field] = value
+        return res
 
-        try:
-            res = self.session.post(endpoints.orders(), data=payload, timeout=15)
-            res.raise_for_status()
+    def post_cancel(self, order_id, cancel_url, headers=None):
+        """POST an order's cancel URL, recording it when `record_perf` is on """
 
-            return res
+        start = time.time()
+        res = self.send_cancel(order_id, cancel_url, headers)
+        if self.perf is not None and res.status_code in (200, 201):
+            self.perf.cancel_sent(order_id, start, time.time())
 
-        except Exception as ex: #sometimes Robinhood asks for another log in when placing an order
-            try:
-                auth_method()
-            except:
-                print(ex)
+        return res
 
-    def place_order(self,
-                    instrument,
-                    quantity=1,
-                    price=0.0,
-                    transaction=None,
-                    trigger='immediate',
-                    order='market',
-                    time_in_force='gfd'):
-        """Place an order with Robinhood
+    def send_order(self, payload):
+        """Send an order payload to the `orders` endpoint
+
+            Every order, however placed, goes through here, see
+            `paper.PaperTrader` for a local replacement.
+        """
+
+        return self.session.post(endpoints.orders(), data=payload, timeout=15)
+
+    def send_cancel(self, order_id, cancel_url, headers=None):
+        """Send an order cancel, the counterpart of `send_order` """
+
+        return self.session.post(cancel_url, headers=headers, timeout=15)
+
+    def get_order(self, order_id):
+        """Fetch one order
+
+            Returns:
+                (:obj:`dict`): JSON contents from the `orders` endpoint
+        """
+
+        res = self.session.get(endpoints.orders(order_id), timeout=15)
+        res.raise_for_status()
+        return res.json()
+
+    def order_page(self, url=None, params=None):
+        """Fetch one page of order history
 
             Args:
-                instrument (dict): the RH URL and symbol in dict for the instrument to be traded
-                quantity (int): quantity of stocks in order
-                bid_price (float): price for order
-                transaction (:enum:`Transaction`): BUY or SELL enum
-                trigger (:enum:`Trigger`): IMMEDIATE or STOP enum
-                order (:enum:`Order`): MARKET or LIMIT
-                time_in_force (:enum:`TIME_IN_FORCE`): GFD or GTC (day or until cancelled)
+                url (str, optional): a page's `next` URL, the first page if None
+                params (dict, optional): query of the first page
 
             Returns:
-                (:obj:`requests.request`): result from `orders` put command
+                (:obj:`dict`): JSON page with `results` and `next`
+        """
+
+        res = self.session.get(url or endpoints.orders(), params=params, timeout=15)
+        res.raise_for_status()
+        return res.json()
+
+    def order_pages(self, params=None):
+        """Yield `results` of each `orders` page, newest first """
+
+        data = self.order_page(params=params)
+        while True:
+            yield data['results']
+            if not data.get('next'):
+                break
+            # `next` already carries the query
+            data = self.order_page(data['next'])
+
+    def order_payload(self,
+                      instrument,
+                      quantity=1,
+                      price=0.0,
+                      transaction=None,
+                      trigger='immediate',
+                      order='market',
+                      time_in_force='gfd',
+                      quote=None):
+        """Build the `orders` POST payload for `place_order` arguments
+
+            Notes:
+                If no price is given it is the current ask (buys) or bid
+                (sells) of `quote`, falling back to the last trade price.
+                The quote is fetched when not passed in.
+
+            Returns:
+                (:obj:`dict`): payload for the `orders` endpoint
         """
 
         if isinstance(transaction, str):
             transaction = Transaction(transaction)
 
         if not price:
-            price = self.quote_data(instrument['symbol'])['bid_price']
+            quote = quote or self.quote_data(instrument['symbol'])
+            price = quote['ask_price'] if transaction == Transaction.BUY else quote['bid_price']
 
             if (price == 0) or (price == None):
-                price = self.quote_data(instrument['symbol'])['last_trade_price']
+                price = quote['last_trade_price']
 
         payload = {
-            'account': self.get_account()['url'],
+            'account': self.get_account_url(),
             'instrument': unquote(instrument['url']),
             'symbol': instrument['symbol'],
             'type': order.lower(),
@@ -1600,8 +1662,41 @@ class Robinhood:
         else:
             payload['price'] = float(price)
 
+        return payload
+
+    def place_order(self,
+                    instrument,
+                    quantity=1,
+                    price=0.0,
+                    transaction=None,
+                    trigger='immediate',
+                    order='market',
+                    time_in_force='gfd'):
+        """Place an order with Robinhood
+
+            Args:
+                instrument (dict): the RH URL and symbol in dict for the instrument to be traded
+                quantity (int): quantity of stocks in order
+                bid_price (float): price for order
+                transaction (:enum:`Transaction`): BUY or SELL enum
+                trigger (:enum:`Trigger`): IMMEDIATE or STOP enum
+                order (:enum:`Order`): MARKET or LIMIT
+                time_in_force (:enum:`TIME_IN_FORCE`): GFD or GTC (day or until cancelled)
+
+            Returns:
+                (:obj:`requests.request`): result from `orders` put command
+        """
+
+        self.check_order({'instrument': instrument, 'quantity': quantity, 'price': price,
+                          'transaction': transaction, 'trigger': trigger, 'order': order,
+                          'time_in_force': time_in_force})
+        # fetched once, to price the order and as its slippage reference
+        quote = None if price else self.quote_data(instrument['symbol'])
+        payload = self.order_payload(instrument, quantity, price, transaction,
+                                     trigger, order, time_in_force, quote)
+
         try:
-            res = self.session.post(endpoints.orders(), data=payload, timeout=15)
+            res = self.post_order(payload, quote)
             res.raise_for_status()
 
             return res
@@ -1628,12 +1723,6 @@ class Robinhood:
 
         """
 
-        if not ask_price:
-            ask_price = self.quote_data(instrument['symbol'])['ask_price']
-
-            if (ask_price == 0) or (ask_price == None):
-                ask_price = self.quote_data(instrument['symbol'])['last_trade_price']
-
         transaction = Transaction.BUY
 
         return self.place_order(instrument, quantity, ask_price, transaction)
@@ -1652,34 +1741,197 @@ class Robinhood:
             Returns:
                 (:obj:`requests.request`): result from `orders` put command
         """
-        if not bid_price:
-            bid_price = self.quote_data(instrument['symbol'])['bid_price']
-
-            if (bid_price == 0) or (bid_price == None):
-                bid_price = self.quote_data(instrument['symbol'])['last_trade_price']
-
         transaction = Transaction.SELL
 
         return self.place_order(instrument, quantity, bid_price, transaction)
 
+    ###########################################################################
+    #                           BASKET ORDERS
+    ###########################################################################
+
+    def check_order(self, intent):
+        """Check `place_order` keyword arguments without any network call,
+            see `pretrade.PreTradeChecker`
+
+            Returns:
+                (:obj:`dict`): the normalized order
+
+            Raises:
+                ValueError: describing the first problem found
+        """
+
+        return self.pretrade.check(intent_order(intent))
+
+    def place_basket_order(self, intents, max_workers=8):
+        """Validate and submit many orders concurrently
+
+            Every order is checked locally first; if any fails, nothing is
+            sent. Otherwise orders are posted concurrently under
+            `order_rate_limiter`.
+
+            Args:
+                intents (list): dicts of `place_order` keyword arguments
+                max_workers (int): concurrent requests
+
+            Returns:
+                (:obj:`list`): one dict per order, in input order, with
+                    `symbol`, `side`, `quantity`, `id`, `state`, `latency`
+                    (seconds from dispatch to response) and `error`
+        """
+
+        results = []
+        for intent in intents:
+            transaction = intent.get('transaction')
+            results.append({
+                'symbol': (intent.get('instrument') or {}).get('symbol'),
+                'side': transaction.value if isinstance(transaction, Transaction) else transaction,
+                'quantity': intent.get('quantity', 1),
+                'id': None,
+                'state': None,
+                'latency': None,
+                'error': None,
+            })
+
+        checked = self.pretrade.check_all([intent_order(intent) for intent in intents])
+        for result, (_, error) in zip(results, checked):
+            if error is not None:
+                result['state'] = 'invalid'
+                result['error'] = error
+
+        if any(result['error'] for result in results):
+            for result in results:
+                if result['state'] is None:
+                    result['state'] = 'not_sent'
+            return results
+
+        # unpriced orders share one bulk quote fetch under `rate_limiter`
+        unpriced = set(intent['instrument']['symbol'] for intent in intents if not intent.get('price'))
+        quotes = QuotePoller(self).fetch(unpriced) if unpriced else {}
+
+        def send(intent):
+            quote = quotes.get(intent['instrument']['symbol'])
+            payload = self.order_payload(quote=quote, **intent)
+            start = time.time()
+            res = self.post_order(payload, quote)
+            latency = time.time() - start
+            try:
+                data = res.json()
+            except ValueError:
+                data = {}
+            return res, data, latency
+
+        for result, (outcome, ex) in zip(results, dispatch(send, intents, max_workers, self.order_rate_limiter)):
+            if ex is not None:
+                result['state'] = 'error'
+                result['error'] = repr(ex)
+                continue
+
+            res, data, result['latency'] = outcome
+            if res.status_code in (200, 201):
+                result['id'] = data.get('id')
+                result['state'] = data.get('state')
+            else:
+                result['state'] = 'rejected'
+                result['error'] = data.get('detail') or data.get('non_field_errors') or str(res.status_code)
+
+        return results
+
     ##############################
     #GET OPEN ORDER(S)
     ##############################
 
     def get_open_orders(self):
         """
-        Returns all currently open (cancellable) orders.
-        If not orders are currently open, `None` is returned.
-        TODO: Is there a way to get these from the API endpoint without stepping through order history?
+        Returns all currently open (cancellable) orders, newest first.
+        The first call pages order history only until it is past the oldest
+        order that can still be open, later ones only fetch orders updated
+        since, see `orders.OpenOrderTracker`.
+        """
+
+        return self.order_tracker.refresh()
+
+    def filter_orders(self, orders, instruments=None, side=None, older_than=None):
+        """Select orders by instrument, side and age
+
+            Args:
+                orders (list): order dicts, e.g. from `get_open_orders`
+                instruments (list, optional): instrument URLs to keep
+                side (str, optional): 'buy' or 'sell'
+                older_than (float, optional): keep orders created at least
+                    this many seconds ago
+
+            Returns:
+                (:obj:`list`): matching orders
         """
 
-        open_orders = []
-        orders = self.order_history()
-        for order in orders['results']:
-            if(order['cancel'] is not None):
-                open_orders.append(order)
+        if instruments is not None:
+            instruments = set(unquote(url) for url in instruments)
+
+        now = time.time()
+        selected = []
+        for order in orders:
+            if instruments is not None and unquote(order['instrument']) not in instruments:
+                continue
+            if side is not None and order['side'] != side.lower():
+                continue
+            if older_than is not None:
+                created = dateutil.parser.parse(order['created_at']).timestamp()
+                if now - created < older_than:
+                    continue
+            selected.append(order)
+
+        return selected
+
+    def cancel_orders(self, orders, max_workers=8):
+        """Cancel many open orders concurrently
+
+            Uses the `cancel` URL already present on each open order, so
+            every cancel is a single POST, dispatched under
+            `order_rate_limiter`.
+
+            Args:
+                orders (list): open order dicts, e.g. from `get_open_orders`
+                max_workers (int): concurrent requests
+
+            Returns:
+                (:obj:`list`): one dict per order, in input order, with
+                    `id`, `instrument`, `side`, `cancelled` (bool),
+                    `latency` (seconds) and `error`
+        """
+
+        def cancel(order):
+            if not order.get('cancel'):
+                raise ValueError('Order is not cancellable')
+            start = time.time()
+            res = self.post_cancel(order['id'], order['cancel'])
+            latency = time.time() - start
+            res.raise_for_status()
+            return latency
+
+        results = []
+        for order, (latency, ex) in zip(orders, dispatch(cancel, orders, max_workers, self.order_rate_limiter)):
+            results.append({
+                'id': order['id'],
+                'instrument': order['instrument'],
+                'side': order['side'],
+                'cancelled': ex is None,
+                'latency': latency,
+                'error': None if ex is None else repr(ex),
+            })
+
+        return results
+
+    def cancel_open_orders(self, instruments=None, side=None, older_than=None, max_workers=8):
+        """Cancel every open order matching the filters of `filter_orders`
+
+            Returns:
+                (:obj:`list`): per-order outcomes from `cancel_orders`
+        """
 
-        return open_orders
+        orders = self.filter_orders(self.get_open_orders(), instruments, side, older_than)
+        results = self.cancel_orders(orders, max_workers)
+        self.order_tracker.discard([result['id'] for result in results if result['cancelled']])
+        return results
 
     ##############################
     #                          CANCEL ORDER
@@ -1699,19 +1951,19 @@ class Robinhood:
         """
         if isinstance(order_id, str):
             try:
-                order = self.session.get(endpoints.orders() + order_id, timeout=15).json()
+                order = self.get_order(order_id)
             except (requests.exceptions.HTTPError) as err_msg:
                 raise ValueError('Failed to get Order for ID: ' + order_id
                     + '\n Error message: '+ repr(err_msg))
 
             if order.get('cancel') is not None:
                 try:
-                    res = self.session.post(order['cancel'], timeout=15)
+                    res = self.post_cancel(order_id, order['cancel'])
                     res.raise_for_status()
                     return res
                 except (requests.exceptions.HTTPError) as err_msg:
                     try: #sometimes Robinhood asks for another log in when placing an order
-                        res = self.session.post(order['cancel'], headers=self.headers, timeout=15)
+                        res = self.post_cancel(order_id, order['cancel'], headers=self.headers)
                         res.raise_for_status()
                         return res
                     except (requests.exceptions.HTTPError) as err_msg:
@@ -1722,19 +1974,19 @@ class Robinhood:
         elif isinstance(order_id, dict):
             order_id = order_id['id']
             try:
-                order = self.session.get(endpoints.orders() + order_id, timeout=15).json()
+                order = self.get_order(order_id)
             except (requests.exceptions.HTTPError) as err_msg:
                 raise ValueError('Failed to get Order for ID: ' + order_id
                     + '\n Error message: '+ repr(err_msg))
 
             if order.get('cancel') is not None:
                 try:
-                    res = self.session.post(order['cancel'], timeout=15)
+                    res = self.post_cancel(order_id, order['cancel'])
                     res.raise_for_status()
                     return res
                 except (requests.exceptions.HTTPError) as err_msg:
                     try: #sometimes Robinhood asks for another log in when placing an order
-                        res = self.session.post(order['cancel'], headers=self.headers, timeout=15)
+                        res = self.post_cancel(order_id, order['cancel'], headers=self.headers)
                         res.raise_for_status()
                         return res
                     except (requests.exceptions.HTTPError) as err_msg:
@@ -0,0 +1,311 @@
+"""alerts.py: price, percent-move and spread alerts
+
+`AlertEngine` is a `quotes.QuotePoller` listener, and can also be fed quote
+dicts directly, e.g. the results of `get_stock_marketdata`. Alerts fire once
+and are passed to every notifier::
+
+    engine = AlertEngine('alerts.data', [BellNotifier(), FileNotifier('alerts.log')])
+    engine.add('AAPL', 'above', 200)
+    poller.subscribe(engine)
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import requests
+
+from .quotes import Levels
+
+KINDS = ('above', 'below', 'move', 'spread')
+
+
+class BellNotifier:
+    """Ring the terminal bell and print the alert """
+
+    def notify(self, alert, message):
+        print('\a\n[alert] ' + message)
+
+
+class FileNotifier:
+    """Append alerts to a log file, one line each """
+
+    def __init__(self, path='alerts.log'):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def notify(self, alert, message):
+        line = time.strftime('%Y-%m-%d %H:%M:%S') + ' ' + message + '\n'
+        with self.lock, open(self.path, 'a') as log_file:
+            log_file.write(line)
+
+
+class WebhookNotifier:
+    """POST alerts as JSON to a URL
+
+        The body is the alert dict plus `message`. Failures are logged and
+        otherwise ignored, an unreachable hook never blocks other notifiers.
+    """
+
+    logger = logging.getLogger('Robinhood')
+
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+
+    def notify(self, alert, message):
+        body = dict(alert, message=message)
+        try:
+            requests.post(self.url, json=body, timeout=self.timeout).raise_for_status()
+        except requests.exceptions.RequestException as ex:
+            self.logger.warning('alert webhook failed: %r', ex)
+
+
+def _float(quote, field):
+    try:
+        return float(quote[field])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def describe(alert):
+    """One line description of an alert """
+
+    if alert['kind'] == 'move':
+        move = ('{:+g}' if alert['signed'] else '+/-{:g}').format(alert['value'])
+        return '{} move {}% from {:.2f}'.format(alert['symbol'], move, alert['reference'])
+    if alert['kind'] == 'spread':
+        unit = 'bps' if alert['bps'] else ''
+        return '{} spread {:g}{}'.format(alert['symbol'], alert['value'], unit)
+
+    return '{} {} {:.2f}'.format(alert['symbol'], alert['kind'], alert['value'])
+
+
+class AlertEngine:
+    """One-shot alerts indexed by threshold
+
+        Thresholds are turned into absolute levels when an alert is added,
+        so per symbol there are three sorted `quotes.Levels`: upper price
+        levels, lower price levels and spread levels (dollars and basis
+        points of the mid kept apart). A quote pops only the levels it
+        crossed; alerts that did not cross are never looked at.
+
+        * 'above' / 'below': last trade price at or above / below `value`
+        * 'move': price moved `value` percent from `reference`, the
+          previous close when added. Unsigned moves alert either way.
+        * 'spread': ask - bid at or above `value` dollars, or basis points
+          of the mid with `bps`
+    """
+
+    logger = logging.getLogger('Robinhood')
+
+    def __init__(self, path='alerts.data', notifiers=None, price_field='last_trade_price'):
+        self.path = path
+        self.notifiers = list(notifiers or [])
+        self.price_field = price_field
+
+        self.alerts = {}
+        self.upper = {}
+        self.lower = {}
+        self.spreads = {}
+        self.lock = threading.RLock()
+
+        self.load()
+
+    def add_notifier(self, notifier):
+        """Add an object with notify(alert, message) """
+
+        self.notifiers.append(notifier)
+
+    def load(self):
+        """Read alerts saved by `save`, replacing the ones in memory """
+
+        try:
+            with open(self.path) as alerts_file:
+                alerts = json.load(alerts_file)
+        except (IOError, OSError, ValueError):
+            alerts = []
+
+        with self.lock:
+            self.alerts = {}
+            self.upper, self.lower, self.spreads = {}, {}, {}
+            for alert in alerts:
+                self._index(alert)
+
+    def save(self):
+        """Write all alerts atomically """
+
+        with self.lock:
+            data = json.dumps(self.list())
+
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as alerts_file:
+            alerts_file.write(data)
+        os.replace(tmp, self.path)
+
+    def _levels(self, alert):
+        """(index, key, level) entries of an alert """
+
+        symbol = alert['symbol']
+        if alert['kind'] == 'above':
+            return [(self.upper, symbol, alert['value'])]
+        if alert['kind'] == 'below':
+            return [(self.lower, symbol, alert['value'])]
+        if alert['kind'] == 'spread':
+            return [(self.spreads, (symbol, alert['bps']), alert['value'])]
+
+        entries = []
+        move = alert['value'] / 100.0
+        if alert['signed'] is False or move > 0:
+            entries.append((self.upper, symbol, alert['reference'] * (1.0 + abs(move))))
+        if alert['signed'] is False or move < 0:
+            entries.append((self.lower, symbol, alert['reference'] * (1.0 - abs(move))))
+        return entries
+
+    def _index(self, alert):
+        self.alerts[alert['id']] = alert
+        for index, key, level in self._levels(alert):
+            index.setdefault(key, Levels()).add(level, alert['id'])
+
+    def _unindex(self, alert):
+        self.alerts.pop(alert['id'], None)
+        for index, key, level in self._levels(alert):
+            if key in index:
+                index[key].remove(level, alert['id'])
+                if not len(index[key]):
+                    del index[key]
+
+    def add(self, symbol, kind, value, reference=None, signed=True, bps=False):
+        """Add an alert
+
+            Args:
+                symbol (str): stock ticker
+                kind (str): one of `KINDS`
+                value (float): price, percent move or spread threshold
+                reference (float, optional): base price of a 'move' alert
+                signed (bool): a 'move' only alerts in the direction of the
+                    sign of `value`, otherwise either way
+                bps (bool): a 'spread' threshold is in basis points of the mid
+
+            Returns:
+                (:obj:`dict`): the alert
+        """
+
+        if kind not in KINDS:
+            raise ValueError('Alert kind must be one of ' + ', '.join(KINDS))
+        value = float(value)
+        if kind == 'move' and (not reference or value == 0):
+            raise ValueError('Move alert needs a reference price and a non-zero move')
+        if kind != 'move' and value <= 0:
+            raise ValueError('Alert threshold must be positive')
+
+        alert = {
+            'id': uuid.uuid4().hex,
+            'symbol': symbol.upper(),
+            'kind': kind,
+            'value': value,
+            'reference': reference,
+            'signed': bool(signed),
+            'bps': bool(bps),
+            'created_at': time.time(),
+        }
+        with self.lock:
+            self._index(alert)
+        self.save()
+
+        return alert
+
+    def remove(self, alert_id):
+        """Remove an alert
+
+            Returns:
+                (:obj:`dict`): the removed alert, or None if unknown
+        """
+
+        with self.lock:
+            alert = self.alerts.get(alert_id)
+            if alert is not None:
+                self._unindex(alert)
+        if alert is not None:
+            self.save()
+
+        return alert
+
+    def list(self):
+        """Alerts, oldest first """
+
+        with self.lock:
+            return sorted(self.alerts.values(), key=lambda a: a['created_at'])
+
+    def symbols(self):
+        """Symbols with alerts, polled by the `QuotePoller` """
+
+        with self.lock:
+            return set(alert['symbol'] for alert in self.alerts.values())
+
+    def _crossed(self, symbol, quote):
+        """(alert id, observed value) for every level the quote crossed """
+
+        crossed = []
+        price = _float(quote, self.price_field)
+        if price:
+            if symbol in self.upper:
+                crossed += [(i, price) for i in self.upper[symbol].pop_at_or_below(price)]
+            if symbol in self.lower:
+                crossed += [(i, price) for i in self.lower[symbol].pop_at_or_above(price)]
+
+        bid, ask = _float(quote, 'bid_price'), _float(quote, 'ask_price')
+        if bid and ask:
+            spread = ask - bid
+            if (symbol, False) in self.spreads:
+                crossed += [(i, spread) for i in self.spreads[(symbol, False)].pop_at_or_below(spread)]
+            if (symbol, True) in self.spreads:
+                spread_bps = spread / ((ask + bid) / 2.0) * 1e4
+                crossed += [(i, spread_bps) for i in self.spreads[(symbol, True)].pop_at_or_below(spread_bps)]
+
+        return crossed
+
+    def on_quotes(self, quotes, now=None):
+        """Check quotes and notify for every alert that fired
+
+            Args:
+                quotes (:obj:`dict` or list): symbol -> quote, or a list of
+                    quote dicts with `symbol` as returned by
+                    `get_stock_marketdata`
+
+            Returns:
+                (:obj:`list`): the alerts that fired
+        """
+
+        if not isinstance(quotes, dict):
+            quotes = dict((quote['symbol'], quote) for quote in quotes if quote)
+        now = now or time.time()
+
+        fired = []
+        with self.lock:
+            for symbol, quote in quotes.items():
+                for alert_id, observed in self._crossed(symbol, quote):
+                    alert = self.alerts.get(alert_id)
+                    if alert is None:
+                        continue  # an unsigned move already fired on its other side
+                    self._unindex(alert)
+                    alert['observed'] = observed
+                    alert['fired_at'] = now
+                    fired.append(alert)
+
+        if not fired:
+            return fired
+
+        self.save()
+        for alert in fired:
+            message = describe(alert) + ' (now {:.2f})'.format(alert['observed'])
+            for notifier in self.notifiers:
+                try:
+                    notifier.notify(alert, message)
+                except Exception as ex:
+                    self.logger.warning('alert notifier failed: %r', ex)
+
+        return fired
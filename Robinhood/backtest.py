@@ -0,0 +1,216 @@
+"""backtest.py: vectorized backtests over locally stored bars
+
+Two ways to run a strategy against bars from a `bars.BarStore`:
+
+* `run` takes target positions as an array shaped (..., symbols, bars).
+  Leading axes are parameter sets, so a whole parameter grid is one call.
+  Targets decided on a bar's close are traded at the next bar's open.
+
+* `simulate` takes order intents, dicts of `Robinhood.place_order` keyword
+  arguments, and fills market, limit and stop orders against the following
+  bars. The same intents can later go to the live client unchanged::
+
+      client.place_order(**intent)
+"""
+
+import numpy as np
+
+from .Robinhood import Transaction
+
+PRICE_COLUMNS = ('open', 'high', 'low', 'close')
+
+
+def _ffill(matrix):
+    """Forward fill NaN along the last axis """
+
+    idx = np.where(np.isnan(matrix), 0, np.arange(matrix.shape[-1]))
+    np.maximum.accumulate(idx, axis=-1, out=idx)
+    return np.take_along_axis(matrix, idx, axis=-1)
+
+
+def align(bars_by_symbol):
+    """Align bars of several symbols on one timeline
+
+        Args:
+            bars_by_symbol (:obj:`dict`): symbol -> bar columns
+
+        Returns:
+            (:obj:`dict`): `symbols` (list), `begins_at` (T,) and one
+                (symbols, T) float64 matrix per price column. Bars missing
+                for a symbol repeat its previous close.
+    """
+
+    symbols = sorted(bars_by_symbol)
+    stamps = [np.asarray(bars_by_symbol[s]['begins_at']) for s in symbols]
+    begins_at = np.unique(np.concatenate(stamps)) if stamps else np.empty(0, dtype='datetime64[s]')
+
+    market = {'symbols': symbols, 'begins_at': begins_at}
+    for col in PRICE_COLUMNS:
+        market[col] = np.full((len(symbols), len(begins_at)), np.nan)
+
+    for i, symbol in enumerate(symbols):
+        pos = np.searchsorted(begins_at, stamps[i])
+        for col in PRICE_COLUMNS:
+            market[col][i, pos] = bars_by_symbol[symbol][col]
+
+    close = _ffill(market['close'])
+    for col in PRICE_COLUMNS:
+        market[col] = np.where(np.isnan(market[col]), close, market[col])
+
+    return market
+
+
+def _account(market, position, trades, flows, orders, commission):
+    """Cash and equity paths from positions and per-bar traded value """
+
+    cash = -np.cumsum(np.nan_to_num(flows) + commission * orders, axis=-1)
+    equity = cash + np.nan_to_num(position * market['close'])
+
+    return {
+        'position': position,
+        'trades': trades,
+        'cash': cash,
+        'equity': equity,
+        'pnl': equity[..., -1] if equity.shape[-1] else np.zeros(equity.shape[:-1]),
+        'orders': orders.sum(axis=-1),
+    }
+
+
+def run(market, targets, commission=0.0, slippage=0.0):
+    """Backtest target positions
+
+        Args:
+            market (:obj:`dict`): output of `align`
+            targets (:obj:`numpy.ndarray`): shares wanted after each bar's
+                close, shaped (..., symbols, bars)
+            commission (float): flat cost per order
+            slippage (float): fraction of the open price paid per trade
+
+        Returns:
+            (:obj:`dict`): `position`, `trades`, `cash` and `equity` paths
+                shaped like `targets`, `pnl` and `orders` per symbol
+    """
+
+    targets = np.asarray(targets, dtype='f8')
+
+    position = np.zeros(targets.shape)
+    position[..., 1:] = targets[..., :-1]
+    trades = np.diff(position, axis=-1, prepend=0.0)
+
+    price = market['open'] * (1.0 + slippage * np.sign(trades))
+
+    return _account(market, position, trades, trades * price, (trades != 0).astype('f8'), commission)
+
+
+def _side(intent):
+    transaction = intent.get('transaction')
+    if isinstance(transaction, str):
+        transaction = Transaction(transaction)
+
+    return 1 if transaction == Transaction.BUY else -1
+
+
+def fill(market, row, start, intent, slippage=0.0):
+    """Find where an order intent fills
+
+        Args:
+            market (:obj:`dict`): output of `align`
+            row (int): symbol row in `market`
+            start (int): first bar the order can fill on
+            intent (:obj:`dict`): `Robinhood.place_order` keyword arguments
+
+        Returns:
+            (:obj:`tuple`): (bar index, fill price) or None if unfilled
+    """
+
+    n = len(market['begins_at'])
+    if start >= n:
+        return None
+
+    stop = n
+    if str(intent.get('time_in_force', 'gfd')).lower() == 'gfd':
+        days = market['begins_at'].astype('datetime64[D]')
+        stop = np.searchsorted(days, days[start], side='right')
+
+    side = _side(intent)
+    order = str(intent.get('order', 'market')).lower()
+    price = float(intent.get('price') or 0.0)
+
+    opens = market['open'][row, start:stop]
+    highs = market['high'][row, start:stop]
+    lows = market['low'][row, start:stop]
+
+    if order == 'market' or (order == 'limit' and not price):
+        return start, opens[0] * (1.0 + slippage * side)
+
+    if order == 'limit':
+        hit = lows <= price if side > 0 else highs >= price
+    elif order == 'stop':
+        hit = highs >= price if side > 0 else lows <= price
+    else:
+        raise ValueError('Invalid order in intent: ' + order)
+
+    if not hit.any():
+        return None
+
+    i = int(np.argmax(hit))
+    if order == 'limit':
+        # gapping through the limit fills at the better open
+        fill_price = min(opens[i], price) if side > 0 else max(opens[i], price)
+    else:
+        fill_price = max(opens[i], price) if side > 0 else min(opens[i], price)
+        fill_price *= 1.0 + slippage * side
+
+    return start + i, fill_price
+
+
+def simulate(market, intents, commission=0.0, slippage=0.0):
+    """Backtest a list of order intents
+
+        Args:
+            market (:obj:`dict`): output of `align`
+            intents (list): (bar index, intent) pairs, the intent is sent
+                after that bar closes and can fill from the next bar on
+            commission (float): flat cost per filled order
+            slippage (float): fraction of price paid on market/stop fills
+
+        Returns:
+            (:obj:`dict`): same paths as `run` plus `fills`, a list of
+                dicts with `intent`, `index`, `symbol`, `side`, `quantity`
+                and `price`
+    """
+
+    rows = {symbol: i for i, symbol in enumerate(market['symbols'])}
+    shape = market['close'].shape
+    trades = np.zeros(shape)
+    cost = np.zeros(shape)
+    orders = np.zeros(shape)
+
+    fills = []
+    for index, intent in intents:
+        symbol = intent['instrument']['symbol'].upper()
+        row = rows[symbol]
+        result = fill(market, row, index + 1, intent, slippage)
+        if result is None:
+            continue
+
+        at, price = result
+        quantity = _side(intent) * float(intent.get('quantity', 1))
+        trades[row, at] += quantity
+        cost[row, at] += quantity * price
+        orders[row, at] += 1
+        fills.append({
+            'intent': intent,
+            'index': at,
+            'symbol': symbol,
+            'side': 'buy' if quantity > 0 else 'sell',
+            'quantity': abs(quantity),
+            'price': price,
+        })
+
+    position = np.cumsum(trades, axis=-1)
+
+    result = _account(market, position, trades, cost, orders, commission)
+    result['fills'] = fills
+
+    return result
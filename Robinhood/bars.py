@@ -0,0 +1,325 @@
+"""bars.py: local columnar store for bars from the `historicals` endpoint
+
+Bars are kept on disk as one `.npy` file per column, per interval/bounds and
+symbol::
+
+    <root>/<interval>_<bounds>/<SYMBOL>/begins_at.npy
+    <root>/<interval>_<bounds>/<SYMBOL>/open.npy
+    ...
+
+Reads memory-map the column files, so a range query is a `searchsorted` on
+`begins_at` followed by zero-copy slices of every column.
+"""
+
+import logging
+import os
+
+import numpy as np
+
+from . import exceptions as RH_exception
+from .Robinhood import Bounds
+from .ratelimit import dispatch
+
+logger = logging.getLogger('Robinhood')
+
+COLUMNS = ('begins_at', 'open', 'high', 'low', 'close', 'volume')
+
+DTYPES = {
+    'begins_at': 'datetime64[s]',
+    'open': 'f8',
+    'high': 'f8',
+    'low': 'f8',
+    'close': 'f8',
+    'volume': 'i8',
+}
+
+# Length of every `span` accepted by the `historicals` endpoint
+SPANS = {
+    'day': np.timedelta64(1, 'D'),
+    'week': np.timedelta64(7, 'D'),
+    'month': np.timedelta64(31, 'D'),
+    '3month': np.timedelta64(92, 'D'),
+    'year': np.timedelta64(366, 'D'),
+    '5year': np.timedelta64(5 * 366, 'D'),
+}
+
+# Spans the endpoint serves for each interval, shortest first
+INTERVAL_SPANS = {
+    '5minute': ('day', 'week'),
+    '10minute': ('day', 'week'),
+    'hour': ('week', 'month', '3month'),
+    'day': ('week', 'month', '3month', 'year', '5year'),
+    'week': ('year', '5year'),
+}
+
+
+def empty_bars():
+    """Returns a dict of zero-length bar columns """
+
+    return {col: np.empty(0, dtype=DTYPES[col]) for col in COLUMNS}
+
+
+def historicals_to_bars(historicals):
+    """Convert `historicals` records into bar columns
+
+        Args:
+            historicals (list): `historicals` list of one result from the
+                `historicals` endpoint
+
+        Returns:
+            (:obj:`dict`): column name -> :obj:`numpy.ndarray`, sorted by
+                `begins_at`
+    """
+
+    if not historicals:
+        return empty_bars()
+
+    bars = {
+        # numpy does not parse the trailing 'Z', timestamps are all UTC
+        'begins_at': np.array([h['begins_at'].rstrip('Z') for h in historicals],
+                              dtype=DTYPES['begins_at']),
+        'open': np.array([h['open_price'] for h in historicals], dtype=DTYPES['open']),
+        'high': np.array([h['high_price'] for h in historicals], dtype=DTYPES['high']),
+        'low': np.array([h['low_price'] for h in historicals], dtype=DTYPES['low']),
+        'close': np.array([h['close_price'] for h in historicals], dtype=DTYPES['close']),
+        'volume': np.array([h['volume'] for h in historicals], dtype=DTYPES['volume']),
+    }
+
+    order = np.argsort(bars['begins_at'], kind='stable')
+    return {col: bars[col][order] for col in COLUMNS}
+
+
+def merge_bars(old, new):
+    """Merge two sets of bar columns, `new` wins on duplicate timestamps
+
+        Returns:
+            (:obj:`dict`): merged columns sorted by `begins_at`
+    """
+
+    combined = {col: np.concatenate((new[col], old[col])) for col in COLUMNS}
+
+    # np.unique keeps the first occurrence, which is the one from `new`
+    _, keep = np.unique(combined['begins_at'], return_index=True)
+    return {col: combined[col][keep] for col in COLUMNS}
+
+
+def span_for_gap(interval, gap, default):
+    """Pick the shortest span for `interval` that covers `gap`
+
+        Args:
+            interval (str): `historicals` interval
+            gap (:obj:`numpy.timedelta64`): time since the last stored bar,
+                or None when nothing is stored
+            default (str): span to use when nothing is stored
+
+        Returns:
+            (str): span to request
+    """
+
+    if gap is None:
+        return default
+
+    spans = INTERVAL_SPANS.get(interval, (default,))
+    for span in spans:
+        if SPANS[span] >= gap:
+            return span
+
+    return spans[-1]
+
+
+def fetch_historicals(client,
+                      symbols,
+                      interval,
+                      span,
+                      bounds=Bounds.REGULAR,
+                      chunk_size=75,
+                      max_workers=4):
+    """Fetch historicals for many symbols in concurrent chunks
+
+        Symbols are split into chunks of `chunk_size` per request and the
+        chunks are fetched concurrently under `client.rate_limiter`. When a
+        chunk fails, each of its symbols is retried on its own so one bad
+        symbol only loses itself.
+
+        Args:
+            client (:obj:`Robinhood`): logged in client
+            symbols (list): stock tickers
+            interval (str): `historicals` interval
+            span (str): `historicals` span
+            bounds (:enum:`Bounds`, optional): 'extended' or 'regular'
+            chunk_size (int): symbols per request
+            max_workers (int): concurrent requests
+
+        Returns:
+            (:obj:`tuple`): (symbol -> bar columns, symbol -> exception)
+    """
+
+    symbols = [symbol.upper() for symbol in symbols]
+    chunks = [symbols[i:i + chunk_size] for i in range(0, len(symbols), chunk_size)]
+
+    def fetch(chunk):
+        return client.get_historical_quotes(chunk, interval, span, bounds)
+
+    bars = {}
+    errors = {}
+
+    def collect(chunk, data):
+        found = set()
+        for result in data.get('results') or []:
+            if not result:
+                continue
+            found.add(result['symbol'])
+            bars[result['symbol']] = historicals_to_bars(result['historicals'])
+        return [symbol for symbol in chunk if symbol not in found]
+
+    retry = []
+    for chunk, (data, ex) in zip(chunks, dispatch(fetch, chunks, max_workers, client.rate_limiter)):
+        if ex is not None:
+            logger.warning('historicals chunk of %d failed, retrying per symbol: %r', len(chunk), ex)
+            retry.extend(chunk)
+        else:
+            for symbol in collect(chunk, data):
+                errors[symbol] = RH_exception.InvalidTickerSymbol(symbol)
+
+    singles = [[symbol] for symbol in retry]
+    for chunk, (data, ex) in zip(singles, dispatch(fetch, singles, max_workers, client.rate_limiter)):
+        if ex is not None:
+            errors[chunk[0]] = ex
+        else:
+            for symbol in collect(chunk, data):
+                errors[symbol] = RH_exception.InvalidTickerSymbol(symbol)
+
+    return bars, errors
+
+
+class BarStore:
+    """Memory-mapped columnar store of `historicals` bars """
+
+    def __init__(self, root='bars'):
+        self.root = root
+
+    def _path(self, symbol, interval, bounds):
+        if isinstance(bounds, str):
+            bounds = Bounds(bounds)
+
+        return os.path.join(self.root,
+                            interval + '_' + bounds.value,
+                            symbol.upper())
+
+    def symbols(self, interval, bounds=Bounds.REGULAR):
+        """Returns the symbols stored for `interval`/`bounds` """
+
+        if isinstance(bounds, str):
+            bounds = Bounds(bounds)
+
+        path = os.path.join(self.root, interval + '_' + bounds.value)
+        if not os.path.isdir(path):
+            return []
+
+        return sorted(os.listdir(path))
+
+    def read(self, symbol, interval, bounds=Bounds.REGULAR, start=None, end=None):
+        """Read stored bars for a symbol
+
+            Args:
+                symbol (str): stock ticker
+                interval (str): `historicals` interval
+                bounds (:enum:`Bounds`, optional): 'extended' or 'regular'
+                start (str or :obj:`numpy.datetime64`, optional): first
+                    `begins_at` to include
+                end (str or :obj:`numpy.datetime64`, optional): `begins_at`
+                    to stop before
+
+            Returns:
+                (:obj:`dict`): column name -> read-only memory-mapped
+                    :obj:`numpy.ndarray` view
+        """
+
+        path = self._path(symbol, interval, bounds)
+        if not os.path.exists(os.path.join(path, 'begins_at.npy')):
+            return empty_bars()
+
+        bars = {col: np.load(os.path.join(path, col + '.npy'), mmap_mode='r')
+                for col in COLUMNS}
+
+        lo = 0
+        hi = len(bars['begins_at'])
+        if start is not None:
+            lo = np.searchsorted(bars['begins_at'], np.datetime64(start, 's'), side='left')
+        if end is not None:
+            hi = np.searchsorted(bars['begins_at'], np.datetime64(end, 's'), side='left')
+
+        return {col: bars[col][lo:hi] for col in COLUMNS}
+
+    def last_timestamp(self, symbol, interval, bounds=Bounds.REGULAR):
+        """Returns `begins_at` of the newest stored bar or None """
+
+        begins_at = self.read(symbol, interval, bounds)['begins_at']
+        if len(begins_at) == 0:
+            return None
+
+        return begins_at[-1]
+
+    def write(self, symbol, interval, bounds, bars):
+        """Merge `bars` into the stored bars for a symbol
+
+            Columns are written to temporary files and swapped in with
+            `os.replace`, so readers never see a half-written store.
+
+            Returns:
+                (int): number of bars stored after the merge
+        """
+
+        path = self._path(symbol, interval, bounds)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        stored = self.read(symbol, interval, bounds)
+        merged = merge_bars(stored, bars)
+        del stored
+
+        for col in COLUMNS:
+            tmp = os.path.join(path, col + '.tmp.npy')
+            np.save(tmp, np.ascontiguousarray(merged[col]))
+            os.replace(tmp, os.path.join(path, col + '.npy'))
+
+        return len(merged['begins_at'])
+
+    def update(self, client, symbols, interval, span, bounds=Bounds.REGULAR):
+        """Fetch and store only the bars newer than what is already stored
+
+            Symbols are grouped by the shortest span that covers the gap
+            since their last stored bar, so a nightly update of an
+            up-to-date store asks for a day or a week instead of `span`.
+
+            Args:
+                client (:obj:`Robinhood`): logged in client
+                symbols (list): stock tickers
+                interval (str): `historicals` interval
+                span (str): span to fetch for symbols with nothing stored
+                bounds (:enum:`Bounds`, optional): 'extended' or 'regular'
+
+            Returns:
+                (:obj:`dict`): symbol -> number of bars stored
+        """
+
+        if isinstance(bounds, str):
+            bounds = Bounds(bounds)
+
+        now = np.datetime64('now', 's')
+        by_span = {}
+        for symbol in symbols:
+            symbol = symbol.upper()
+            last = self.last_timestamp(symbol, interval, bounds)
+            gap = None if last is None else now - last
+            by_span.setdefault(span_for_gap(interval, gap, span), []).append(symbol)
+
+        counts = {}
+        for fetch_span, group in by_span.items():
+            fetched, errors = fetch_historicals(client, group, interval, fetch_span, bounds)
+            for symbol, bars in fetched.items():
+                counts[symbol] = self.write(symbol, interval, bounds, bars)
+            for symbol, ex in errors.items():
+                logger.warning('historicals for %s not updated: %r', symbol, ex)
+
+        return counts
@@ -79,7 +79,9 @@ def watchlists():
 def news(stock):
     return api_url + "/midlands/news/{_stock}/".format(_stock=stock)
 
-def fundamentals(stock):
+def fundamentals(stock=None):
+    if stock is None:
+        return api_url + "/fundamentals/"
     return api_url + "/fundamentals/{_stock}/".format(_stock=stock)
 
 def tags(tag=None):
@@ -0,0 +1,384 @@
+"""export.py: streaming order history, positions and dividends export
+
+An export is a pipeline over pages of raw API dicts, one page in memory at
+a time:
+
+    pages -> instrument symbols (`history.InstrumentResolver`) -> rows -> writer
+
+Pages come from `HistoryStore.iter_orders`, `Robinhood.order_pages` or
+`api_pages`. Rows are one per order, execution, position or dividend (see
+`TABLES`), written as CSV, newline-delimited JSON, or typed columns: Parquet
+through the optional pyarrow, or NumPy `.npz`. Columnar writers write every
+page as one row group, prices as float64, timestamps as datetime64[ns] UTC
+and symbols dictionary-encoded::
+
+    with open('orders.csv', 'w') as out:
+        export_orders(store.iter_orders(), InstrumentResolver(client, store), out)
+    export_orders(store.iter_orders(), resolver, 'orders.parquet', 'parquet')
+"""
+
+import csv
+import json
+import zipfile
+
+import numpy as np
+
+import dateutil.parser
+from dateutil import tz
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+ORDER_FIELDS = ('side', 'symbol', 'shares', 'price', 'date', 'state')
+EXECUTION_FIELDS = ('order_id', 'side', 'symbol', 'shares', 'price', 'date', 'settlement_date')
+POSITION_FIELDS = ('symbol', 'shares', 'average_buy_price', 'created_at', 'updated_at')
+DIVIDEND_FIELDS = ('id', 'symbol', 'shares', 'rate', 'amount', 'state', 'record_date',
+                   'payable_date', 'paid_at')
+FORMATS = ('csv', 'ndjson', 'parquet', 'npz')
+LEVELS = ('orders', 'executions')
+
+# Column types of the columnar formats: 'category' is dictionary-encoded
+TYPES = {
+    'id': 'str',
+    'order_id': 'str',
+    'side': 'category',
+    'symbol': 'category',
+    'state': 'category',
+    'shares': 'float',
+    'price': 'float',
+    'rate': 'float',
+    'amount': 'float',
+    'average_buy_price': 'float',
+    'date': 'timestamp',
+    'created_at': 'timestamp',
+    'updated_at': 'timestamp',
+    'paid_at': 'timestamp',
+    'settlement_date': 'day',
+    'record_date': 'day',
+    'payable_date': 'day',
+}
+
+
+def order_rows(orders, symbols):
+    """One row per order
+
+        Args:
+            orders (list): raw order dicts
+            symbols (dict): instrument URL -> symbol
+    """
+
+    for order in orders:
+        #side: .side,  price: .average_price, shares: .cumulative_quantity, instrument: .instrument, date : .last_transaction_at
+        yield {
+            'side': order['side'],
+            'price': order['average_price'],
+            'shares': order['cumulative_quantity'],
+            'symbol': symbols.get(order['instrument']),
+            'date': order['last_transaction_at'],
+            'state': order['state']
+        }
+
+
+def execution_rows(orders, symbols):
+    """One row per execution, orders without fills yield nothing """
+
+    for order in orders:
+        for execution in order.get('executions') or []:
+            yield {
+                'order_id': order['id'],
+                'side': order['side'],
+                'symbol': symbols.get(order['instrument']),
+                'shares': execution['quantity'],
+                'price': execution['price'],
+                'date': execution['timestamp'],
+                'settlement_date': execution.get('settlement_date'),
+            }
+
+
+def position_rows(positions, symbols):
+    """One row per position """
+
+    for position in positions:
+        yield {
+            'symbol': symbols.get(position['instrument']),
+            'shares': position['quantity'],
+            'average_buy_price': position['average_buy_price'],
+            'created_at': position.get('created_at'),
+            'updated_at': position.get('updated_at'),
+        }
+
+
+def dividend_rows(dividends, symbols):
+    """One row per dividend """
+
+    for dividend in dividends:
+        yield {
+            'id': dividend['id'],
+            'symbol': symbols.get(dividend['instrument']),
+            'shares': dividend['position'],
+            'rate': dividend['rate'],
+            'amount': dividend['amount'],
+            'state': dividend['state'],
+            'record_date': dividend.get('record_date'),
+            'payable_date': dividend.get('payable_date'),
+            'paid_at': dividend.get('paid_at'),
+        }
+
+
+TABLES = {
+    'orders': (order_rows, ORDER_FIELDS),
+    'executions': (execution_rows, EXECUTION_FIELDS),
+    'positions': (position_rows, POSITION_FIELDS),
+    'dividends': (dividend_rows, DIVIDEND_FIELDS),
+}
+
+
+def api_pages(client, data):
+    """Yield `results` of a paged API response and every page after it
+
+        Args:
+            data (dict): first page, e.g. from `positions()` or `dividends()`
+    """
+
+    while True:
+        yield data['results']
+        if not data.get('next'):
+            break
+        data = client.get_url(data['next'])
+
+
+def parse_timestamps(values):
+    """API timestamps as datetime64[ns] UTC, missing ones NaT """
+
+    parsed = []
+    for value in values:
+        if not value:
+            parsed.append('NaT')
+        elif value.endswith('Z'):
+            parsed.append(value[:-1])
+        else:
+            value = dateutil.parser.parse(value)
+            if value.tzinfo is not None:
+                value = value.astimezone(tz.UTC).replace(tzinfo=None)
+            parsed.append(value.isoformat())
+
+    return np.array(parsed, dtype='datetime64[ns]')
+
+
+def _floats(values):
+    return np.array([np.nan if value is None or value == '' else value for value in values], dtype='f8')
+
+
+def typed_column(rows, field):
+    """Column `field` of row dicts as a NumPy array of its `TYPES` type
+
+        'str' and 'category' columns are object arrays of str or None.
+    """
+
+    values = [row[field] for row in rows]
+    kind = TYPES.get(field, 'str')
+    if kind == 'float':
+        return _floats(values)
+    if kind == 'timestamp':
+        return parse_timestamps(values)
+    if kind == 'day':
+        return np.array([value[:10] if value else 'NaT' for value in values], dtype='datetime64[D]')
+
+    return np.array(values, dtype=object)
+
+
+class CsvWriter:
+    """Write rows to a CSV file with a header """
+
+    def __init__(self, out, fields):
+        self.writer = csv.DictWriter(out, fields)
+        self.writer.writeheader()
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        pass
+
+
+class NdjsonWriter:
+    """Write rows as one JSON object per line """
+
+    def __init__(self, out, fields):
+        self.out = out
+
+    def write(self, rows):
+        for row in rows:
+            self.out.write(json.dumps(row) + '\n')
+
+    def close(self):
+        pass
+
+
+class ParquetWriter:
+    """Write rows to a Parquet file, one row group per `write` """
+
+    ARROW_TYPES = {
+        'str': lambda: pa.string(),
+        'category': lambda: pa.dictionary(pa.int32(), pa.string()),
+        'float': lambda: pa.float64(),
+        'timestamp': lambda: pa.timestamp('ns', tz='UTC'),
+        'day': lambda: pa.date32(),
+    }
+
+    def __init__(self, path, fields):
+        if pa is None:
+            raise ImportError('Parquet export needs pyarrow, use the npz format instead')
+
+        self.fields = fields
+        self.schema = pa.schema([(field, self.ARROW_TYPES[TYPES.get(field, 'str')]())
+                                 for field in fields])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, rows):
+        if not rows:
+            return
+
+        arrays = []
+        for field in self.fields:
+            column = typed_column(rows, field)
+            kind = TYPES.get(field, 'str')
+            if kind == 'category':
+                arrays.append(pa.array(column, type=pa.string()).dictionary_encode()
+                              .cast(self.schema.field(field).type))
+            else:
+                arrays.append(pa.array(column, type=self.schema.field(field).type, from_pandas=True))
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class NpzWriter:
+    """Write rows to a NumPy `.npz` archive, one row group per `write`
+
+        Row group `i` of a column is the `<field>.<i>` array. Category
+        columns are stored as int32 `<field>.<i>` codes (-1 for missing)
+        into one `<field>.categories` array written on `close`. Read the
+        archive back with `load_npz`.
+    """
+
+    def __init__(self, path, fields):
+        self.fields = fields
+        self.groups = 0
+        self.categories = dict((field, {}) for field in fields if TYPES.get(field) == 'category')
+        self.archive = zipfile.ZipFile(path, 'w', allowZip64=True)
+
+    def _put(self, name, array):
+        with self.archive.open(name + '.npy', 'w', force_zip64=True) as array_file:
+            np.lib.format.write_array(array_file, array, allow_pickle=False)
+
+    def write(self, rows):
+        if not rows:
+            return
+
+        for field in self.fields:
+            column = typed_column(rows, field)
+            if field in self.categories:
+                codes = self.categories[field]
+                column = np.array([-1 if value is None else codes.setdefault(value, len(codes))
+                                   for value in column], dtype='i4')
+            elif column.dtype == object:
+                column = np.array(['' if value is None else value for value in column], dtype=str)
+            self._put('{}.{}'.format(field, self.groups), column)
+        self.groups += 1
+
+    def close(self):
+        for field, codes in self.categories.items():
+            self._put(field + '.categories', np.array(sorted(codes, key=codes.get), dtype=str))
+        self._put('groups', np.array(self.groups))
+        self.archive.close()
+
+
+def load_npz(path):
+    """Columns of an `NpzWriter` archive, row groups concatenated
+
+        Category columns come back as (codes, categories) tuples.
+    """
+
+    with np.load(path) as archive:
+        groups = int(archive['groups'])
+        fields = sorted(set(name.rsplit('.', 1)[0] for name in archive.files if name != 'groups'))
+
+        columns = {}
+        for field in fields:
+            column = np.concatenate([archive['{}.{}'.format(field, i)] for i in range(groups)]) \
+                if groups else np.empty(0)
+            if field + '.categories' in archive.files:
+                column = (column, archive[field + '.categories'])
+            columns[field] = column
+
+    return columns
+
+
+WRITERS = {'csv': CsvWriter, 'ndjson': NdjsonWriter, 'parquet': ParquetWriter, 'npz': NpzWriter}
+
+
+def export_rows(pages, resolver, out, format='csv', table='orders'):
+    """Stream pages of raw API dicts into `out`
+
+        Each page has its instruments resolved in one batch, is turned into
+        rows and written before the next page is read.
+
+        Args:
+            pages (iterable): lists of raw order, position or dividend dicts
+            resolver (:obj:`history.InstrumentResolver`): instrument symbols
+            out (file or str): open text file for 'csv' and 'ndjson', path
+                for 'parquet' and 'npz'
+            format (str): one of `FORMATS`
+            table (str): one of `TABLES`
+
+        Returns:
+            (int): rows written
+    """
+
+    if format not in FORMATS:
+        raise ValueError('Format must be one of ' + ', '.join(FORMATS))
+    if table not in TABLES:
+        raise ValueError('Table must be one of ' + ', '.join(TABLES))
+
+    rows, fields = TABLES[table]
+    writer = WRITERS[format](out, fields)
+
+    count = 0
+    try:
+        for items in pages:
+            symbols = resolver.resolve([item['instrument'] for item in items])
+            page_rows = list(rows(items, symbols))
+            writer.write(page_rows)
+            count += len(page_rows)
+    finally:
+        writer.close()
+
+    return count
+
+
+def export_file(pages, resolver, path, format='csv', table='orders'):
+    """`export_rows` into the file at `path`, opened as `format` needs """
+
+    if format in ('csv', 'ndjson'):
+        with open(path, 'w') as out:
+            return export_rows(pages, resolver, out, format, table)
+
+    return export_rows(pages, resolver, path, format, table)
+
+
+def export_orders(pages, resolver, out, format='csv', level='orders'):
+    """Stream order history pages into `out`, see `export_rows`
+
+        Args:
+            level (str): one of `LEVELS`
+    """
+
+    if level not in LEVELS:
+        raise ValueError('Level must be one of ' + ', '.join(LEVELS))
+
+    return export_rows(pages, resolver, out, format, level)
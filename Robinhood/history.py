@@ -0,0 +1,572 @@
+"""history.py: local SQLite copy of the order and dividend history
+
+`HistoryStore` keeps every order and its executions keyed by id, dividends
+(synced by `dividends.sync_dividends`), plus the instrument URL -> symbol
+map. `sync_orders` brings it up to date with one `updated_at[gte]` query
+from the last checkpoint, so after the first run a sync only downloads
+orders that changed. Each page is stored together with the pagination
+cursor, so an interrupted sync resumes where it stopped::
+
+    store = HistoryStore('history.db')
+    sync_orders(client, store)
+    rows = store.orders()
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+import requests
+
+from .orders import TERMINAL_STATES, order_time, parse_time
+from .ratelimit import dispatch
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id TEXT PRIMARY KEY,
+    instrument TEXT,
+    symbol TEXT,
+    side TEXT,
+    type TEXT,
+    trigger TEXT,
+    time_in_force TEXT,
+    state TEXT,
+    price REAL,
+    stop_price REAL,
+    quantity REAL,
+    cumulative_quantity REAL,
+    average_price REAL,
+    fees REAL,
+    created_at TEXT,
+    updated_at TEXT,
+    last_transaction_at TEXT,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS orders_created_at ON orders (created_at);
+CREATE INDEX IF NOT EXISTS orders_instrument ON orders (instrument);
+CREATE TABLE IF NOT EXISTS executions (
+    id TEXT PRIMARY KEY,
+    order_id TEXT,
+    price REAL,
+    quantity REAL,
+    timestamp TEXT,
+    settlement_date TEXT
+);
+CREATE INDEX IF NOT EXISTS executions_order_id ON executions (order_id);
+CREATE TABLE IF NOT EXISTS dividends (
+    id TEXT PRIMARY KEY,
+    instrument TEXT,
+    symbol TEXT,
+    amount REAL,
+    rate REAL,
+    position REAL,
+    withholding REAL,
+    state TEXT,
+    record_date TEXT,
+    payable_date TEXT,
+    paid_at TEXT,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS dividends_instrument ON dividends (instrument);
+CREATE INDEX IF NOT EXISTS dividends_payable_date ON dividends (payable_date);
+CREATE TABLE IF NOT EXISTS instruments (
+    url TEXT PRIMARY KEY,
+    symbol TEXT
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+ORDER_COLUMNS = ('id', 'instrument', 'symbol', 'side', 'type', 'trigger', 'time_in_force',
+                 'state', 'price', 'stop_price', 'quantity', 'cumulative_quantity',
+                 'average_price', 'fees', 'created_at', 'updated_at', 'last_transaction_at')
+DIVIDEND_COLUMNS = ('id', 'instrument', 'symbol', 'amount', 'rate', 'position', 'withholding',
+                    'state', 'record_date', 'payable_date', 'paid_at')
+
+# Dividend states that count as received
+RECEIVED_STATES = ('paid', 'reinvested')
+
+# `dividend_totals` groupings, as SQL expressions
+DIVIDEND_GROUPS = {
+    'symbol': 'symbol',
+    'month': 'substr(payable_date, 1, 7)',
+    'year': 'substr(payable_date, 1, 4)',
+}
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _instrument_id(url):
+    return url.rstrip('/').rsplit('/', 1)[-1]
+
+
+class HistoryStore:
+    """SQLite store of orders, executions, dividends and sync checkpoints """
+
+    def __init__(self, path='history.db'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            self.db.executescript(SCHEMA)
+
+    def checkpoint(self, name):
+        """Value saved with `set_checkpoint`, None before the first one """
+
+        with self.lock:
+            row = self.db.execute("SELECT value FROM checkpoints WHERE name = ?", (name,)).fetchone()
+        return row['value'] if row else None
+
+    def set_checkpoints(self, checkpoints):
+        """Save name -> value checkpoints in one transaction, None deletes """
+
+        with self.lock, self.db:
+            self._set_checkpoints(checkpoints)
+
+    def set_checkpoint(self, name, value):
+        self.set_checkpoints({name: value})
+
+    def _set_checkpoints(self, checkpoints):
+        for name, value in checkpoints.items():
+            if value is None:
+                self.db.execute("DELETE FROM checkpoints WHERE name = ?", (name,))
+            else:
+                self.db.execute("INSERT OR REPLACE INTO checkpoints (name, value) VALUES (?, ?)",
+                                (name, value))
+
+    def upsert_orders(self, orders, checkpoints=None):
+        """Insert orders or update them in place, with their executions
+
+            Args:
+                orders (list): order dicts from the `orders` endpoint
+                checkpoints (dict, optional): saved in the same transaction,
+                    see `set_checkpoints`
+
+            Returns:
+                (:obj:`tuple`): (new, updated) counts; orders whose
+                    `updated_at` did not change are neither
+        """
+
+        with self.lock, self.db:
+            self._set_checkpoints(checkpoints or {})
+            if not orders:
+                return 0, 0
+
+            ids = [order['id'] for order in orders]
+            known = dict(self.db.execute(
+                "SELECT id, updated_at FROM orders WHERE id IN (%s)" % ','.join('?' * len(ids)), ids))
+            symbols = dict(self.db.execute(
+                "SELECT url, symbol FROM instruments WHERE url IN (%s)" % ','.join('?' * len(orders)),
+                [order['instrument'] for order in orders]))
+
+            new, updated = 0, 0
+            for order in orders:
+                if order['id'] not in known:
+                    new += 1
+                elif known[order['id']] != order.get('updated_at'):
+                    updated += 1
+                else:
+                    continue
+
+                self.db.execute(
+                    "INSERT OR REPLACE INTO orders (%s, data) VALUES (%s)"
+                    % (', '.join(ORDER_COLUMNS), ', '.join('?' * (len(ORDER_COLUMNS) + 1))),
+                    (order['id'], order['instrument'], symbols.get(order['instrument']),
+                     order.get('side'), order.get('type'), order.get('trigger'),
+                     order.get('time_in_force'), order.get('state'),
+                     _float(order.get('price')), _float(order.get('stop_price')),
+                     _float(order.get('quantity')), _float(order.get('cumulative_quantity')),
+                     _float(order.get('average_price')), _float(order.get('fees')),
+                     order.get('created_at'), order.get('updated_at'),
+                     order.get('last_transaction_at'), json.dumps(order)))
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO executions "
+                    "(id, order_id, price, quantity, timestamp, settlement_date) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(execution['id'], order['id'], _float(execution.get('price')),
+                      _float(execution.get('quantity')), execution.get('timestamp'),
+                      execution.get('settlement_date'))
+                     for execution in order.get('executions') or []])
+
+        return new, updated
+
+    def oldest_live(self):
+        """`created_at` of the oldest order not in a terminal state, or None """
+
+        with self.lock:
+            row = self.db.execute(
+                "SELECT MIN(created_at) AS created_at FROM orders WHERE state NOT IN (%s)"
+                % ','.join('?' * len(TERMINAL_STATES)), TERMINAL_STATES).fetchone()
+        return row['created_at']
+
+    def instrument_symbols(self):
+        """Every known instrument URL -> symbol """
+
+        with self.lock:
+            return dict(self.db.execute("SELECT url, symbol FROM instruments"))
+
+    def unresolved_instruments(self):
+        """Instrument URLs of orders and dividends without a symbol """
+
+        with self.lock:
+            return [row['instrument'] for row in self.db.execute(
+                "SELECT instrument FROM orders WHERE symbol IS NULL "
+                "UNION SELECT instrument FROM dividends WHERE symbol IS NULL")]
+
+    def add_symbols(self, symbols):
+        """Save instrument URL -> symbol pairs and fill in their orders and dividends """
+
+        pairs = [(symbol, url) for url, symbol in symbols.items()]
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO instruments (url, symbol) VALUES (?, ?)",
+                                list(symbols.items()))
+            self.db.executemany("UPDATE orders SET symbol = ? WHERE instrument = ?", pairs)
+            self.db.executemany("UPDATE dividends SET symbol = ? WHERE instrument = ?", pairs)
+
+    def upsert_dividends(self, dividends, checkpoints=None):
+        """Insert dividends or update the ones that changed, see `upsert_orders`
+
+            Returns:
+                (:obj:`tuple`): (new, updated) counts
+        """
+
+        with self.lock, self.db:
+            self._set_checkpoints(checkpoints or {})
+            if not dividends:
+                return 0, 0
+
+            ids = [dividend['id'] for dividend in dividends]
+            known = dict(self.db.execute(
+                "SELECT id, data FROM dividends WHERE id IN (%s)" % ','.join('?' * len(ids)), ids))
+            symbols = dict(self.db.execute(
+                "SELECT url, symbol FROM instruments WHERE url IN (%s)" % ','.join('?' * len(ids)),
+                [dividend['instrument'] for dividend in dividends]))
+
+            new, updated = 0, 0
+            for dividend in dividends:
+                data = json.dumps(dividend, sort_keys=True)
+                if dividend['id'] not in known:
+                    new += 1
+                elif known[dividend['id']] != data:
+                    updated += 1
+                else:
+                    continue
+
+                self.db.execute(
+                    "INSERT OR REPLACE INTO dividends (%s, data) VALUES (%s)"
+                    % (', '.join(DIVIDEND_COLUMNS), ', '.join('?' * (len(DIVIDEND_COLUMNS) + 1))),
+                    (dividend['id'], dividend['instrument'], symbols.get(dividend['instrument']),
+                     _float(dividend.get('amount')), _float(dividend.get('rate')),
+                     _float(dividend.get('position')), _float(dividend.get('withholding')),
+                     dividend.get('state'), dividend.get('record_date'), dividend.get('payable_date'),
+                     dividend.get('paid_at'), data))
+
+        return new, updated
+
+    def dividends(self, state=None):
+        """Dividends as dicts of `DIVIDEND_COLUMNS`, newest payable date first """
+
+        sql = "SELECT %s FROM dividends" % ', '.join(DIVIDEND_COLUMNS)
+        params = ()
+        if state is not None:
+            sql += " WHERE state = ?"
+            params = (state,)
+
+        with self.lock:
+            return [dict(row) for row in self.db.execute(sql + " ORDER BY payable_date DESC", params)]
+
+    def dividend_totals(self, by='symbol', year=None):
+        """Dividends per symbol, month or year of the payable date
+
+            Args:
+                by (str): one of `DIVIDEND_GROUPS`
+                year (int, optional): only dividends payable in this year
+
+            Returns:
+                (:obj:`list`): dicts with `group`, `count` and `received`
+                    (paid or reinvested), `pending` and `withheld` amounts,
+                    ordered by group. Voided dividends are left out.
+        """
+
+        if by not in DIVIDEND_GROUPS:
+            raise ValueError('Group must be one of ' + ', '.join(DIVIDEND_GROUPS))
+
+        received = ','.join('?' * len(RECEIVED_STATES))
+        sql = ("SELECT {group} AS grp, COUNT(*) AS count, "
+               "SUM(CASE WHEN state IN ({received}) THEN amount ELSE 0 END) AS received, "
+               "SUM(CASE WHEN state = 'pending' THEN amount ELSE 0 END) AS pending, "
+               "SUM(COALESCE(withholding, 0)) AS withheld "
+               "FROM dividends WHERE state != 'voided'").format(group=DIVIDEND_GROUPS[by], received=received)
+        params = list(RECEIVED_STATES)
+        if year is not None:
+            sql += " AND substr(payable_date, 1, 4) = ?"
+            params.append(str(year))
+        sql += " GROUP BY grp ORDER BY grp"
+
+        with self.lock:
+            return [{'group': row['grp'], 'count': row['count'], 'received': row['received'],
+                     'pending': row['pending'], 'withheld': row['withheld']}
+                    for row in self.db.execute(sql, params)]
+
+    def orders(self, state=None):
+        """Orders as dicts of `ORDER_COLUMNS`, newest first
+
+            Args:
+                state (str, optional): only orders in this state
+        """
+
+        sql = "SELECT %s FROM orders" % ', '.join(ORDER_COLUMNS)
+        params = ()
+        if state is not None:
+            sql += " WHERE state = ?"
+            params = (state,)
+
+        with self.lock:
+            return [dict(row) for row in self.db.execute(sql + " ORDER BY created_at DESC", params)]
+
+    def iter_orders(self, batch_size=1000, state=None):
+        """Yield lists of at most `batch_size` raw order dicts, newest first
+
+            Orders are read from the database a batch at a time, so memory
+            does not grow with the length of the history.
+        """
+
+        sql = "SELECT data FROM orders"
+        params = ()
+        if state is not None:
+            sql += " WHERE state = ?"
+            params = (state,)
+
+        cursor = self.db.cursor()
+        with self.lock:
+            cursor.execute(sql + " ORDER BY created_at DESC", params)
+        while True:
+            with self.lock:
+                rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [json.loads(row['data']) for row in rows]
+
+    def fills(self):
+        """Every fill as a dict of `order_id`, `symbol`, `side`, `quantity`,
+            `price`, `fees` and `timestamp`, ordered by symbol then time
+
+            Executions are used where stored, otherwise the order's
+            cumulative quantity at its average price. Order fees are split
+            over its executions by quantity.
+        """
+
+        sql = """
+            SELECT o.id AS order_id, o.symbol, o.side, e.quantity, e.price,
+                   COALESCE(o.fees, 0) * e.quantity / o.cumulative_quantity AS fees,
+                   e.timestamp
+            FROM executions e JOIN orders o ON e.order_id = o.id
+            UNION ALL
+            SELECT o.id, o.symbol, o.side, o.cumulative_quantity, o.average_price,
+                   COALESCE(o.fees, 0), o.last_transaction_at
+            FROM orders o
+            WHERE o.cumulative_quantity > 0
+                AND NOT EXISTS (SELECT 1 FROM executions WHERE order_id = o.id)
+            ORDER BY symbol, timestamp
+        """
+        with self.lock:
+            return [dict(row) for row in self.db.execute(sql)]
+
+    def executions(self, order_id=None):
+        """Executions as dicts, oldest first """
+
+        sql = "SELECT * FROM executions"
+        params = ()
+        if order_id is not None:
+            sql += " WHERE order_id = ?"
+            params = (order_id,)
+
+        with self.lock:
+            return [dict(row) for row in self.db.execute(sql + " ORDER BY timestamp", params)]
+
+
+class InstrumentResolver:
+    """Instrument URL -> symbol with a cache in front of batched lookups
+
+        Known symbols come from the store's `instruments` table; unknown
+        URLs are fetched `chunk_size` at a time with `get_instruments`,
+        chunks dispatched under `client.rate_limiter`, and saved back.
+
+        Args:
+            client (:obj:`Robinhood`): used for lookups
+            store (:obj:`HistoryStore`, optional): persistent cache
+    """
+
+    logger = logging.getLogger('Robinhood')
+
+    def __init__(self, client, store=None, chunk_size=50, max_workers=4):
+        self.client = client
+        self.store = store
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.symbols = store.instrument_symbols() if store is not None else {}
+
+    def resolve(self, urls):
+        """Symbols of `urls` as a URL -> symbol dict, looking up unknown ones
+
+            URLs that cannot be resolved are left out.
+        """
+
+        unknown = sorted(set(url for url in urls if url and url not in self.symbols))
+        if unknown:
+            chunks = [unknown[i:i + self.chunk_size] for i in range(0, len(unknown), self.chunk_size)]
+            found = {}
+            for chunk, (results, ex) in zip(chunks, dispatch(self.client.get_instruments, chunks,
+                                                             self.max_workers, self.client.rate_limiter)):
+                if ex is not None:
+                    self.logger.warning('instrument lookup failed for %d urls: %r', len(chunk), ex)
+                    continue
+                # match by id, the API need not keep the order of `ids`
+                by_id = dict((_instrument_id(url), url) for url in chunk)
+                for instrument in results:
+                    if instrument and instrument.get('id') in by_id:
+                        found[by_id[instrument['id']]] = instrument['symbol']
+
+            self.symbols.update(found)
+            if self.store is not None and found:
+                self.store.add_symbols(found)
+
+        return dict((url, self.symbols[url]) for url in urls if url in self.symbols)
+
+
+def resolve_symbols(client, store):
+    """Look up symbols of instruments the store has not seen yet
+
+        Returns:
+            (int): instruments resolved
+    """
+
+    return len(InstrumentResolver(client, store).resolve(store.unresolved_instruments()))
+
+
+def fetch_page(client, url=None, params=None, retries=5, backoff=1.0, page=None):
+    """`client.order_page` that rides out expired tokens, throttling and drops
+
+        A 401 refreshes the token with `relogin_oauth2` once per page. 429s,
+        5xx responses and connection errors are retried up to `retries`
+        times, waiting `Retry-After` or `backoff` doubling each attempt.
+
+        Args:
+            page (callable, optional): page fetcher taking (url, params),
+                e.g. `client.dividend_page`, defaults to `client.order_page`
+    """
+
+    logger = logging.getLogger('Robinhood')
+    page = page or client.order_page
+    relogged = False
+    for attempt in range(retries + 1):
+        try:
+            return page(url, params)
+        except requests.exceptions.HTTPError as ex:
+            status = ex.response.status_code if ex.response is not None else None
+            if status == 401 and not relogged:
+                logger.info('history: token expired, refreshing')
+                client.relogin_oauth2()
+                relogged = True
+                continue
+            if status != 429 and (status is None or status < 500) or attempt == retries:
+                raise
+            wait = backoff * 2 ** attempt
+            try:
+                wait = float(ex.response.headers.get('Retry-After', wait))
+            except (TypeError, ValueError):
+                pass
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt == retries:
+                raise
+            wait = backoff * 2 ** attempt
+
+        logger.warning('history page failed, retrying in %.1fs', wait)
+        time.sleep(wait)
+
+
+def sync_orders(client, store, progress=None):
+    """Bring the store up to date with the server's order history
+
+        The first sync downloads everything. Later ones ask for orders with
+        `updated_at` at or after the checkpoint, and stop paging once a page
+        is older than both the checkpoint and the oldest order that was
+        still live, so they stay cheap even if the server ignores the
+        filter. The checkpoint only moves once every page is stored.
+
+        Each page is committed together with the `next` URL, so if a sync
+        dies part way the next call carries on from the last stored page
+        instead of starting over. Pages are fetched with `fetch_page`.
+
+        Args:
+            progress (callable, optional): called with the stats dict after
+                every page
+
+        Returns:
+            (:obj:`dict`): `pages`, `orders` seen, `new` and `updated`
+                counts, `seconds`, `pages_per_s`, `orders_per_s` and
+                `resumed`
+    """
+
+    run = store.checkpoint('orders_run')
+    if run is not None:
+        run = json.loads(run)
+        url, params = run['next'], None
+    else:
+        cursor = store.checkpoint('orders')
+        if cursor is None:
+            params = None
+            stop_before = None
+        else:
+            params = {'updated_at[gte]': cursor}
+            oldest_live = store.oldest_live()
+            stop_before = parse_time(cursor)
+            if oldest_live is not None:
+                stop_before = min(stop_before, parse_time(oldest_live))
+        run = {'next': None, 'newest': cursor, 'stop_before': stop_before}
+        url = None
+
+    stats = {'pages': 0, 'orders': 0, 'new': 0, 'updated': 0, 'resumed': url is not None}
+    start = time.time()
+    newest_time = None if run['newest'] is None else parse_time(run['newest'])
+    while True:
+        data = fetch_page(client, url, params)
+        results = data['results']
+
+        for order in results:
+            updated_at = order_time(order, 'updated_at')
+            if newest_time is None or updated_at > newest_time:
+                run['newest'], newest_time = order['updated_at'], updated_at
+
+        url, params = data.get('next'), None
+        done = not url or not results or (run['stop_before'] is not None and
+                                          order_time(results[-1]) < run['stop_before'])
+        run['next'] = url
+        if done:
+            checkpoints = {'orders_run': None, 'orders': run['newest']}
+        else:
+            checkpoints = {'orders_run': json.dumps(run)}
+        new, updated = store.upsert_orders(results, checkpoints)
+
+        stats['pages'] += 1
+        stats['orders'] += len(results)
+        stats['new'] += new
+        stats['updated'] += updated
+        stats['seconds'] = max(time.time() - start, 1e-9)
+        stats['pages_per_s'] = stats['pages'] / stats['seconds']
+        stats['orders_per_s'] = stats['orders'] / stats['seconds']
+        if progress is not None:
+            progress(stats)
+
+        if done:
+            return stats
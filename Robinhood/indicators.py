@@ -0,0 +1,235 @@
+"""indicators.py: vectorized technical indicators over bar columns
+
+Every indicator works along the last axis, so a 1-d close series and a 2-d
+(symbols x bars) matrix built with `stack` are computed the same way.
+Values before an indicator has a full window are NaN.
+"""
+
+import numpy as np
+
+# Largest factor a block of the EMA filter may rescale by, see `ema`
+_MAX_SCALE_LOG = 100 * np.log(10)
+
+
+def stack(series):
+    """Stack series of different lengths into one (n, length) matrix
+
+        Shorter series are left padded with NaN so the most recent values
+        line up in the last column.
+
+        Args:
+            series (list): 1-d arrays, e.g. `close` of several symbols
+
+        Returns:
+            (:obj:`numpy.ndarray`): float64 matrix
+    """
+
+    length = max([len(s) for s in series] or [0])
+    out = np.full((len(series), length), np.nan)
+    for i, s in enumerate(series):
+        if len(s):
+            out[i, length - len(s):] = s
+
+    return out
+
+
+def _warmup(out, window):
+    out[..., :window - 1] = np.nan
+    return out
+
+
+def sma(x, window):
+    """Simple moving average from a cumulative sum
+
+        Windows containing NaN, e.g. the padding added by `stack`, are NaN.
+    """
+
+    x = np.asarray(x, dtype='f8')
+    out = np.full(x.shape, np.nan)
+    if x.shape[-1] < window:
+        return out
+
+    missing = np.isnan(x)
+    csum = np.cumsum(np.where(missing, 0.0, x), axis=-1)
+    cmissing = np.cumsum(missing, axis=-1)
+
+    total = csum[..., window - 1:].copy()
+    total[..., 1:] -= csum[..., :-window]
+    gaps = cmissing[..., window - 1:].copy()
+    gaps[..., 1:] -= cmissing[..., :-window]
+
+    out[..., window - 1:] = np.where(gaps == 0, total / window, np.nan)
+
+    return out
+
+
+def ema(x, span=None, alpha=None):
+    """Exponential moving average, seeded with the first value
+
+        Computes the recursive filter y[t] = (1 - alpha) * y[t - 1] +
+        alpha * x[t] without a Python loop per bar: within a block the
+        recursion unrolls to a cumulative sum of x scaled by powers of
+        (1 - alpha). Blocks are sized so the scale stays below 1e100, which
+        means only a handful of blocks even for very long series.
+
+        Args:
+            x (:obj:`numpy.ndarray`): values along the last axis
+            span (int): smoothing span, alpha = 2 / (span + 1)
+            alpha (float): smoothing factor, takes precedence over `span`
+
+        Returns:
+            (:obj:`numpy.ndarray`): float64 array shaped like `x`
+    """
+
+    x = np.asarray(x, dtype='f8')
+    if alpha is None:
+        alpha = 2.0 / (span + 1)
+
+    decay = 1.0 - alpha
+    n = x.shape[-1]
+    if n == 0:
+        return np.empty(x.shape)
+    if decay <= 0:
+        return x.copy()
+
+    # Series left padded with NaN by `stack` are seeded at their first value
+    first = np.argmax(~np.isnan(x), axis=-1)
+    lead = np.arange(n) < first[..., None]
+    if lead.any():
+        x = np.where(lead, np.take_along_axis(x, first[..., None], axis=-1), x)
+
+    block = min(n, max(1, int(_MAX_SCALE_LOG / -np.log(decay))))
+    k = np.arange(block)
+    shrink = decay ** k
+    grow = 1.0 / shrink
+
+    out = np.empty(x.shape)
+    prev = x[..., :1]
+    for start in range(0, n, block):
+        m = min(block, n - start)
+        seg = out[..., start:start + m]
+        np.multiply(x[..., start:start + m], grow[:m], out=seg)
+        np.cumsum(seg, axis=-1, out=seg)
+        seg *= alpha
+        seg += decay * prev
+        seg *= shrink[:m]
+        prev = seg[..., -1:]
+
+    out[lead] = np.nan
+    return out
+
+
+def rolling_std(x, window):
+    """Rolling population standard deviation over strided windows """
+
+    x = np.asarray(x, dtype='f8')
+    out = np.full(x.shape, np.nan)
+    if x.shape[-1] < window:
+        return out
+
+    windows = np.lib.stride_tricks.sliding_window_view(x, window, axis=-1)
+    out[..., window - 1:] = windows.std(axis=-1)
+
+    return out
+
+
+def bollinger(close, window=20, k=2.0):
+    """Bollinger bands
+
+        Returns:
+            (:obj:`tuple`): (lower, middle, upper)
+    """
+
+    middle = sma(close, window)
+    width = k * rolling_std(close, window)
+
+    return middle - width, middle, middle + width
+
+
+def wilder(x, window):
+    """Wilder's moving average, seeded with the mean of the first `window`
+        values and NaN before it
+
+        Leading NaN, e.g. the padding added by `stack`, is skipped: each
+        series is seeded from its own first `window` values.
+    """
+
+    x = np.asarray(x, dtype='f8')
+    n = x.shape[-1]
+    if n < window:
+        return np.full(x.shape, np.nan)
+
+    index = np.arange(n)
+    seed = (np.argmax(~np.isnan(x), axis=-1) + window - 1)[..., None]
+    seed_value = np.take_along_axis(sma(x, window), np.minimum(seed, n - 1), axis=-1)
+
+    seeded = np.where(index < seed, np.nan, np.where(index == seed, seed_value, x))
+    return np.where(index >= seed, ema(seeded, alpha=1.0 / window), np.nan)
+
+
+def rsi(close, window=14):
+    """Relative strength index with Wilder smoothing, see `wilder` """
+
+    close = np.asarray(close, dtype='f8')
+    out = np.full(close.shape, np.nan)
+    if close.shape[-1] <= window:
+        return out
+
+    delta = np.diff(close, axis=-1)
+    gain = wilder(np.clip(delta, 0, None), window)
+    loss = wilder(np.clip(-delta, 0, None), window)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out[..., 1:] = np.where(loss == 0, 100.0, 100.0 - 100.0 / (1.0 + gain / loss))
+
+    return _warmup(out, window + 1)
+
+
+def true_range(high, low, close):
+    """True range, the first bar falls back to high - low """
+
+    high = np.asarray(high, dtype='f8')
+    low = np.asarray(low, dtype='f8')
+    close = np.asarray(close, dtype='f8')
+
+    prev_close = np.concatenate((close[..., :1], close[..., :-1]), axis=-1)
+    return np.maximum(high - low,
+                      np.maximum(np.abs(high - prev_close), np.abs(low - prev_close)))
+
+
+def atr(high, low, close, window=14):
+    """Average true range with Wilder smoothing, see `wilder` """
+
+    return wilder(true_range(high, low, close), window)
+
+
+# name -> (function, bar columns passed positionally, default params)
+INDICATORS = {
+    'sma': (sma, ('close',), (20,)),
+    'ema': (ema, ('close',), (20,)),
+    'rsi': (rsi, ('close',), (14,)),
+    'atr': (atr, ('high', 'low', 'close'), (14,)),
+    'bb': (bollinger, ('close',), (20, 2.0)),
+}
+
+
+def compute(name, bars, *params):
+    """Compute an indicator by name over bar columns
+
+        Args:
+            name (str): one of `INDICATORS`
+            bars (:obj:`dict`): bar columns
+            params: indicator parameters, defaults are used when omitted
+
+        Returns:
+            (:obj:`numpy.ndarray` or :obj:`tuple`): indicator values
+    """
+
+    if name not in INDICATORS:
+        raise ValueError('Unknown indicator: ' + name)
+
+    function, columns, defaults = INDICATORS[name]
+    params = tuple(params) + defaults[len(params):]
+    params = tuple(type(d)(p) for p, d in zip(params, defaults))
+
+    return function(*([bars[col] for col in columns] + list(params)))
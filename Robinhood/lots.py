@@ -0,0 +1,317 @@
+"""lots.py: tax lots and realized P&L over the local order history
+
+`match` pairs sells with the buys they close, per symbol, from fills in a
+`history.HistoryStore`, and returns column arrays for realized lots and for
+lots still open::
+
+    realized, open_lots = match(store.fills(), 'fifo')
+    summary = summarize(realized, open_lots, prices)
+
+FIFO is matched without a Python loop: on cumulative quantity, sell k closes
+the shares between its cumulative bounds, so both sides' cumulative sums
+merged by `searchsorted` give every (buy, sell, quantity) piece at once.
+LIFO and specific identification need a stack per symbol.
+
+The history must start flat (no shares bought before it), and stock splits,
+transfers and option exercises are not accounted for.
+"""
+
+import numpy as np
+
+from .export import parse_timestamps
+
+METHODS = ('fifo', 'lifo', 'specific')
+
+# Gains on shares held longer than this are long term
+LONG_TERM = np.timedelta64(365, 'D')
+
+# A loss is a wash sale if the same symbol was bought this close to the sale
+WASH_WINDOW = np.timedelta64(30, 'D')
+
+REALIZED_COLUMNS = ('symbol', 'quantity', 'buy_order', 'sell_order', 'bought_at', 'sold_at',
+                    'cost', 'proceeds', 'gain', 'days', 'long_term', 'wash_sale')
+OPEN_COLUMNS = ('symbol', 'quantity', 'buy_order', 'bought_at', 'cost')
+
+# Shares below this are float noise
+EPSILON = 1e-9
+
+# Close time of a buy with shares still held, int64 ns
+OPEN = np.iinfo('i8').max
+
+
+def fill_arrays(fills):
+    """Fill dicts from `HistoryStore.fills` as column arrays
+
+        `price` is per share including fees: fees are added to buys and
+        taken off sells.
+    """
+
+    buy = np.array([fill['side'] == 'buy' for fill in fills], dtype=bool)
+    quantity = np.array([fill['quantity'] for fill in fills], dtype='f8')
+    price = np.array([fill['price'] for fill in fills], dtype='f8')
+    fees = np.array([fill['fees'] or 0.0 for fill in fills], dtype='f8')
+
+    return {
+        'symbol': np.array([fill['symbol'] or '' for fill in fills], dtype=object),
+        'order_id': np.array([fill['order_id'] for fill in fills], dtype=object),
+        'buy': buy,
+        'quantity': quantity,
+        'price': price + np.where(buy, fees, -fees) / np.where(quantity > 0, quantity, 1.0),
+        'time': parse_timestamps([fill['timestamp'] for fill in fills]),
+    }
+
+
+def _fifo(buy_quantity, sell_quantity):
+    """(buy index, sell index, quantity) of every FIFO piece
+
+        Args:
+            buy_quantity (:obj:`numpy.ndarray`): quantities of the buys in
+                time order
+            sell_quantity (:obj:`numpy.ndarray`): same for the sells
+    """
+
+    buys = np.cumsum(buy_quantity)
+    sells = np.cumsum(sell_quantity)
+    matched = min(buys[-1] if len(buys) else 0.0, sells[-1] if len(sells) else 0.0)
+
+    bounds = np.union1d(buys, sells)
+    bounds = bounds[bounds <= matched + EPSILON]
+    starts = np.concatenate(([0.0], bounds[:-1]))
+    quantity = bounds - starts
+    keep = quantity > EPSILON
+    starts, quantity = starts[keep], quantity[keep]
+
+    return (np.searchsorted(buys, starts + EPSILON, side='left'),
+            np.searchsorted(sells, starts + EPSILON, side='left'),
+            quantity)
+
+
+def _stack(buy_quantity, sell_quantity, order, method, buy_orders, sell_orders, specific):
+    """(buy index, sell index, quantity) pieces matched by walking the fills
+
+        Args:
+            order (:obj:`numpy.ndarray`): fill sequence as +buy index + 1
+                or -(sell index + 1)
+            specific (dict): sell order id -> buy order ids to close first
+    """
+
+    remaining = list(buy_quantity)
+    open_buys = []
+    head = 0
+    pieces = []
+
+    def take(i, sell, left):
+        quantity = min(left, remaining[i])
+        if quantity > EPSILON:
+            pieces.append((i, sell, quantity))
+            remaining[i] -= quantity
+        return left - quantity
+
+    for step in order:
+        if step > 0:
+            open_buys.append(step - 1)
+            continue
+
+        sell = -step - 1
+        left = sell_quantity[sell]
+        if method == 'lifo':
+            while left > EPSILON and open_buys:
+                left = take(open_buys[-1], sell, left)
+                if remaining[open_buys[-1]] <= EPSILON:
+                    open_buys.pop()
+            continue
+
+        chosen = set(specific.get(sell_orders[sell]) or ())
+        if chosen:
+            for i in open_buys[head:]:
+                if left <= EPSILON:
+                    break
+                if buy_orders[i] in chosen:
+                    left = take(i, sell, left)
+        while left > EPSILON and head < len(open_buys):
+            left = take(open_buys[head], sell, left)
+            if remaining[open_buys[head]] <= EPSILON:
+                head += 1
+
+    if not pieces:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty(0)
+
+    buy_index, sell_index, quantity = zip(*pieces)
+    return np.array(buy_index), np.array(sell_index), np.array(quantity, dtype='f8')
+
+
+def _wash_sales(sold_at, gain, own_order, order_times, order_closed):
+    """Losses with replacement shares: a buy of the symbol within
+        `WASH_WINDOW` of the sale whose shares are still held after it
+
+        Args:
+            own_order (:obj:`numpy.ndarray`): index of the buy order each
+                lot came from, not its own replacement
+            order_times (:obj:`numpy.ndarray`): first fill time of every
+                buy order of the symbol
+            order_closed (:obj:`numpy.ndarray`): time the last share of
+                each buy order was sold, int64 ns, `OPEN` if some are held
+    """
+
+    sold = sold_at.astype('datetime64[ns]').astype('i8')[:, None]
+    bought = order_times.astype('datetime64[ns]').astype('i8')[None, :]
+    window = WASH_WINDOW.astype('timedelta64[ns]').astype('i8')
+
+    # (lot, buy order) pairs; buys after the sale are held after it too
+    replacement = (np.abs(bought - sold) <= window) & (order_closed[None, :] > sold)
+    replacement[np.arange(len(own_order)), own_order] = False
+
+    return (gain < 0) & replacement.any(axis=1)
+
+
+def match(fills, method='fifo', specific=None):
+    """Match sells to buys per symbol
+
+        Args:
+            fills (list): fill dicts from `HistoryStore.fills`
+            method (str): one of `METHODS`
+            specific (dict, optional): for 'specific', sell order id ->
+                buy order ids whose shares that sell closes first; the rest
+                of the sell, and sells not listed, close FIFO
+
+        Returns:
+            (:obj:`tuple`): (realized, open) dicts of column arrays, see
+                `REALIZED_COLUMNS` and `OPEN_COLUMNS`. Money columns
+                include fees.
+    """
+
+    if method not in METHODS:
+        raise ValueError('Method must be one of ' + ', '.join(METHODS))
+
+    data = fill_arrays(fills)
+    by_symbol = np.argsort(data['symbol'].astype(str), kind='stable')
+    data = dict((col, values[by_symbol]) for col, values in data.items())
+    realized = dict((col, []) for col in REALIZED_COLUMNS)
+    open_lots = dict((col, []) for col in OPEN_COLUMNS)
+
+    symbols, starts = np.unique(data['symbol'], return_index=True)
+    ends = np.append(starts[1:], len(data['symbol']))
+    for symbol, start, end in zip(symbols, starts, ends):
+        if not symbol:
+            continue
+        fill = dict((col, values[start:end]) for col, values in data.items())
+        order = np.argsort(fill['time'], kind='stable')
+        fill = dict((col, values[order]) for col, values in fill.items())
+
+        is_buy = fill['buy']
+        buy = dict((col, values[is_buy]) for col, values in fill.items())
+        sell = dict((col, values[~is_buy]) for col, values in fill.items())
+
+        if method == 'fifo':
+            buy_index, sell_index, quantity = _fifo(buy['quantity'], sell['quantity'])
+        else:
+            steps = np.where(is_buy, np.cumsum(is_buy), -np.cumsum(~is_buy))
+            buy_index, sell_index, quantity = _stack(buy['quantity'], sell['quantity'], steps, method,
+                                                     buy['order_id'], sell['order_id'], specific or {})
+
+        bought_at = buy['time'][buy_index]
+        sold_at = sell['time'][sell_index]
+        cost = quantity * buy['price'][buy_index]
+        proceeds = quantity * sell['price'][sell_index]
+        held = sold_at - bought_at
+
+        left = buy['quantity'] - np.bincount(buy_index, weights=quantity, minlength=len(buy['quantity']))
+
+        # per buy order: first fill time, and when its last share was sold
+        _, first, inverse = np.unique(buy['order_id'], return_index=True, return_inverse=True)
+        inverse = inverse.ravel()
+        order_times = buy['time'][first]
+        closed = np.full(len(left), np.iinfo('i8').min)
+        np.maximum.at(closed, buy_index, sold_at.astype('datetime64[ns]').astype('i8'))
+        closed[left > EPSILON] = OPEN
+        order_closed = np.full(len(first), np.iinfo('i8').min)
+        np.maximum.at(order_closed, inverse, closed)
+
+        realized['symbol'].append(np.full(len(quantity), symbol, dtype=object))
+        realized['quantity'].append(quantity)
+        realized['buy_order'].append(buy['order_id'][buy_index])
+        realized['sell_order'].append(sell['order_id'][sell_index])
+        realized['bought_at'].append(bought_at)
+        realized['sold_at'].append(sold_at)
+        realized['cost'].append(cost)
+        realized['proceeds'].append(proceeds)
+        realized['gain'].append(proceeds - cost)
+        realized['days'].append(held.astype('timedelta64[D]').astype(int))
+        realized['long_term'].append(held > LONG_TERM)
+        realized['wash_sale'].append(_wash_sales(sold_at, proceeds - cost, inverse[buy_index],
+                                                 order_times, order_closed))
+
+        still_open = left > EPSILON
+        open_lots['symbol'].append(np.full(still_open.sum(), symbol, dtype=object))
+        open_lots['quantity'].append(left[still_open])
+        open_lots['buy_order'].append(buy['order_id'][still_open])
+        open_lots['bought_at'].append(buy['time'][still_open])
+        open_lots['cost'].append(left[still_open] * buy['price'][still_open])
+
+    return _concat(realized), _concat(open_lots)
+
+
+def _concat(columns):
+    empty = {
+        'symbol': object, 'buy_order': object, 'sell_order': object, 'bought_at': 'datetime64[ns]',
+        'sold_at': 'datetime64[ns]', 'days': int, 'long_term': bool, 'wash_sale': bool,
+    }
+    return dict((col, np.concatenate(values) if values else np.empty(0, dtype=empty.get(col, 'f8')))
+                for col, values in columns.items())
+
+
+def summarize(realized, open_lots, prices=None, year=None):
+    """Per symbol P&L
+
+        Args:
+            realized, open_lots (dict): from `match`
+            prices (dict, optional): symbol -> current price, for
+                unrealized gains
+            year (int, optional): only count lots sold in this year
+
+        Returns:
+            (:obj:`list`): one dict per symbol with `symbol`,
+                `short_term` and `long_term` realized gains, `wash_sale`
+                (losses disallowed), `open_quantity`, `open_cost`,
+                `unrealized` (None without a price) and `price`
+    """
+
+    prices = prices or {}
+    if year is not None:
+        years = realized['sold_at'].astype('datetime64[Y]').astype(int) + 1970
+        realized = dict((col, values[years == year]) for col, values in realized.items())
+
+    symbols = np.union1d(realized['symbol'].astype(str), open_lots['symbol'].astype(str))
+    index = dict((symbol, i) for i, symbol in enumerate(symbols))
+    r = np.array([index[s] for s in realized['symbol']], dtype=int)
+    o = np.array([index[s] for s in open_lots['symbol']], dtype=int)
+    n = len(symbols)
+
+    def total(at, values):
+        return np.bincount(at, weights=values, minlength=n)
+
+    gain = realized['gain']
+    short_term = total(r, np.where(realized['long_term'], 0.0, gain))
+    long_term = total(r, np.where(realized['long_term'], gain, 0.0))
+    wash_sale = total(r, np.where(realized['wash_sale'], -gain, 0.0))
+    open_quantity = total(o, open_lots['quantity'])
+    open_cost = total(o, open_lots['cost'])
+
+    summary = []
+    for i, symbol in enumerate(symbols):
+        price = prices.get(symbol)
+        unrealized = None
+        if price is not None and open_quantity[i] > EPSILON:
+            unrealized = open_quantity[i] * price - open_cost[i]
+        summary.append({
+            'symbol': symbol,
+            'short_term': short_term[i],
+            'long_term': long_term[i],
+            'wash_sale': wash_sale[i],
+            'open_quantity': open_quantity[i],
+            'open_cost': open_cost[i],
+            'unrealized': unrealized,
+            'price': price,
+        })
+
+    return summary
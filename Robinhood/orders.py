@@ -0,0 +1,334 @@
+"""orders.py: incremental tracking of open orders and order lifecycles"""
+
+import collections
+import logging
+import threading
+import time
+
+from six.moves import queue
+
+import dateutil.parser
+
+# GTC orders expire after 90 days, nothing created earlier can still be open
+GTC_HORIZON = 90 * 24 * 3600
+
+
+def parse_time(value):
+    """Parse an API timestamp into epoch seconds """
+
+    return dateutil.parser.parse(value).timestamp()
+
+
+def order_time(order, field='created_at'):
+    """Epoch seconds of an order timestamp field """
+
+    return parse_time(order[field])
+
+
+def iter_order_pages(client, params=None):
+    """Yield `results` of each `orders` page, newest first """
+
+    return client.order_pages(params)
+
+
+def is_open(order):
+    """An order is open while it can still be cancelled """
+
+    return order.get('cancel') is not None
+
+
+class OpenOrderTracker:
+    """Local view of open orders, kept current with incremental syncs
+
+        The first `refresh` walks order history pages only until it is past
+        the GTC horizon. Later refreshes ask for orders with `updated_at`
+        at or after the newest update already seen and stop paging once a
+        page is older than both that cursor and the oldest live order, so
+        they stay cheap even if the server ignores the filter.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.orders = {}
+        self.cursor = None
+        self.listed = []
+
+    def refresh(self):
+        """Sync with the server
+
+            Returns:
+                (:obj:`list`): open orders, newest first
+        """
+
+        now = time.time()
+        if self.cursor is None:
+            params = None
+            stop_before = now - GTC_HORIZON
+        else:
+            params = {'updated_at[gte]': self.cursor}
+            oldest_live = min([order_time(o) for o in self.orders.values()] or [now])
+            stop_before = min(oldest_live, parse_time(self.cursor))
+
+        newest = self.cursor
+        newest_time = None if newest is None else parse_time(newest)
+        for results in iter_order_pages(self.client, params):
+            for order in results:
+                self.update(order)
+                updated = order_time(order, 'updated_at')
+                if newest_time is None or updated > newest_time:
+                    newest, newest_time = order['updated_at'], updated
+
+            if not results or order_time(results[-1]) < stop_before:
+                break
+
+        self.cursor = newest
+        return self.open_orders()
+
+    def update(self, order):
+        """Apply one order dict to the local view """
+
+        if is_open(order):
+            self.orders[order['id']] = order
+        else:
+            self.orders.pop(order['id'], None)
+
+    def discard(self, order_ids):
+        """Drop orders known to be closed, e.g. after cancelling them """
+
+        for order_id in order_ids:
+            self.orders.pop(order_id, None)
+
+    def open_orders(self):
+        """Open orders from the local view, newest first
+
+            The list is remembered so `by_index` maps the indices shown to
+            the user without refetching.
+        """
+
+        self.listed = sorted(self.orders.values(), key=order_time, reverse=True)
+        return self.listed
+
+    def by_index(self, index):
+        """Order at 1-based `index` of the last `open_orders` listing, or None """
+
+        if 0 < index <= len(self.listed):
+            return self.listed[index - 1]
+        return None
+
+
+# Order states after which nothing changes any more
+TERMINAL_STATES = ('filled', 'cancelled', 'rejected', 'failed')
+
+
+class OrderWatcher:
+    """Follow submitted orders until they are filled, cancelled or rejected
+
+        Each order is polled on its own schedule: `min_interval` right after
+        submission, then `backoff` times its age, capped at `max_interval`.
+        When at least `batch_size` orders are due together they are
+        refreshed with one paged `updated_at[gte]` list call instead of one
+        GET each.
+
+        Events are 'ack', 'partial_fill', 'fill', 'cancel' and 'reject'.
+        Each is passed to the callbacks registered with `on`, from the
+        polling thread, and its local time is kept in the order's record
+        under `times`, next to `submitted_at`. With `max_events` they are
+        also put on the `events` queue as (event, record), for a consumer
+        on another thread; once it holds `max_events` the oldest is dropped.
+        The last `max_finished` orders that reached a terminal state are
+        kept in `finished`.
+    """
+
+    logger = logging.getLogger('Robinhood')
+
+    def __init__(self, client, min_interval=0.5, max_interval=30.0, backoff=0.25, batch_size=3, max_events=0,
+                 max_finished=100):
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.batch_size = batch_size
+        self.max_finished = max_finished
+
+        self.active = {}
+        self.finished = collections.OrderedDict()
+        self.callbacks = []
+        self.events = queue.Queue(max_events) if max_events else None
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def on(self, callback):
+        """Register callback(event, record) for every event """
+
+        self.callbacks.append(callback)
+
+    def watch(self, order, submitted_at=None):
+        """Start following an order
+
+            Args:
+                order (dict or str): order dict as returned by the `orders`
+                    POST, or an order id. Watching an order twice keeps the
+                    first record. The first poll is compared against an
+                    unacknowledged, unfilled order, so an order the POST
+                    already returned filled still gets its 'ack' and 'fill'.
+                submitted_at (float, optional): epoch seconds the order was
+                    sent, defaults to now
+
+            Returns:
+                (:obj:`dict`): the record kept for the order
+        """
+
+        now = time.time()
+        if not isinstance(order, dict):
+            order = {'id': order}
+        order = dict(order, state=None, cumulative_quantity='0')
+
+        with self.lock:
+            if order['id'] in self.active:
+                return self.active[order['id']]
+            if order['id'] in self.finished:
+                return self.finished[order['id']]
+
+        record = {
+            'id': order['id'],
+            'order': order,
+            'submitted_at': submitted_at or now,
+            'times': {},
+            'next_poll': now + self.min_interval,
+        }
+        with self.lock:
+            self.active[order['id']] = record
+
+        return record
+
+    def _interval(self, record, now):
+        age = now - record['submitted_at']
+        return min(self.max_interval, max(self.min_interval, age * self.backoff))
+
+    def _fetch(self, due):
+        if len(due) < self.batch_size:
+            updates = {}
+            for record in due:
+                updates[record['id']] = self.client.get_order(record['id'])
+            return updates
+
+        since = min(due, key=lambda r: r['submitted_at'])
+        stop_before = since['submitted_at'] - 60
+        params = {'updated_at[gte]': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(stop_before))}
+
+        wanted = set(record['id'] for record in due)
+        updates = {}
+        for results in iter_order_pages(self.client, params):
+            for order in results:
+                if order['id'] in wanted:
+                    updates[order['id']] = order
+            if not results or len(updates) == len(wanted) or order_time(results[-1]) < stop_before:
+                break
+
+        return updates
+
+    def _transitions(self, old, new):
+        events = []
+        if old.get('state') in (None, 'unconfirmed') and new.get('state') not in (None, 'unconfirmed'):
+            events.append('ack')
+
+        filled_before = float(old.get('cumulative_quantity') or 0)
+        filled_now = float(new.get('cumulative_quantity') or 0)
+        state = new.get('state')
+        if state == 'filled' and old.get('state') != 'filled':
+            events.append('fill')
+        elif filled_now > filled_before:
+            events.append('partial_fill')
+
+        if state == 'cancelled' and old.get('state') != 'cancelled':
+            events.append('cancel')
+        if state in ('rejected', 'failed') and old.get('state') not in ('rejected', 'failed'):
+            events.append('reject')
+
+        return events
+
+    def _fire(self, event, record):
+        if self.events is not None:
+            while True:
+                try:
+                    self.events.put_nowait((event, record))
+                    break
+                except queue.Full:
+                    try:
+                        self.events.get_nowait()
+                    except queue.Empty:
+                        pass
+        for callback in self.callbacks:
+            try:
+                callback(event, record)
+            except Exception as ex:
+                self.logger.warning('order watcher callback failed: %r', ex)
+
+    def poll(self, now=None):
+        """Refresh every order that is due
+
+            Returns:
+                (:obj:`list`): (event, record) pairs fired by this poll
+        """
+
+        now = now or time.time()
+        with self.lock:
+            due = [r for r in self.active.values() if r['next_poll'] <= now]
+        if not due:
+            return []
+
+        updates = self._fetch(due)
+        seen = time.time()
+
+        fired = []
+        for record in due:
+            new = updates.get(record['id'])
+            if new is not None:
+                for event in self._transitions(record['order'], new):
+                    record['times'].setdefault(event, seen)
+                    fired.append((event, record))
+                record['order'] = new
+
+            record['next_poll'] = seen + self._interval(record, seen)
+            if record['order'].get('state') in TERMINAL_STATES:
+                with self.lock:
+                    self.active.pop(record['id'], None)
+                    self.finished[record['id']] = record
+                    while len(self.finished) > self.max_finished:
+                        self.finished.popitem(last=False)
+
+        for event, record in fired:
+            self._fire(event, record)
+
+        return fired
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                self.poll()
+            except Exception as ex:
+                self.logger.warning('order watcher poll failed: %r', ex)
+
+            with self.lock:
+                upcoming = min([r['next_poll'] for r in self.active.values()] or [time.time() + self.min_interval])
+            self.stopped.wait(max(0.05, min(self.min_interval, upcoming - time.time())))
+
+    def start(self):
+        """Poll in a background daemon thread """
+
+        if self.thread is not None and self.thread.is_alive():
+            return
+
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, name='OrderWatcher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop the background thread """
+
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,477 @@
+"""paper.py: local paper trading behind the `Robinhood` order API
+
+`PaperTrader` is a `Robinhood` whose orders never leave the process. Every
+order path of the client ends in `send_order` / `send_cancel` and every
+order read in `get_order` / `order_page`; those are answered from a local
+book instead, as are `positions`, `securities_owned`, `portfolios`,
+`get_account` and the (always empty) dividends. Return shapes are the API's, including `requests.Response`
+objects from the `place_*` methods, so callers cannot tell the difference.
+
+Orders are matched against quotes, either polled live (it is a
+`quotes.QuotePoller` listener) or replayed::
+
+    trader = PaperTrader(cash=10000, live_quotes=False)
+    trader.on_quotes({'AAPL': quote})
+    trader.place_buy_order({'symbol': 'AAPL', 'url': url}, 10)
+    trader.on_quotes({'AAPL': next_quote})  # confirms and fills the order
+"""
+
+import datetime
+import json
+import threading
+import time
+import uuid
+
+import requests
+
+from . import endpoints
+from .Robinhood import Robinhood
+from .orders import parse_time
+from .quotes import Levels
+
+PAPER_ACCOUNT = endpoints.accounts() + 'PAPER/'
+
+
+def _timestamp(seconds):
+    return datetime.datetime.utcfromtimestamp(seconds).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _response(data, status_code=201, url=None):
+    """A `requests.Response` carrying `data` as its JSON body """
+
+    res = requests.models.Response()
+    res.status_code = status_code
+    res.url = url or endpoints.orders()
+    res.headers['Content-Type'] = 'application/json'
+    res._content = json.dumps(data).encode('utf-8')
+    res.encoding = 'utf-8'
+    return res
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class PaperTrader(Robinhood):
+    """Robinhood client with a local order book and account
+
+        Args:
+            cash (float): starting cash
+            live_quotes (bool): fetch quotes from the API when an order
+                needs one. Without it only quotes passed to `on_quotes` are
+                used, and `quote_data` / `quotes_data` answer from them too,
+                so replays need no login.
+
+        Matching: like the `orders` POST, `send_order` answers with an
+        'unconfirmed' order. The next quotes confirm it, then market orders
+        fill at the ask (buys) or bid (sells) of the quote of their symbol.
+        The quote taken when the order is placed, a fresh API quote with
+        `live_quotes`, the last replayed one otherwise, only sizes the cash
+        held for a buy. Limit orders fill at that side of a quote once it
+        reaches the limit. Stop orders trigger on the last
+        trade price and then behave as market or limit orders. Orders fill
+        in full. Resting limit and stop prices sit in per-symbol sorted
+        `quotes.Levels`, so a quote only touches the orders it crosses.
+    """
+
+    def __init__(self, cash=100000.0, live_quotes=True):
+        Robinhood.__init__(self)
+        self.live_quotes = live_quotes
+        self.account_url = PAPER_ACCOUNT
+        # Local orders need no throttling, market data calls still have it
+        self.order_rate_limiter = None
+
+        self.cash = float(cash)
+        self.start_equity = float(cash)
+        self.held_cash = 0.0
+        self.holdings = {}
+        self.orders = {}
+        self.quotes = {}
+        self.clock = None
+        self.unconfirmed = []
+
+        self.market = {}
+        self.limits = {'buy': {}, 'sell': {}}
+        self.stops = {'buy': {}, 'sell': {}}
+        self.book_lock = threading.RLock()
+
+    def now(self):
+        """Current time, the replayed time while quotes are replayed """
+
+        return self.clock or time.time()
+
+    ###########################################################################
+    #                               QUOTES
+    ###########################################################################
+
+    def quote_data(self, stock=''):
+        if self.live_quotes:
+            return Robinhood.quote_data(self, stock)
+
+        symbol = stock['symbol'] if isinstance(stock, dict) else stock
+        if symbol.upper() not in self.quotes:
+            raise ValueError('No replayed quote for ' + symbol)
+        return self.quotes[symbol.upper()]
+
+    def quotes_data(self, stocks):
+        if self.live_quotes:
+            return Robinhood.quotes_data(self, stocks)
+
+        return [self.quotes.get(stock.upper()) for stock in stocks]
+
+    def get_stock_marketdata(self, instruments):
+        if self.live_quotes:
+            return Robinhood.get_stock_marketdata(self, instruments)
+
+        with self.book_lock:
+            symbols = dict((order['instrument'], order['symbol']) for order in self.orders.values())
+            return [self.quotes.get(symbols.get(instrument)) for instrument in instruments]
+
+    def _quote(self, symbol):
+        """Quote to match a new order against, fresh when quotes are live """
+
+        if self.live_quotes:
+            quote = Robinhood.quote_data(self, symbol)
+            with self.book_lock:
+                self.quotes[symbol] = quote
+            return quote
+
+        return self.quotes.get(symbol)
+
+    def symbols(self):
+        """Symbols with open orders, polled by a `QuotePoller` """
+
+        with self.book_lock:
+            return set(order['symbol'] for order in self.orders.values() if order['cancel'])
+
+    def on_quotes(self, quotes, now=None):
+        """Match open orders against new quotes
+
+            Args:
+                quotes (:obj:`dict`): symbol -> quote dict
+                now (float, optional): epoch seconds of the quotes, set it
+                    when replaying
+
+            Returns:
+                (:obj:`list`): orders filled by these quotes
+        """
+
+        filled = []
+        with self.book_lock:
+            if now is not None:
+                self.clock = now
+            self._confirm()
+            for symbol, quote in quotes.items():
+                if quote:
+                    self.quotes[symbol] = quote
+                    filled += self._match(symbol, quote)
+        self.pretrade.observe(quotes.values())
+
+        return filled
+
+    ###########################################################################
+    #                               MATCHING
+    ###########################################################################
+
+    def _sides(self, quote):
+        last = _float(quote.get('last_trade_price'))
+        bid = _float(quote.get('bid_price')) or last
+        ask = _float(quote.get('ask_price')) or last
+        return bid, ask, last
+
+    def _confirm(self):
+        """Confirm the orders placed since the last quotes, and rest them """
+
+        for order_id in self.unconfirmed:
+            order = self.orders[order_id]
+            if order['cancel'] is None:
+                continue
+            order['state'] = 'confirmed'
+            order['updated_at'] = _timestamp(self.now())
+            self._rest(order)
+        self.unconfirmed = []
+
+    def _rest(self, order):
+        """Put an open order where the next matching quote finds it """
+
+        symbol, side = order['symbol'], order['side']
+        if order['trigger'] == 'stop' and order['state'] != 'triggered':
+            self.stops[side].setdefault(symbol, Levels()).add(float(order['stop_price']), order['id'])
+        elif order['type'] == 'limit':
+            self.limits[side].setdefault(symbol, Levels()).add(float(order['price']), order['id'])
+        else:
+            self.market.setdefault(symbol, []).append(order['id'])
+
+    def _match(self, symbol, quote):
+        bid, ask, last = self._sides(quote)
+        if not last:
+            return []
+
+        triggered = []
+        if symbol in self.stops['buy']:
+            triggered += self.stops['buy'][symbol].pop_at_or_below(last)
+        if symbol in self.stops['sell']:
+            triggered += self.stops['sell'][symbol].pop_at_or_above(last)
+        for order_id in triggered:
+            order = self.orders[order_id]
+            order['state'] = 'triggered'
+            self._rest(order)
+
+        due = self.market.pop(symbol, [])
+        if symbol in self.limits['buy']:
+            due += self.limits['buy'][symbol].pop_at_or_above(ask)
+        if symbol in self.limits['sell']:
+            due += self.limits['sell'][symbol].pop_at_or_below(bid)
+
+        filled = []
+        for order_id in due:
+            order = self.orders[order_id]
+            if order['cancel'] is None:
+                continue
+            self._fill(order, ask if order['side'] == 'buy' else bid)
+            filled.append(order)
+
+        return filled
+
+    def _fill(self, order, price):
+        quantity = float(order['quantity'])
+        now = self.now()
+
+        if order['side'] == 'buy':
+            self.held_cash -= order['held']
+            self.cash -= quantity * price
+            holding = self.holdings.setdefault(order['instrument'], {'symbol': order['symbol'], 'quantity': 0.0,
+                                                                     'cost': 0.0, 'held': 0.0})
+            holding['quantity'] += quantity
+            holding['cost'] += quantity * price
+        else:
+            holding = self.holdings[order['instrument']]
+            average = holding['cost'] / holding['quantity']
+            holding['quantity'] -= quantity
+            holding['held'] -= quantity
+            holding['cost'] -= quantity * average
+            self.cash += quantity * price
+
+        order['held'] = 0.0
+        order['state'] = 'filled'
+        order['cancel'] = None
+        order['cumulative_quantity'] = order['quantity']
+        order['average_price'] = '{:.4f}'.format(price)
+        order['executions'] = [{
+            'id': uuid.uuid4().hex,
+            'price': '{:.4f}'.format(price),
+            'quantity': order['quantity'],
+            'settlement_date': _timestamp(now)[:10],
+            'timestamp': _timestamp(now),
+        }]
+        order['updated_at'] = order['last_transaction_at'] = _timestamp(now)
+
+    ###########################################################################
+    #                           ORDER ENDPOINTS
+    ###########################################################################
+
+    def send_order(self, payload):
+        """Accept an order into the local book, mirroring the `orders` POST
+
+            Returns:
+                (:obj:`requests.Response`): 201 with the order, or 400 with
+                    a `detail` for orders the account cannot cover
+        """
+
+        side = str(payload['side']).lower()
+        order_type = str(payload.get('type', 'market')).lower()
+        trigger = str(payload.get('trigger', 'immediate')).lower()
+        if order_type == 'stop':
+            order_type, trigger = 'market', 'stop'
+
+        quantity = float(payload['quantity'])
+        symbol = str(payload['symbol']).upper()
+        price = _float(payload.get('price'))
+        stop_price = _float(payload.get('stop_price'))
+
+        quote = self._quote(symbol)
+        if quote is None:
+            return _response({'detail': 'No quote for ' + symbol}, 400)
+        bid, ask, last = self._sides(quote)
+
+        with self.book_lock:
+
+            now = self.now()
+            order_id = str(uuid.uuid4())
+            order = {
+                'id': order_id,
+                'url': endpoints.orders(order_id),
+                'cancel': endpoints.orders(order_id) + 'cancel/',
+                'account': self.account_url,
+                'instrument': payload['instrument'],
+                'symbol': symbol,
+                'side': side,
+                'type': order_type,
+                'trigger': trigger,
+                'time_in_force': str(payload.get('time_in_force', 'gfd')).lower(),
+                'price': None if price is None else '{:.4f}'.format(price),
+                'stop_price': None if stop_price is None else '{:.4f}'.format(stop_price),
+                'quantity': '{:.5f}'.format(quantity),
+                'cumulative_quantity': '0.00000',
+                'average_price': None,
+                'fees': '0.00',
+                'executions': [],
+                'state': 'unconfirmed',
+                'held': 0.0,
+                'created_at': _timestamp(now),
+                'updated_at': _timestamp(now),
+                'last_transaction_at': _timestamp(now),
+            }
+
+            if side == 'buy':
+                order['held'] = quantity * max(price or 0.0, stop_price or 0.0, ask or 0.0)
+                if order['held'] > self.cash - self.held_cash:
+                    return _response({'detail': 'Not enough buying power.'}, 400)
+                self.held_cash += order['held']
+            else:
+                holding = self.holdings.get(payload['instrument'])
+                if holding is None or holding['quantity'] - holding['held'] < quantity:
+                    return _response({'detail': 'Not enough shares to sell.'}, 400)
+                holding['held'] += quantity
+
+            self.orders[order_id] = order
+            self.unconfirmed.append(order_id)
+
+            return _response(self._public(order))
+
+    def send_cancel(self, order_id, cancel_url, headers=None):
+        """Cancel an open local order, mirroring the cancel POST """
+
+        with self.book_lock:
+            order = self.orders.get(order_id)
+            if order is None or order['cancel'] is None:
+                return _response({'detail': 'Order cannot be cancelled.'}, 400, cancel_url)
+
+            symbol, side = order['symbol'], order['side']
+            if order['id'] in self.market.get(symbol, []):
+                self.market[symbol].remove(order['id'])
+            if order['state'] == 'unconfirmed':
+                self.unconfirmed.remove(order['id'])
+            elif order['trigger'] == 'stop' and order['state'] != 'triggered':
+                self.stops[side].get(symbol, Levels()).remove(float(order['stop_price']), order['id'])
+            elif order['type'] == 'limit':
+                self.limits[side].get(symbol, Levels()).remove(float(order['price']), order['id'])
+
+            if side == 'buy':
+                self.held_cash -= order['held']
+            else:
+                self.holdings[order['instrument']]['held'] -= float(order['quantity'])
+
+            order['held'] = 0.0
+            order['state'] = 'cancelled'
+            order['cancel'] = None
+            order['updated_at'] = _timestamp(self.now())
+
+            return _response({}, 200, cancel_url)
+
+    def _public(self, order):
+        return dict((k, v) for k, v in order.items() if k != 'held')
+
+    def get_order(self, order_id):
+        with self.book_lock:
+            if order_id not in self.orders:
+                raise requests.exceptions.HTTPError('404 Not Found: order ' + order_id)
+            return self._public(self.orders[order_id])
+
+    def order_page(self, url=None, params=None):
+        """All local orders as one page, newest first, honouring `updated_at[gte]` """
+
+        since = (params or {}).get('updated_at[gte]')
+        with self.book_lock:
+            orders = [self._public(o) for o in self.orders.values()]
+
+        if since is not None:
+            since = _timestamp(parse_time(since))
+            orders = [o for o in orders if o['updated_at'] >= since]
+
+        return {'results': sorted(orders, key=lambda o: o['created_at'], reverse=True), 'next': None}
+
+    def order_history(self, orderId=None):
+        if orderId:
+            return self.get_order(orderId)
+
+        return self.order_page()
+
+    def dividends(self):
+        return self.dividend_page()
+
+    def dividend_page(self, url=None, params=None):
+        """A paper account gets no dividends """
+
+        return {'results': [], 'next': None}
+
+    ###########################################################################
+    #                       ACCOUNT, POSITIONS, PORTFOLIO
+    ###########################################################################
+
+    def _market_value(self):
+        value = 0.0
+        for holding in self.holdings.values():
+            if not holding['quantity']:
+                continue
+            quote = self.quotes.get(holding['symbol']) or {}
+            value += holding['quantity'] * (_float(quote.get('last_trade_price')) or
+                                            holding['cost'] / holding['quantity'])
+        return value
+
+    def get_account(self):
+        with self.book_lock:
+            held = max(0.0, self.held_cash)
+            buying_power = '{:.4f}'.format(self.cash - held)
+            account = {
+                'url': self.account_url,
+                'account_number': 'PAPER',
+                'type': 'cash',
+                'cash': '{:.4f}'.format(self.cash),
+                'buying_power': buying_power,
+                'cash_held_for_orders': '{:.4f}'.format(held),
+                'margin_balances': {'unallocated_margin_cash': buying_power},
+            }
+        self.pretrade.set_account(account)
+        return account
+
+    def positions(self):
+        with self.book_lock:
+            results = []
+            for instrument, holding in self.holdings.items():
+                quantity = holding['quantity']
+                results.append({
+                    'account': self.account_url,
+                    'instrument': instrument,
+                    'quantity': '{:.5f}'.format(quantity),
+                    'average_buy_price': '{:.4f}'.format(holding['cost'] / quantity if quantity else 0.0),
+                    'shares_held_for_sells': '{:.5f}'.format(holding['held']),
+                })
+
+        return {'results': results, 'next': None, 'previous': None}
+
+    def securities_owned(self):
+        positions = self.positions()
+        positions['results'] = [p for p in positions['results'] if float(p['quantity']) > 0]
+        return positions
+
+    def portfolios(self):
+        with self.book_lock:
+            market_value = self._market_value()
+            equity = self.cash + market_value
+            return {
+                'account': self.account_url,
+                'equity': '{:.4f}'.format(equity),
+                'market_value': '{:.4f}'.format(market_value),
+                'extended_hours_equity': None,
+                'extended_hours_market_value': None,
+                'last_core_equity': '{:.4f}'.format(equity),
+                'last_core_market_value': '{:.4f}'.format(market_value),
+                'equity_previous_close': '{:.4f}'.format(self.start_equity),
+                'adjusted_equity_previous_close': '{:.4f}'.format(self.start_equity),
+                'excess_margin': '{:.4f}'.format(self.cash - self.held_cash),
+                'withdrawable_amount': '{:.4f}'.format(self.cash - self.held_cash),
+            }
@@ -0,0 +1,207 @@
+"""perf.py: order latency and slippage analytics
+
+`OrderPerfStore` keeps one SQLite row per order sent through the client:
+submit and ack times from the order POST, first fill, fill and cancel times
+from an `orders.OrderWatcher`, the bid/ask of the quote the order was priced
+from and the average fill price. Enable it with `Robinhood.record_perf`.
+"""
+
+import datetime
+import sqlite3
+import threading
+
+import numpy as np
+
+from dateutil import tz
+
+MARKET_TZ = tz.gettz('America/New_York')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS order_perf (
+    id TEXT PRIMARY KEY,
+    symbol TEXT,
+    side TEXT,
+    type TEXT,
+    trigger TEXT,
+    quantity REAL,
+    state TEXT,
+    submitted_at REAL,
+    acked_at REAL,
+    first_fill_at REAL,
+    filled_at REAL,
+    cancel_sent_at REAL,
+    cancel_acked_at REAL,
+    cancelled_at REAL,
+    bid REAL,
+    ask REAL,
+    last REAL,
+    average_price REAL
+)
+"""
+
+GROUPS = ('symbol', 'type', 'hour')
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def slippage_bps(row):
+    """Fill price versus the quote at submission, in basis points
+
+        Positive values are a cost: buys filled above the ask, sells filled
+        below the bid. Falls back to the last trade price without a quote.
+    """
+
+    if row['average_price'] is None:
+        return None
+
+    if row['side'] == 'buy':
+        reference = row['ask'] or row['last']
+        sign = 1.0
+    else:
+        reference = row['bid'] or row['last']
+        sign = -1.0
+
+    if not reference:
+        return None
+
+    return sign * (row['average_price'] - reference) / reference * 1e4
+
+
+class OrderPerfStore:
+    """SQLite store of per-order latency and slippage """
+
+    def __init__(self, path='orders_perf.db'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            self.db.execute(SCHEMA)
+        self.watcher = None
+
+    def follow(self, watcher):
+        """Take fill and cancel times from an `orders.OrderWatcher` """
+
+        self.watcher = watcher
+        watcher.on(self._on_event)
+
+    def _execute(self, sql, params):
+        with self.lock, self.db:
+            self.db.execute(sql, params)
+
+    def submitted(self, res, payload, submitted_at, acked_at, quote=None):
+        """Record an order POST
+
+            Args:
+                quote (dict, optional): the quote the order was priced
+                    from; without one the payload price stands in for the
+                    last trade, so recording never fetches a quote
+        """
+
+        if res.status_code not in (200, 201):
+            return
+
+        quote = quote or {}
+        last = quote.get('last_trade_price') or payload.get('price') or payload.get('stop_price')
+        order = res.json()
+        self._execute(
+            "INSERT OR REPLACE INTO order_perf "
+            "(id, symbol, side, type, trigger, quantity, state, submitted_at, acked_at, bid, ask, last) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (order['id'], payload.get('symbol'), payload.get('side'), payload.get('type'),
+             payload.get('trigger'), _float(payload.get('quantity')), order.get('state'),
+             submitted_at, acked_at, _float(quote.get('bid_price')), _float(quote.get('ask_price')),
+             _float(last)))
+
+        if self.watcher is not None:
+            self.watcher.watch(order, submitted_at)
+            self.watcher.start()
+
+    def cancel_sent(self, order_id, sent_at, acked_at):
+        """Record a cancel POST for a tracked order """
+
+        self._execute(
+            "UPDATE order_perf SET cancel_sent_at = ?, cancel_acked_at = ? WHERE id = ?",
+            (sent_at, acked_at, order_id))
+
+    def _on_event(self, event, record):
+        order = record['order']
+        at = record['times'][event]
+        if event in ('partial_fill', 'fill'):
+            self._execute(
+                "UPDATE order_perf SET first_fill_at = COALESCE(first_fill_at, ?), "
+                "average_price = ?, state = ? WHERE id = ?",
+                (at, _float(order.get('average_price')), order.get('state'), record['id']))
+        if event == 'fill':
+            self._execute("UPDATE order_perf SET filled_at = ? WHERE id = ?", (at, record['id']))
+        if event == 'cancel':
+            self._execute("UPDATE order_perf SET cancelled_at = ?, state = ? WHERE id = ?",
+                          (at, order.get('state'), record['id']))
+        if event == 'reject':
+            self._execute("UPDATE order_perf SET state = ? WHERE id = ?",
+                          (order.get('state'), record['id']))
+
+    def rows(self):
+        """All recorded orders as dicts """
+
+        with self.lock:
+            return [dict(row) for row in self.db.execute("SELECT * FROM order_perf")]
+
+    def report(self, by='symbol'):
+        """Latency and slippage percentiles per group
+
+            Args:
+                by (str): 'symbol', 'type' or 'hour' (exchange time of day
+                    the order was submitted)
+
+            Returns:
+                (:obj:`list`): one dict per group with `group`, `orders`,
+                    `fills`, `ack_ms` / `fill_ms` / `cancel_ms` (cancel POST to ack) percentiles
+                    (p50, p90, p99) and `slippage_bps` (mean, p50, p90)
+        """
+
+        if by not in GROUPS:
+            raise ValueError('Group must be one of ' + ', '.join(GROUPS))
+
+        rows = self.rows()
+        for row in rows:
+            if by == 'hour':
+                submitted = datetime.datetime.fromtimestamp(row['submitted_at'], MARKET_TZ)
+                row['hour'] = '{:02d}:00'.format(submitted.hour)
+            row['slippage'] = slippage_bps(row)
+
+        def elapsed(rows, end, start):
+            return np.array([(r[end] - r[start]) * 1000 if r[end] is not None and r[start] is not None
+                             else np.nan for r in rows])
+
+        def percentiles(values, qs=(50, 90, 99)):
+            values = values[~np.isnan(values)]
+            if len(values) == 0:
+                return tuple(None for q in qs)
+            return tuple(np.percentile(values, qs))
+
+        groups = {}
+        for row in rows:
+            groups.setdefault(row[by] or '', []).append(row)
+
+        report = []
+        for group in sorted(groups):
+            members = groups[group]
+            slippage = np.array([np.nan if r['slippage'] is None else r['slippage'] for r in members])
+            filled = slippage[~np.isnan(slippage)]
+            report.append({
+                'group': group,
+                'orders': len(members),
+                'fills': int(np.sum([r['first_fill_at'] is not None for r in members])),
+                'ack_ms': percentiles(elapsed(members, 'acked_at', 'submitted_at')),
+                'fill_ms': percentiles(elapsed(members, 'first_fill_at', 'submitted_at')),
+                'cancel_ms': percentiles(elapsed(members, 'cancel_acked_at', 'cancel_sent_at')),
+                'slippage_bps': (filled.mean() if len(filled) else None,) + percentiles(slippage, (50, 90)),
+            })
+
+        return report
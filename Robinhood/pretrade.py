@@ -0,0 +1,350 @@
+"""pretrade.py: local pre-trade checks run before any order call
+
+`PreTradeChecker` validates orders against state the client already holds,
+so a bad order is rejected without a quote, account or order request:
+
+* the instrument index, filled only from the client's `instruments` lookups
+* the instrument's tick size
+* quantity and notional limits
+* buying power from the last `get_account` snapshot, less buys sent since
+  that are still open; with `follow`, cancels give buying power back
+* identical orders sent within `duplicate_window` seconds
+
+Orders are dicts shaped like the `orders` POST payload (`symbol`,
+`instrument`, `side`, `type`, `trigger`, `price`, `stop_price`, `quantity`,
+`time_in_force`); `intent_order` converts `place_order` keyword arguments.
+"""
+
+import threading
+import time
+
+from six.moves.urllib.parse import unquote  # pylint: disable=E0401
+
+ORDER_TYPES = ('market', 'limit')
+TRIGGERS = ('immediate', 'stop')
+TIMES_IN_FORCE = ('gfd', 'gtc', 'ioc', 'opg')
+
+
+def tick_size(instrument, price):
+    """Price increment allowed for an instrument at `price`
+
+        Uses the instrument's `min_tick_size` when set, otherwise the
+        usual $0.01 at or above $1 and $0.0001 below.
+    """
+
+    tick = (instrument or {}).get('min_tick_size')
+    if tick:
+        return float(tick)
+
+    return 0.01 if price >= 1.0 else 0.0001
+
+
+def intent_order(intent):
+    """Order dict for `place_order` keyword arguments """
+
+    instrument = intent.get('instrument') or {}
+    transaction = intent.get('transaction')
+    order_type = str(intent.get('order', 'market')).lower()
+    price = intent.get('price') or None
+
+    order = {
+        'symbol': instrument.get('symbol'),
+        'instrument': instrument.get('url'),
+        'side': getattr(transaction, 'value', transaction),
+        'type': order_type,
+        'trigger': intent.get('trigger', 'immediate'),
+        'price': price,
+        'stop_price': None,
+        'quantity': intent.get('quantity', 1),
+        'time_in_force': intent.get('time_in_force', 'gfd'),
+    }
+    if order_type == 'stop':
+        order.update({'type': 'market', 'trigger': 'stop', 'price': None, 'stop_price': price})
+
+    return order
+
+
+class PreTradeChecker:
+    """Offline order validation shared by every order method
+
+        Args:
+            max_quantity (int, optional): largest quantity per order
+            max_notional (float, optional): largest quantity x price per order
+            duplicate_window (float): seconds an identical order is rejected
+                after one was sent, 0 to allow duplicates
+    """
+
+    def __init__(self, max_quantity=None, max_notional=None, duplicate_window=5.0):
+        self.max_quantity = max_quantity
+        self.max_notional = max_notional
+        self.duplicate_window = duplicate_window
+
+        self.instruments = {}
+        self.prices = {}
+        self.account = None
+        self.committed = 0.0
+        # order id -> (notional, quantity) of buys sent since the snapshot
+        self.pending = {}
+        self.recent = {}
+        self.lock = threading.Lock()
+
+    def add_instruments(self, instruments):
+        """Index instrument dicts (`symbol`, `url`, optionally `min_tick_size`,
+            `tradeable`, `state`) by symbol
+
+            A bare `symbol` and `url` does not drop fields already known
+            for the same instrument.
+        """
+
+        with self.lock:
+            for instrument in instruments:
+                if instrument and instrument.get('symbol'):
+                    symbol = instrument['symbol'].upper()
+                    known = self.instruments.get(symbol)
+                    if known is not None and known.get('url') == instrument.get('url'):
+                        instrument = dict(known, **instrument)
+                    self.instruments[symbol] = instrument
+
+    def observe(self, quotes):
+        """Remember last trade prices, used to size market orders """
+
+        for quote in quotes:
+            if quote and quote.get('last_trade_price'):
+                self.prices[quote['symbol'].upper()] = float(quote['last_trade_price'])
+
+    def set_account(self, account):
+        """Take a fresh account snapshot, forgetting buys recorded before it """
+
+        with self.lock:
+            self.account = account
+            self.committed = 0.0
+            self.pending = {}
+
+    def follow(self, watcher):
+        """Release buying power of buys an `orders.OrderWatcher` sees end """
+
+        watcher.on(self._on_event)
+
+    def _on_event(self, event, record):
+        if event not in ('fill', 'cancel', 'reject'):
+            return
+
+        order = record['order']
+        with self.lock:
+            pending = self.pending.pop(record['id'], None)
+            if pending is None:
+                return
+            notional, quantity = pending
+            filled = float(order.get('cumulative_quantity') or 0)
+            price = float(order.get('average_price') or 0) or notional / quantity
+            # the unfilled part is released, the filled part costs what it
+            # filled at until the next snapshot
+            self.committed -= notional - filled * price
+
+    def buying_power(self):
+        """Buying power of the snapshot less buys sent since, None if unknown """
+
+        if not self.account or self.account.get('buying_power') is None:
+            return None
+
+        return float(self.account['buying_power']) - self.committed
+
+    def _key(self, order):
+        # market order prices are quote collars, not part of the intent
+        price = order['price'] if order['type'] == 'limit' else None
+        return (order['symbol'], order['side'], order['type'], order['trigger'],
+                price, order['stop_price'], order['quantity'])
+
+    def normalize(self, order):
+        """Check one order on its own
+
+            A symbol not indexed yet is indexed with the order's instrument
+            URL. Tick and tradeable checks only apply to instruments whose
+            data was fetched.
+
+            Returns:
+                (:obj:`dict`): the order with canonical types: upper case
+                    symbol, lower case enums, float prices, int quantity
+
+            Raises:
+                ValueError: describing the first problem found
+        """
+
+        symbol = order.get('symbol')
+        url = order.get('instrument')
+        if not symbol:
+            if url:
+                raise ValueError('Symbol not passed with instrument ' + str(url))
+            raise ValueError('Order needs a symbol and instrument')
+        symbol = str(symbol).upper()
+
+        instrument = self.instruments.get(symbol)
+        if instrument is None:
+            if not url:
+                raise ValueError('Unknown symbol ' + symbol + ', pass its instrument or look it up first')
+            instrument = {'symbol': symbol, 'url': url}
+            self.add_instruments([instrument])
+        if url and unquote(url) != unquote(instrument['url']):
+            raise ValueError('Instrument ' + str(url) + ' is not ' + symbol)
+        if instrument.get('tradeable') is False or instrument.get('state', 'active') != 'active':
+            raise ValueError(symbol + ' is not tradeable')
+
+        side = str(order.get('side')).lower()
+        if side not in ('buy', 'sell'):
+            raise ValueError('Order is neither buy nor sell')
+
+        order_type = str(order.get('type') or 'market').lower()
+        trigger = str(order.get('trigger') or 'immediate').lower()
+        if order_type == 'stop':
+            # `place_order(order='stop')` payloads
+            order_type, trigger = 'market', 'stop'
+        if order_type not in ORDER_TYPES:
+            raise ValueError('Invalid order type: ' + order_type)
+
+        if trigger not in TRIGGERS:
+            raise ValueError('Invalid trigger: ' + trigger)
+
+        time_in_force = str(order.get('time_in_force') or 'gfd').lower()
+        if time_in_force not in TIMES_IN_FORCE:
+            raise ValueError('time_in_force must be one of ' + ', '.join(TIMES_IN_FORCE))
+
+        try:
+            price = None if order.get('price') is None else float(order['price'])
+            stop_price = None if order.get('stop_price') is None else float(order['stop_price'])
+        except (TypeError, ValueError):
+            raise ValueError('Price is not a number')
+
+        if order_type == 'limit':
+            if price is None:
+                raise ValueError('Limit order has no price')
+            if price <= 0:
+                raise ValueError('Price must be positive')
+        elif price is not None and price < 0:
+            raise ValueError('Price must not be negative')
+
+        if trigger == 'stop':
+            if stop_price is None:
+                raise ValueError('Stop order has no stop_price')
+            if stop_price <= 0:
+                raise ValueError('Stop_price must be positive')
+        elif stop_price is not None:
+            raise ValueError('Stop price set for non-stop order')
+
+        for value in (price if order_type == 'limit' else None, stop_price):
+            if value is not None and 'min_tick_size' in instrument:
+                tick = tick_size(instrument, value)
+                if abs(round(value / tick) * tick - value) > 1e-9:
+                    raise ValueError('Price {:g} is not a multiple of the {:g} tick'.format(value, tick))
+
+        try:
+            quantity = float(order.get('quantity'))
+        except (TypeError, ValueError):
+            raise ValueError('Quantity is not a number')
+        if quantity <= 0 or quantity != int(quantity):
+            raise ValueError('Quantity must be a positive whole number')
+        quantity = int(quantity)
+        if self.max_quantity is not None and quantity > self.max_quantity:
+            raise ValueError('Quantity {} is above the {} limit'.format(quantity, self.max_quantity))
+
+        return {
+            'symbol': symbol,
+            'instrument': url or instrument['url'],
+            'side': side,
+            'type': order_type,
+            'trigger': trigger,
+            'price': price,
+            'stop_price': stop_price,
+            'quantity': quantity,
+            'time_in_force': time_in_force,
+        }
+
+    def notional(self, order):
+        """quantity x best known price of a normalized order, None if unknown """
+
+        price = order['price'] or order['stop_price'] or self.prices.get(order['symbol'])
+        if not price:
+            return None
+
+        return order['quantity'] * max(price, order['stop_price'] or 0.0)
+
+    def check_all(self, orders, now=None):
+        """Check orders as one batch
+
+            Buys draw on buying power cumulatively. Identical orders within
+            the batch are allowed, only orders sent before count as
+            duplicates.
+
+            Returns:
+                (:obj:`list`): per order, (normalized order, None) or
+                    (None, error message)
+        """
+
+        now = now or time.time()
+        buying_power = self.buying_power()
+
+        results = []
+        for order in orders:
+            try:
+                order = self.normalize(order)
+
+                if now - self.recent.get(self._key(order), -float('inf')) < self.duplicate_window:
+                    raise ValueError('Duplicate of an order sent moments ago')
+
+                notional = self.notional(order)
+                if notional is not None:
+                    if self.max_notional is not None and notional > self.max_notional:
+                        raise ValueError('Order value {:.2f} is above the {:.2f} limit'.format(
+                            notional, self.max_notional))
+                    if order['side'] == 'buy' and buying_power is not None:
+                        if notional > buying_power:
+                            raise ValueError('Not enough buying power: {:.2f} needed, {:.2f} available'.format(
+                                notional, buying_power))
+                        buying_power -= notional
+
+                results.append((order, None))
+            except ValueError as err_msg:
+                results.append((None, str(err_msg)))
+
+        return results
+
+    def check(self, order):
+        """Check one order
+
+            Returns:
+                (:obj:`dict`): the normalized order
+
+            Raises:
+                ValueError: describing the first problem found
+        """
+
+        order, error = self.check_all([order])[0]
+        if error is not None:
+            raise ValueError(error)
+
+        return order
+
+    def record(self, payload, now=None, order_id=None):
+        """Note an order that was sent, for duplicate and buying power checks
+
+            Args:
+                order_id (str, optional): id the order was given, so a
+                    followed watcher can release its buying power
+        """
+
+        try:
+            order = self.normalize(payload)
+        except ValueError:
+            return
+
+        now = now or time.time()
+        with self.lock:
+            self.recent[self._key(order)] = now
+            # forget orders that can no longer be duplicates
+            if len(self.recent) > 1000:
+                self.recent = dict((k, t) for k, t in self.recent.items()
+                                   if now - t < self.duplicate_window)
+            if order['side'] == 'buy':
+                notional = self.notional(order) or 0.0
+                self.committed += notional
+                if order_id is not None:
+                    self.pending[order_id] = (notional, order['quantity'])
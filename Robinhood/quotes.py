@@ -0,0 +1,168 @@
+"""quotes.py: bulk quote polling shared by local trigger engines"""
+
+import bisect
+import logging
+import threading
+import time
+
+from .ratelimit import dispatch
+
+
+class Levels:
+    """Trigger levels of one symbol kept sorted, for O(log n) crossing checks
+
+        Holds (level, id) pairs as two parallel lists ordered by level, so
+        a new price only touches the levels it crossed.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.ids = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, level, id):
+        i = bisect.bisect_right(self.keys, level)
+        self.keys.insert(i, level)
+        self.ids.insert(i, id)
+
+    def remove(self, level, id):
+        i = bisect.bisect_left(self.keys, level)
+        while i < len(self.keys) and self.keys[i] == level:
+            if self.ids[i] == id:
+                del self.keys[i]
+                del self.ids[i]
+                return
+            i += 1
+
+    def pop_at_or_above(self, price):
+        """Remove and return ids whose level is >= price """
+
+        i = bisect.bisect_left(self.keys, price)
+        ids = self.ids[i:]
+        del self.keys[i:]
+        del self.ids[i:]
+        return ids
+
+    def pop_at_or_below(self, price):
+        """Remove and return ids whose level is <= price """
+
+        i = bisect.bisect_right(self.keys, price)
+        ids = self.ids[:i]
+        del self.keys[:i]
+        del self.ids[:i]
+        return ids
+
+    def raise_to(self, price):
+        """Lift every level below price up to it
+
+            Returns:
+                (:obj:`list`): ids whose level changed
+        """
+
+        i = bisect.bisect_left(self.keys, price)
+        self.keys[:i] = [price] * i
+        return self.ids[:i]
+
+
+class QuotePoller:
+    """Poll quotes for the symbols its listeners want, in bulk
+
+        A listener is any object with `symbols()`, returning the symbols it
+        currently needs, and `on_quotes(quotes, now)`, called after every
+        poll with a symbol -> quote dict. The union of all listeners'
+        symbols is fetched with one `quotes/?symbols=` call per
+        `chunk_size` symbols, chunks dispatched under `client.rate_limiter`.
+    """
+
+    logger = logging.getLogger('Robinhood')
+
+    def __init__(self, client, interval=2.0, chunk_size=100, max_workers=4):
+        self.client = client
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+
+        self.listeners = []
+        self.quotes = {}
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def subscribe(self, listener):
+        """Add a listener, see the class docstring """
+
+        self.listeners.append(listener)
+
+    def fetch(self, symbols):
+        """Quotes for `symbols` as a symbol -> quote dict
+
+            Symbols the API does not know are left out.
+        """
+
+        symbols = sorted(symbols)
+        chunks = [symbols[i:i + self.chunk_size] for i in range(0, len(symbols), self.chunk_size)]
+
+        quotes = {}
+        for chunk, (results, ex) in zip(chunks, dispatch(self.client.quotes_data, chunks,
+                                                         self.max_workers, self.client.rate_limiter)):
+            if ex is not None:
+                self.logger.warning('quote poll failed for %s: %r', ','.join(chunk), ex)
+                continue
+            for quote in results:
+                if quote:
+                    quotes[quote['symbol']] = quote
+
+        return quotes
+
+    def poll(self, now=None):
+        """Fetch quotes once and hand them to every listener
+
+            Returns:
+                (:obj:`dict`): symbol -> quote
+        """
+
+        symbols = set()
+        for listener in self.listeners:
+            symbols.update(listener.symbols())
+        if not symbols:
+            return {}
+
+        quotes = self.fetch(symbols)
+        self.quotes.update(quotes)
+        now = now or time.time()
+
+        for listener in self.listeners:
+            try:
+                listener.on_quotes(quotes, now)
+            except Exception as ex:
+                self.logger.warning('quote listener failed: %r', ex)
+
+        return quotes
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                self.poll()
+            except Exception as ex:
+                self.logger.warning('quote poll failed: %r', ex)
+            self.stopped.wait(self.interval)
+
+    def start(self):
+        """Poll in a background daemon thread """
+
+        if self.thread is not None and self.thread.is_alive():
+            return
+
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, name='QuotePoller')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop the background thread """
+
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
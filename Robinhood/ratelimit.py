@@ -0,0 +1,69 @@
+"""ratelimit.py: rate limited concurrent dispatch of API calls"""
+
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RateLimiter:
+    """Thread-safe token bucket
+
+        Args:
+            rate (float): requests per second allowed on average
+            burst (int): requests allowed back to back
+    """
+
+    def __init__(self, rate=5.0, burst=10):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent """
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+def dispatch(function, items, max_workers=8, limiter=None):
+    """Call `function` on every item concurrently
+
+        Args:
+            function (callable): called once per item
+            items (list): arguments for `function`
+            max_workers (int): number of threads
+            limiter (:obj:`RateLimiter`, optional): acquired before each call
+
+        Returns:
+            (:obj:`list`): (result, exception) per item, in the order of
+                `items`. Exactly one of the two is None.
+    """
+
+    def call(item):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return function(item), None
+        except Exception as ex:
+            return None, ex
+
+    items = list(items)
+    if not items:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+        return list(pool.map(call, items))
@@ -0,0 +1,244 @@
+"""rebalance.py: plan the orders that bring holdings to target weights
+
+`plan` works on arrays over the union of held and targeted symbols::
+
+    targets = read_targets('targets.csv')
+    rebalance = plan(symbols, quantity, price, weights, cash, lot, tolerance=0.02)
+    sells, buys = execute(client, rebalance_intents(rebalance, instruments))
+
+Turnover is kept down by leaving positions within `tolerance` of their
+target alone, netting to one order per symbol, rounding to the nearest lot
+and, when cash runs short, trimming the buys that are least underweight.
+Orders are for whole shares: sells are floored and fractional shares they
+would leave behind are reported in `fraction` instead of traded. Weights are
+of equity: cash plus the value of every position.
+"""
+
+import csv
+import time
+
+import numpy as np
+
+from .orders import TERMINAL_STATES
+
+# Shares below this are float noise
+EPSILON = 1e-9
+
+
+def read_targets(path):
+    """Target weights from a CSV file with `symbol`, `weight` and optional
+        `lot` columns
+
+        Weights are fractions, or percentages if they add up to more than
+        1. Lot is a whole number of shares, 1 by default.
+
+        Returns:
+            (:obj:`dict`): symbol -> (weight, lot)
+
+        Raises:
+            ValueError: on a bad row, a fractional lot or weights above 100%
+    """
+
+    rows = []
+    with open(path) as targets_file:
+        for line, row in enumerate(csv.DictReader(targets_file), 2):
+            try:
+                symbol = row['symbol'].strip().upper()
+                weight = float(row['weight'])
+                lot = float(row.get('lot') or 1)
+            except (AttributeError, KeyError, TypeError, ValueError):
+                raise ValueError('Bad target on line {}'.format(line))
+            if not symbol or weight < 0 or lot < 1 or lot != int(lot):
+                raise ValueError('Bad target on line {}'.format(line))
+            rows.append((symbol, weight, int(lot)))
+
+    total = sum(weight for _, weight, _ in rows)
+    scale = 100.0 if total > 1.0 + EPSILON else 1.0
+    if total / scale > 1.0 + EPSILON:
+        raise ValueError('Target weights add up to {:g}%'.format(total / scale * 100))
+
+    return dict((symbol, (weight / scale, lot)) for symbol, weight, lot in rows)
+
+
+def _fill(lots, wanted, cost, budget):
+    """Add lots, one per symbol per pass, most underweight first, while the
+        budget lasts
+
+        Args:
+            lots (:obj:`numpy.ndarray`): lots bought so far, updated in place
+            wanted (:obj:`numpy.ndarray`): lots each symbol could still take
+            cost (:obj:`numpy.ndarray`): cost of one lot
+
+        Returns:
+            (float): budget left
+    """
+
+    while True:
+        left = wanted - lots
+        candidates = np.flatnonzero((left > EPSILON) & (cost <= budget))
+        if not len(candidates):
+            return budget
+        # most underweight by value first
+        candidates = candidates[np.argsort(-(left * cost)[candidates], kind='stable')]
+        take = candidates[np.cumsum(cost[candidates]) <= budget]
+        if not len(take):
+            take = candidates[:1]
+        lots[take] += 1
+        budget -= cost[take].sum()
+
+
+def plan(symbols, quantity, price, target, cash, lot=None, tolerance=0.0, to_edge=False, reserve=0.0):
+    """Orders that move holdings to their target weights
+
+        Args:
+            symbols (list): stock tickers
+            quantity (:obj:`numpy.ndarray`): shares held
+            price (:obj:`numpy.ndarray`): prices to trade at; symbols
+                without a price (NaN) are not traded
+            target (:obj:`numpy.ndarray`): target weights, 0 to sell out
+            cash (float): cash available for buys before any sells
+            lot (:obj:`numpy.ndarray`, optional): whole share lot sizes, 1
+                by default
+            tolerance (float): weight drift left alone, e.g. 0.02 for +-2%
+            to_edge (bool): trade drifted positions back to the edge of
+                the tolerance band instead of to the target
+            reserve (float): weight to keep in cash
+
+        Returns:
+            (:obj:`dict`): per symbol arrays `symbols`, `quantity`,
+                `price`, `value`, `weight`, `target`, `drift`, `trade`
+                (signed whole shares), `fraction` (shares a sell leaves
+                because they are not a whole share), `trade_value` and
+                `after` (weight after the trades), and `equity`, `cash`,
+                `cash_after` and `turnover` (traded value / equity)
+    """
+
+    quantity = np.asarray(quantity, dtype='f8')
+    price = np.asarray(price, dtype='f8')
+    target = np.asarray(target, dtype='f8')
+    lot = np.ones_like(quantity) if lot is None else np.asarray(lot, dtype='f8')
+
+    priced = np.isfinite(price) & (price > 0)
+    value = np.where(priced, quantity * price, 0.0)
+    equity = cash + value.sum()
+    weight = value / equity if equity > 0 else np.zeros_like(value)
+    drift = weight - target
+
+    trade = priced & (np.abs(drift) > tolerance + EPSILON)
+    goal = target
+    if to_edge:
+        goal = np.clip(target + np.sign(drift) * tolerance, 0.0, None)
+    shares = np.where(trade, (goal * equity - value) / np.where(priced, price, 1.0), 0.0)
+
+    lots = np.round(shares / lot)
+    # sell out completely even when the position is not a whole number of lots
+    delta = np.where(trade & (goal <= 0), -quantity, lots * lot)
+    delta = np.maximum(delta, -quantity)
+    # orders are for whole shares, a fractional holding keeps its fraction
+    whole = np.where(delta < 0, -np.floor(-delta + EPSILON), delta) + 0.0
+    fraction = np.where(delta < 0, whole - delta, 0.0)
+    delta = whole
+
+    sells = delta < 0
+    lot_cost = np.where(priced, lot * price, 0.0)
+    budget = cash - reserve * equity - np.where(sells, delta * price, 0.0).sum()
+    buy_lots = np.where(delta > 0, np.round(delta / lot), 0.0)
+    cost = (buy_lots * lot_cost).sum() if buy_lots.any() else 0.0
+    if cost > max(budget, 0.0):
+        # scale buys down, then spend what is left on the most underweight
+        bought = np.floor(buy_lots * max(budget, 0.0) / cost)
+        budget = _fill(bought, buy_lots, lot_cost, max(budget, 0.0) - (bought * lot_cost).sum())
+        delta = np.where(delta > 0, bought * lot, delta)
+
+    trade_value = np.where(priced, delta * price, 0.0)
+    cash_after = cash - trade_value.sum()
+    after = (value + trade_value) / equity if equity > 0 else np.zeros_like(value)
+
+    return {
+        'symbols': list(symbols),
+        'quantity': quantity,
+        'price': price,
+        'value': value,
+        'weight': weight,
+        'target': target,
+        'drift': drift,
+        'trade': delta,
+        'fraction': fraction,
+        'trade_value': trade_value,
+        'after': after,
+        'equity': equity,
+        'cash': cash,
+        'cash_after': cash_after,
+        'turnover': np.abs(trade_value).sum() / equity if equity > 0 else 0.0,
+    }
+
+
+def rebalance_intents(rebalance, instruments):
+    """`place_order` keyword arguments of the planned trades, market orders
+
+        Args:
+            rebalance (dict): from `plan`
+            instruments (dict): symbol -> instrument dict
+
+        Returns:
+            (:obj:`list`): sells first, then buys, trades of less than a
+                whole share left out
+    """
+
+    intents = []
+    for i in np.argsort(rebalance['trade'] > 0, kind='stable'):
+        shares = rebalance['trade'][i]
+        quantity = int(np.floor(abs(shares) + EPSILON))
+        if not quantity:
+            continue
+        intents.append({
+            'instrument': instruments[rebalance['symbols'][i]],
+            'quantity': quantity,
+            'price': 0.0,
+            'transaction': 'buy' if shares > 0 else 'sell',
+            'trigger': 'immediate',
+            'order': 'market',
+            'time_in_force': 'gfd',
+        })
+
+    return intents
+
+
+def _filled(client, results, timeout, poll):
+    """Wait for orders to finish, True if all of them filled """
+
+    states = dict((result['id'], result['state']) for result in results)
+    deadline = time.time() + timeout
+    while True:
+        states = dict((order_id, state if state in TERMINAL_STATES else client.get_order(order_id).get('state'))
+                      for order_id, state in states.items())
+        if all(state in TERMINAL_STATES for state in states.values()) or time.time() >= deadline:
+            return all(state == 'filled' for state in states.values())
+        time.sleep(poll)
+
+
+def execute(client, intents, timeout=30.0, poll=1.0):
+    """Send sells as one basket, then buys as another
+
+        Buys wait for the sells to fill, up to `timeout` seconds, and for
+        a fresh `get_account` so their proceeds count as buying power.
+        Buys are not sent unless every sell filled.
+
+        Returns:
+            (:obj:`tuple`): (sell results, buy results) from
+                `place_basket_order`, buy results empty if not sent
+    """
+
+    sells = [intent for intent in intents if intent['transaction'] == 'sell']
+    buys = [intent for intent in intents if intent['transaction'] == 'buy']
+
+    sell_results = client.place_basket_order(sells) if sells else []
+    if any(result['error'] for result in sell_results):
+        return sell_results, []
+    if sell_results and not _filled(client, sell_results, timeout, poll):
+        return sell_results, []
+
+    if not buys:
+        return sell_results, []
+    client.get_account()
+    return sell_results, client.place_basket_order(buys)
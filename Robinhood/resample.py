@@ -0,0 +1,148 @@
+"""resample.py: derive coarser bars from finer intraday bars
+
+Works on the bar columns produced by `bars.historicals_to_bars` or read from
+a `bars.BarStore`, e.g. one stored week of 5minute bars gives 15minute,
+30minute, hour or day bars without another `historicals` call::
+
+    hourly = resample(store.read('AAPL', '5minute'), 'hour')
+"""
+
+import datetime
+import re
+
+import numpy as np
+
+from dateutil import tz
+
+from .Robinhood import Bounds
+from .bars import COLUMNS
+
+MARKET_TZ = tz.gettz('America/New_York')
+
+# Trading session segments in exchange local time, as seconds since midnight.
+# Bars never straddle a segment boundary, so pre-market, regular and
+# after-hours bars are aggregated separately.
+SESSIONS = {
+    Bounds.REGULAR: ((9 * 3600 + 1800, 16 * 3600),),
+    Bounds.EXTENDED: ((9 * 3600, 9 * 3600 + 1800),
+                      (9 * 3600 + 1800, 16 * 3600),
+                      (16 * 3600, 18 * 3600)),
+}
+
+_UNITS = {'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def interval_seconds(interval):
+    """Parse an interval such as '30minute', 'hour' or '2hour'
+
+        Returns:
+            (int): interval length in seconds
+    """
+
+    match = re.match(r'^(\d*)(minute|hour|day)$', interval)
+    if not match:
+        raise ValueError('Invalid interval: ' + interval)
+
+    return int(match.group(1) or 1) * _UNITS[match.group(2)]
+
+
+def utc_offsets(begins_at):
+    """Exchange timezone offset in seconds for every timestamp
+
+        The offset is looked up once per distinct UTC day. DST switches
+        happen on weekend nights, so a trading day never spans two offsets.
+    """
+
+    days, inverse = np.unique(begins_at.astype('datetime64[D]'), return_inverse=True)
+    offsets = np.empty(len(days), dtype='i8')
+    for i, day in enumerate(days.astype(datetime.datetime)):
+        noon = datetime.datetime(day.year, day.month, day.day, 12, tzinfo=tz.UTC)
+        offsets[i] = int(noon.astimezone(MARKET_TZ).utcoffset().total_seconds())
+
+    return offsets[inverse.ravel()]
+
+
+def _empty(bars):
+    empty = {col: np.asarray(bars[col])[:0] for col in COLUMNS}
+    empty['vwap'] = np.empty(0, dtype='f8')
+    return empty
+
+
+def resample(bars, interval, bounds=Bounds.REGULAR):
+    """Aggregate intraday bars into coarser bars
+
+        Buckets are anchored at the start of each session segment, so
+        hourly regular-hours bars begin at 9:30, 10:30, ... exchange time.
+        Bars outside the sessions of `bounds` are dropped.
+
+        Args:
+            bars (:obj:`dict`): bar columns sorted by `begins_at`
+            interval (str): target interval, e.g. '30minute', 'hour', 'day'
+            bounds (:enum:`Bounds`, optional): 'extended' or 'regular'
+
+        Returns:
+            (:obj:`dict`): bar columns plus `vwap`, one row per bucket
+    """
+
+    if isinstance(bounds, str):
+        bounds = Bounds(bounds)
+
+    step = interval_seconds(interval)
+    segments = np.array(SESSIONS[bounds], dtype='i8')
+
+    begins_at = np.asarray(bars['begins_at']).astype('datetime64[s]')
+    if len(begins_at) == 0:
+        return _empty(bars)
+
+    seconds = begins_at.astype('i8')
+    offsets = utc_offsets(begins_at)
+    local = seconds + offsets
+    day = local // 86400
+    clock = local % 86400
+
+    segment = np.searchsorted(segments[:, 0], clock, side='right') - 1
+    keep = (segment >= 0) & (clock < segments[np.maximum(segment, 0), 1])
+    if step >= 86400:
+        # whole trading day per bar, irrespective of segments
+        segment[:] = 0
+
+    idx = np.flatnonzero(keep)
+    day, clock, segment, offsets = day[idx], clock[idx], segment[idx], offsets[idx]
+    if len(idx) == 0:
+        return _empty(bars)
+
+    if step >= 86400:
+        anchor = np.full(len(idx), segments[0, 0])
+        bucket = np.zeros(len(idx), dtype='i8')
+    else:
+        anchor = segments[segment, 0]
+        bucket = (clock - anchor) // step
+
+    key = (day * len(segments) + segment) * (86400 // min(step, 86400) + 1) + bucket
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(key)) + 1))
+    ends = np.concatenate((starts[1:], [len(key)]))
+
+    high = np.asarray(bars['high'])[idx]
+    low = np.asarray(bars['low'])[idx]
+    close = np.asarray(bars['close'])[idx]
+    volume = np.asarray(bars['volume'])[idx]
+
+    typical = (high + low + close) / 3.0
+    pv = np.add.reduceat(typical * volume, starts)
+    total_volume = np.add.reduceat(volume, starts)
+    last_close = close[ends - 1]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        vwap = np.where(total_volume > 0, pv / total_volume, last_close)
+
+    bucket_start = day[starts] * 86400 + anchor[starts] + bucket[starts] * step - offsets[starts]
+
+    return {
+        'begins_at': bucket_start.astype('datetime64[s]'),
+        'open': np.asarray(bars['open'])[idx][starts],
+        'high': np.maximum.reduceat(high, starts),
+        'low': np.minimum.reduceat(low, starts),
+        'close': last_close,
+        'volume': total_volume,
+        'vwap': vwap,
+    }
@@ -0,0 +1,149 @@
+"""risk.py: portfolio risk from holdings and locally stored daily bars
+
+`portfolio_risk` takes the close matrix of a `backtest.align` market, the
+held quantities and a benchmark close series, and computes everything with
+a handful of matrix products::
+
+    market = align(dict((s, store.read(s, 'day')) for s in symbols + ['SPY']))
+    report = portfolio_risk(quantities, market['close'][:-1], market['close'][-1])
+
+Returns are simple daily returns. A day a symbol has no bar, including
+before its first one, counts as a zero return, so short histories shrink
+its volatility rather than the window of everything else. VaR and expected
+shortfall are one-day losses in dollars, positive numbers being losses.
+"""
+
+import numpy as np
+
+# Trading days per year, to annualize daily figures
+TRADING_DAYS = 252
+
+# One-sided standard normal quantiles for parametric VaR
+Z_SCORES = {0.95: 1.6448536269514722, 0.99: 2.3263478740408408}
+
+
+def daily_returns(close):
+    """Simple returns along the last axis, missing ones 0
+
+        Args:
+            close (:obj:`numpy.ndarray`): (..., bars) closes
+
+        Returns:
+            (:obj:`numpy.ndarray`): (..., bars - 1) returns
+    """
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = close[..., 1:] / close[..., :-1] - 1.0
+
+    return np.where(np.isfinite(returns), returns, 0.0)
+
+
+def covariance(returns):
+    """Sample covariance of the rows of a (symbols, days) return matrix """
+
+    centered = returns - returns.mean(axis=-1, keepdims=True)
+    return centered @ centered.T / max(returns.shape[-1] - 1, 1)
+
+
+def concentration(values):
+    """Concentration of position values
+
+        Returns:
+            (:obj:`dict`): `weights`, `largest` and `top5` weights, `hhi`
+                (Herfindahl index, sum of squared weights) and
+                `effective_n` (1 / hhi)
+    """
+
+    total = np.abs(values).sum()
+    weights = values / total if total else np.zeros_like(values)
+    hhi = float((weights ** 2).sum())
+    ranked = np.sort(np.abs(weights))[::-1]
+
+    return {
+        'weights': weights,
+        'largest': float(ranked[0]) if len(ranked) else 0.0,
+        'top5': float(ranked[:5].sum()),
+        'hhi': hhi,
+        'effective_n': 1.0 / hhi if hhi else 0.0,
+    }
+
+
+def portfolio_risk(quantity, close, benchmark=None, confidence=(0.95, 0.99)):
+    """Risk of holding `quantity` shares at the last closes
+
+        Args:
+            quantity (:obj:`numpy.ndarray`): (symbols,) shares held
+            close (:obj:`numpy.ndarray`): (symbols, bars) daily closes
+                from `backtest.align`, the window to measure over
+            benchmark (:obj:`numpy.ndarray`, optional): (bars,) closes of
+                the benchmark on the same timeline, for betas
+            confidence (tuple): VaR levels, keys of `Z_SCORES`
+
+        Returns:
+            (:obj:`dict`): `positions`, a dict of per symbol arrays
+                `price`, `value`, `weight`, `volatility` (annualized),
+                `beta` and `contribution` (share of portfolio variance);
+                portfolio `value`, `volatility` (annualized), `beta`,
+                `days` of returns, annualized `covariance` matrix, `var`,
+                `parametric_var` and `expected_shortfall` dicts by
+                confidence level, and the `concentration` dict
+    """
+
+    quantity = np.asarray(quantity, dtype='f8')
+    close = np.asarray(close, dtype='f8')
+    returns = daily_returns(close)
+    days = returns.shape[-1]
+
+    # `align` carries closes forward, NaN only if a symbol has no bars
+    price = close[:, -1] if close.shape[-1] else np.full(len(quantity), np.nan)
+    value = np.nan_to_num(quantity * price)
+    total = value.sum()
+
+    cov = covariance(returns)
+    variance = float(value @ cov @ value)
+    sigma = np.sqrt(max(variance, 0.0))
+    marginal = cov @ value
+    contribution = value * marginal / variance if variance > 0 else np.zeros_like(value)
+
+    # dollar P&L the current holdings would have made each day
+    pnl = np.sort(value @ returns)
+    var, parametric_var, shortfall = {}, {}, {}
+    for level in confidence:
+        if days:
+            cut = max(int(np.floor((1.0 - level) * days)), 1)
+            var[level] = -float(np.percentile(pnl, 100.0 * (1.0 - level)))
+            shortfall[level] = -float(pnl[:cut].mean())
+        else:
+            var[level] = shortfall[level] = np.nan
+        parametric_var[level] = Z_SCORES[level] * sigma
+
+    beta = np.full(len(value), np.nan)
+    portfolio_beta = np.nan
+    if benchmark is not None and days > 1:
+        market = daily_returns(np.asarray(benchmark, dtype='f8'))
+        centered = market - market.mean()
+        market_var = centered @ centered
+        if market_var > 0:
+            beta = (returns - returns.mean(axis=-1, keepdims=True)) @ centered / market_var
+            portfolio_beta = float(value @ beta / total) if total else np.nan
+
+    weights = concentration(value)
+    return {
+        'positions': {
+            'price': price,
+            'value': value,
+            'weight': weights['weights'],
+            'volatility': np.sqrt(np.diag(cov) * TRADING_DAYS),
+            'beta': beta,
+            'contribution': contribution,
+        },
+        'value': total,
+        'volatility': sigma / total * np.sqrt(TRADING_DAYS) if total else np.nan,
+        'beta': portfolio_beta,
+        'days': days,
+        'covariance': cov * TRADING_DAYS,
+        'var': var,
+        'parametric_var': parametric_var,
+        'expected_shortfall': shortfall,
+        'concentration': weights,
+    }
@@ -0,0 +1,248 @@
+"""screen.py: stock screener over batched, daily cached fundamentals
+
+`FundamentalsCache` loads fundamentals for a universe of symbols with one
+`fundamentals/?symbols=` call per `chunk_size` symbols, chunks dispatched
+under `client.rate_limiter`, and keeps them for the rest of the day.
+`screen` turns them into column arrays and evaluates a filter expression
+over all symbols at once::
+
+    cache = FundamentalsCache('fundamentals.data')
+    data = cache.load(client, client.get_tickers_by_tag('100-most-popular'))
+    matches = screen(data, 'pe < 20 and market_cap > 1e10')
+
+Expressions use field names (see `FIELDS`, with the `ALIASES` short
+forms), numbers, strings, arithmetic, comparisons, `and`, `or` and `not`.
+A comparison with a missing value is false, so `not` of it is true.
+"""
+
+import ast
+import datetime
+import json
+import logging
+import operator
+
+import numpy as np
+
+from .ratelimit import dispatch
+
+logger = logging.getLogger('Robinhood')
+
+NUMERIC_FIELDS = ('open', 'high', 'low', 'volume', 'average_volume', 'average_volume_2_weeks',
+                  'high_52_weeks', 'low_52_weeks', 'market_cap', 'pe_ratio', 'pb_ratio',
+                  'dividend_yield', 'shares_outstanding', 'float', 'num_employees', 'year_founded')
+TEXT_FIELDS = ('symbol', 'sector', 'industry')
+FIELDS = NUMERIC_FIELDS + TEXT_FIELDS
+
+ALIASES = {
+    'pe': 'pe_ratio',
+    'pb': 'pb_ratio',
+    'cap': 'market_cap',
+    'div_yield': 'dividend_yield',
+    'employees': 'num_employees',
+}
+
+_COMPARE = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+
+_ARITHMETIC = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+}
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class FundamentalsCache:
+    """Fundamentals by symbol, kept in a JSON file for the day they were fetched
+
+        Args:
+            path (str): cache file, replaced when a new day starts
+            chunk_size (int): symbols per `get_fundamentals_list` call
+            max_workers (int): concurrent calls
+    """
+
+    def __init__(self, path='fundamentals.data', chunk_size=100, max_workers=4):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.day = None
+        self.data = {}
+
+        try:
+            with open(path) as cache_file:
+                cached = json.load(cache_file)
+            self.day, self.data = cached['day'], cached['data']
+        except (IOError, ValueError, KeyError):
+            pass
+
+    def load(self, client, symbols):
+        """Fundamentals of `symbols`, fetching those not cached today
+
+            Returns:
+                (:obj:`dict`): symbol -> fundamentals dict, unknown
+                    symbols left out
+        """
+
+        today = datetime.date.today().isoformat()
+        if self.day != today:
+            self.day, self.data = today, {}
+
+        symbols = [symbol.upper() for symbol in symbols]
+        missing = sorted(set(symbol for symbol in symbols if symbol not in self.data))
+        if missing:
+            chunks = [missing[i:i + self.chunk_size] for i in range(0, len(missing), self.chunk_size)]
+            for chunk, (results, ex) in zip(chunks, dispatch(client.get_fundamentals_list, chunks,
+                                                             self.max_workers, client.rate_limiter)):
+                if ex is not None:
+                    logger.warning('fundamentals failed for %d symbols: %r', len(chunk), ex)
+                    continue
+                # results follow the order of the query, None for unknown symbols
+                for symbol, fundamentals in zip(chunk, results):
+                    self.data[symbol] = fundamentals
+
+            with open(self.path, 'w') as cache_file:
+                json.dump({'day': self.day, 'data': self.data}, cache_file)
+
+        return dict((symbol, self.data[symbol]) for symbol in symbols if self.data.get(symbol))
+
+
+def columns(fundamentals):
+    """Fundamentals as one array per field of `FIELDS`, rows sorted by symbol
+
+        Numeric fields are float64 with NaN for missing values, text fields
+        object arrays.
+    """
+
+    symbols = sorted(fundamentals)
+    data = {'symbol': np.array(symbols, dtype=object)}
+    for field in NUMERIC_FIELDS:
+        data[field] = np.array([_float(fundamentals[symbol].get(field)) for symbol in symbols], dtype='f8')
+    for field in TEXT_FIELDS[1:]:
+        data[field] = np.array([fundamentals[symbol].get(field) or '' for symbol in symbols], dtype=object)
+
+    return data
+
+
+def field_names(expression):
+    """Fields an expression refers to, aliases resolved, in order of use """
+
+    names = []
+    for node in ast.walk(ast.parse(expression, mode='eval')):
+        if isinstance(node, ast.Name):
+            name = ALIASES.get(node.id, node.id)
+            if name not in names:
+                names.append(name)
+
+    return names
+
+
+def _evaluate(node, data):
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body, data)
+
+    if isinstance(node, ast.BoolOp):
+        values = [np.asarray(_evaluate(value, data), dtype=bool) for value in node.values]
+        combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        result = values[0]
+        for value in values[1:]:
+            result = combine(result, value)
+        return result
+
+    if isinstance(node, ast.UnaryOp):
+        value = _evaluate(node.operand, data)
+        if isinstance(node.op, ast.Not):
+            return np.logical_not(np.asarray(value, dtype=bool))
+        if isinstance(node.op, ast.USub):
+            return -value
+        if isinstance(node.op, ast.UAdd):
+            return value
+
+    if isinstance(node, ast.Compare):
+        left = _evaluate(node.left, data)
+        result = True
+        for op, right in zip(node.ops, node.comparators):
+            if type(op) not in _COMPARE:
+                break
+            right = _evaluate(right, data)
+            result = np.logical_and(result, _COMPARE[type(op)](left, right))
+            left = right
+        else:
+            return result
+
+    if isinstance(node, ast.BinOp) and type(node.op) in _ARITHMETIC:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return _ARITHMETIC[type(node.op)](_evaluate(node.left, data), _evaluate(node.right, data))
+
+    if isinstance(node, ast.Name):
+        name = ALIASES.get(node.id, node.id)
+        if name not in data:
+            raise ValueError('Unknown field ' + node.id)
+        return data[name]
+
+    # numbers and strings, ast.Num and ast.Str before Python 3.8
+    if type(node).__name__ in ('Constant', 'Num', 'Str'):
+        value = node.value if hasattr(node, 'value') else getattr(node, 'n', getattr(node, 's', None))
+        if isinstance(value, (int, float, str)) and not isinstance(value, bool):
+            return value
+
+    raise ValueError('Unsupported expression: ' + type(node).__name__)
+
+
+def evaluate(expression, data):
+    """Boolean mask of the rows of `columns` output matching `expression`
+
+        Raises:
+            ValueError: for syntax errors, unknown fields or unsupported
+                constructs (calls, attributes, subscripts, ...)
+    """
+
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError as ex:
+        raise ValueError('Bad expression: ' + str(ex.msg))
+
+    try:
+        mask = _evaluate(tree, data)
+    except TypeError as ex:
+        # e.g. a number compared with a text field
+        raise ValueError('Bad expression: ' + str(ex))
+
+    return np.broadcast_to(np.asarray(mask, dtype=bool), data['symbol'].shape)
+
+
+def screen(fundamentals, expression, sort='market_cap'):
+    """Rows of `fundamentals` matching `expression`
+
+        Args:
+            fundamentals (dict): symbol -> fundamentals dict
+            expression (str): filter, see the module docstring
+            sort (str): field to sort matches by, descending
+
+        Returns:
+            (:obj:`dict`): `columns` output restricted to the matches
+    """
+
+    data = columns(fundamentals)
+    mask = evaluate(expression, data) if expression.strip() else np.ones(len(data['symbol']), dtype=bool)
+    rows = np.flatnonzero(mask)
+
+    sort = ALIASES.get(sort, sort)
+    if sort in NUMERIC_FIELDS:
+        # NaN last
+        key = data[sort][rows]
+        rows = rows[np.argsort(np.where(np.isnan(key), np.inf, -key), kind='stable')]
+
+    return dict((field, values[rows]) for field, values in data.items())
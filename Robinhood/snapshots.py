@@ -0,0 +1,380 @@
+"""snapshots.py: append-only time series of account and position snapshots
+
+`SnapshotRecorder` samples `portfolios`, `get_account`, `securities_owned`
+and position quotes every `interval` seconds into a `SnapshotStore`. The
+store keeps two files of fixed-size NumPy records, appended to and never
+rewritten::
+
+    <root>/account.dat    time, equity, market_value, buying_power
+    <root>/positions.dat  time, symbol, quantity, price
+
+A record is only written when its values differ from the last one of the
+same series (the account, or one symbol), so a quiet market or a closed one
+adds nothing. Values hold until the next record; a position that is closed
+gets one record with quantity 0. Reads memory-map the files and a range
+query is a `searchsorted` on `time`::
+
+    store = SnapshotStore('snapshots')
+    SnapshotRecorder(client, store, interval=60).start()
+    times, equity = store.equity_curve(start='2018-06-15T13:30')
+    worst = drawdown(times, equity)
+"""
+
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from .export import api_pages
+from .history import InstrumentResolver
+
+ACCOUNT_DTYPE = np.dtype([
+    ('time', 'datetime64[s]'),
+    ('equity', 'f8'),
+    ('market_value', 'f8'),
+    ('buying_power', 'f8'),
+])
+
+POSITION_DTYPE = np.dtype([
+    ('time', 'datetime64[s]'),
+    ('symbol', 'S16'),
+    ('quantity', 'f8'),
+    ('price', 'f8'),
+])
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _same(a, b):
+    # NaN (no quote) equals NaN here
+    return a == b or (a != a and b != b)
+
+
+def _time(value):
+    return None if value is None else np.datetime64(value, 's')
+
+
+def _columns(records):
+    return dict((name, records[name]) for name in records.dtype.names)
+
+
+class SnapshotStore:
+    """Append-only store of account and position snapshots """
+
+    def __init__(self, root='snapshots'):
+        self.root = root
+        self.lock = threading.Lock()
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+        # last written values of every series, for deduplication
+        self.last_account = None
+        self.last_positions = {}
+        self.last_time = None
+
+        account = self._read('account', ACCOUNT_DTYPE)
+        if len(account):
+            last = account[-1]
+            self.last_account = (last['equity'], last['market_value'], last['buying_power'])
+            self.last_time = last['time']
+
+        positions = self._read('positions', POSITION_DTYPE)
+        if len(positions):
+            # last record of each symbol: first occurrence in the reversed file
+            symbols, first = np.unique(positions['symbol'][::-1], return_index=True)
+            last = positions[len(positions) - 1 - first]
+            self.last_positions = dict((symbol.decode(), (quantity, price)) for symbol, quantity, price
+                                       in zip(symbols, last['quantity'], last['price']))
+            if self.last_time is None or positions['time'][-1] > self.last_time:
+                self.last_time = positions['time'][-1]
+
+    def _path(self, name):
+        return os.path.join(self.root, name + '.dat')
+
+    def _read(self, name, dtype):
+        """Records of a file, memory-mapped; a torn last record is ignored """
+
+        path = self._path(name)
+        count = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+        if not count:
+            return np.empty(0, dtype=dtype)
+
+        return np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+    def _append(self, name, records):
+        path = self._path(name)
+        with open(path, 'ab') as out:
+            # drop a torn record left by a crash so records stay aligned
+            size = out.tell()
+            if size % records.dtype.itemsize:
+                out.truncate(size - size % records.dtype.itemsize)
+            records.tofile(out)
+
+    def append(self, now, account, positions):
+        """Record one snapshot, skipping values that did not change
+
+            Args:
+                now (float): snapshot time, seconds since the epoch
+                account (dict): `equity`, `market_value` and `buying_power`
+                positions (dict): symbol -> (quantity, price) of every
+                    position held; symbols left out are recorded as closed
+
+            Returns:
+                (:obj:`tuple`): (account records, position records) written
+        """
+
+        at = np.datetime64(int(now), 's')
+        with self.lock:
+            if self.last_time is not None and at < self.last_time:
+                raise ValueError('Snapshot at {} is older than the last one'.format(at))
+
+            values = (_float(account.get('equity')), _float(account.get('market_value')),
+                      _float(account.get('buying_power')))
+            account_written = 0
+            if self.last_account is None or not all(map(_same, values, self.last_account)):
+                self._append('account', np.array([(at,) + values], dtype=ACCOUNT_DTYPE))
+                self.last_account = values
+                account_written = 1
+
+            current = dict((symbol.upper(), (_float(quantity), _float(price)))
+                           for symbol, (quantity, price) in positions.items())
+            for symbol, (quantity, price) in self.last_positions.items():
+                if symbol not in current and quantity:
+                    current[symbol] = (0.0, price)
+
+            changed = [(at, symbol.encode(), quantity, price)
+                       for symbol, (quantity, price) in sorted(current.items())
+                       if symbol not in self.last_positions or
+                       not all(map(_same, (quantity, price), self.last_positions[symbol]))]
+            if changed:
+                self._append('positions', np.array(changed, dtype=POSITION_DTYPE))
+                for _, symbol, quantity, price in changed:
+                    self.last_positions[symbol.decode()] = (quantity, price)
+
+            self.last_time = at
+
+        return account_written, len(changed)
+
+    def account(self, start=None, end=None):
+        """Account records with `start` <= time < `end`
+
+            Returns:
+                (:obj:`dict`): column name -> read-only memory-mapped
+                    :obj:`numpy.ndarray` view
+        """
+
+        records = self._read('account', ACCOUNT_DTYPE)
+        lo, hi = 0, len(records)
+        if start is not None:
+            lo = np.searchsorted(records['time'], _time(start), side='left')
+        if end is not None:
+            hi = np.searchsorted(records['time'], _time(end), side='left')
+
+        return _columns(records[lo:hi])
+
+    def positions(self, start=None, end=None, symbol=None):
+        """Position records with `start` <= time < `end`, optionally of one symbol
+
+            Returns:
+                (:obj:`dict`): column name -> :obj:`numpy.ndarray`, `symbol`
+                    as an array of str
+        """
+
+        records = self._read('positions', POSITION_DTYPE)
+        lo, hi = 0, len(records)
+        if start is not None:
+            lo = np.searchsorted(records['time'], _time(start), side='left')
+        if end is not None:
+            hi = np.searchsorted(records['time'], _time(end), side='left')
+        records = records[lo:hi]
+        if symbol is not None:
+            records = records[records['symbol'] == symbol.upper().encode()]
+
+        columns = _columns(records)
+        columns['symbol'] = columns['symbol'].astype(str)
+        return columns
+
+    def holdings_at(self, at=None):
+        """Symbol -> (quantity, price) of positions held at time `at`, the latest if None """
+
+        positions = self.positions(end=None if at is None else _time(at) + np.timedelta64(1, 's'))
+        if not len(positions['time']):
+            return {}
+
+        symbols, first = np.unique(positions['symbol'][::-1], return_index=True)
+        last = len(positions['time']) - 1 - first
+        return dict((str(symbol), (positions['quantity'][i], positions['price'][i]))
+                    for symbol, i in zip(symbols, last) if positions['quantity'][i])
+
+    def equity_curve(self, start=None, end=None, field='equity'):
+        """Account `field` over time as a step series
+
+            The value in effect at `start` is included, dated `start`, so
+            the curve starts at `start` even if nothing changed there.
+
+            Returns:
+                (:obj:`tuple`): (times, values) arrays
+        """
+
+        records = self._read('account', ACCOUNT_DTYPE)
+        lo, hi = 0, len(records)
+        if start is not None:
+            lo = np.searchsorted(records['time'], _time(start), side='right')
+        if end is not None:
+            hi = np.searchsorted(records['time'], _time(end), side='left')
+
+        times = np.array(records['time'][lo:hi])
+        values = np.array(records[field][lo:hi])
+        if lo > 0 and lo <= hi:
+            times = np.concatenate(([_time(start)], times))
+            values = np.concatenate(([records[field][lo - 1]], values))
+
+        return times, values
+
+
+def resample(times, values, every):
+    """A step series sampled every `every` from its first time, plus its last
+
+        Args:
+            every (:obj:`numpy.timedelta64`): sampling interval
+
+        Returns:
+            (:obj:`tuple`): (sample times, values in effect at them)
+    """
+
+    if not len(times):
+        return times, values
+
+    at = np.append(np.arange(times[0], times[-1], every), times[-1])
+    return at, values[np.searchsorted(times, at, side='right') - 1]
+
+
+def drawdown(times, values):
+    """Drawdowns of a value series from its running peak
+
+        Returns:
+            (:obj:`dict`): `drawdown` array (fraction below the peak),
+                `max_drawdown` fraction and `max_loss` amount, `peak_at` and
+                `trough_at` times of the worst one, None when empty
+    """
+
+    if not len(values):
+        return None
+
+    peaks = np.maximum.accumulate(values)
+    drawdowns = np.where(peaks > 0, 1.0 - values / np.where(peaks > 0, peaks, 1.0), 0.0)
+    trough = int(np.argmax(drawdowns))
+    peak = int(np.argmax(values[:trough + 1]))
+
+    return {
+        'drawdown': drawdowns,
+        'max_drawdown': drawdowns[trough],
+        'max_loss': values[peak] - values[trough],
+        'peak_at': times[peak],
+        'trough_at': times[trough],
+    }
+
+
+class SnapshotRecorder:
+    """Take snapshots of the account into a `SnapshotStore`
+
+        Each `snapshot` makes four calls: `portfolios`, `get_account`,
+        `securities_owned` and one `get_stock_marketdata` for every
+        position's price. Callers that already fetched those can hand them
+        to `record` instead.
+    """
+
+    logger = logging.getLogger('Robinhood')
+
+    def __init__(self, client, store, interval=60.0):
+        self.client = client
+        self.store = store
+        self.interval = interval
+        self.resolver = InstrumentResolver(client)
+
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def record(self, portfolio, account, positions, quotes, now=None):
+        """Store a snapshot from API payloads
+
+            Args:
+                portfolio (dict): `portfolios` payload
+                account (dict): `get_account` payload
+                positions (list): `securities_owned` results
+                quotes (list): `get_stock_marketdata` results for
+                    `positions`, in the same order
+
+            Returns:
+                (:obj:`tuple`): see `SnapshotStore.append`
+        """
+
+        equity = portfolio.get('extended_hours_equity') or portfolio.get('equity')
+        market_value = portfolio.get('extended_hours_market_value') or portfolio.get('market_value')
+        buying_power = (account.get('margin_balances') or {}).get('unallocated_margin_cash',
+                                                                 account.get('buying_power'))
+
+        symbols = self.resolver.resolve([position['instrument'] for position, quote
+                                         in zip(positions, quotes) if not quote])
+        held = {}
+        for position, quote in zip(positions, quotes):
+            symbol = quote['symbol'] if quote else symbols.get(position['instrument'])
+            if not symbol:
+                continue
+            price = None
+            if quote:
+                price = quote.get('last_extended_hours_trade_price') or quote.get('last_trade_price')
+            held[symbol] = (position['quantity'], price)
+
+        return self.store.append(now or time.time(),
+                                 {'equity': equity, 'market_value': market_value, 'buying_power': buying_power},
+                                 held)
+
+    def snapshot(self, now=None):
+        """Fetch and store one snapshot, see `record` """
+
+        portfolio = self.client.portfolios()
+        account = self.client.get_account()
+        positions = []
+        for results in api_pages(self.client, self.client.securities_owned()):
+            positions.extend(results)
+        quotes = self.client.get_stock_marketdata([p['instrument'] for p in positions]) if positions else []
+
+        return self.record(portfolio, account, positions, quotes, now)
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                self.snapshot()
+            except Exception as ex:
+                self.logger.warning('snapshot failed: %r', ex)
+            self.stopped.wait(self.interval)
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        """Snapshot in a background daemon thread """
+
+        if self.running():
+            return
+
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, name='SnapshotRecorder')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop the background thread """
+
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
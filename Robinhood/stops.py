@@ -0,0 +1,413 @@
+"""stops.py: client-side stop-loss, trailing, bracket and time exits
+
+`StopEngine` watches prices through a `quotes.QuotePoller` and sells with
+`place_market_sell_order` or `place_limit_sell_order` once an exit triggers.
+Nothing rests on the server until then. Stops are saved to a JSON file on
+every change, so they survive restarts. A time exit that passed while the
+engine was not running is not sold on load, it waits in `expired` until
+`resolve_expired` sells it or drops its exit time. A triggered stop is only
+dropped once its sell order is accepted; if the sell fails it waits in
+`failed` until `retry` or `remove`::
+
+    engine = StopEngine(client, 'stops.data')
+    poller.subscribe(engine)
+    engine.add('AAPL', instrument_url, 10, trail=5, trail_percent=True)
+"""
+
+import json
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+
+from .quotes import Levels
+
+
+def _exit_level(stop):
+    """Price at or below which the stop sells """
+
+    levels = []
+    if stop.get('stop'):
+        levels.append(stop['stop'])
+    if stop.get('trail'):
+        if stop.get('trail_percent'):
+            levels.append(stop['peak'] * (1.0 - stop['trail'] / 100.0))
+        else:
+            levels.append(stop['peak'] - stop['trail'])
+
+    return max(levels) if levels else None
+
+
+class StopEngine:
+    """Local exits for long positions, evaluated against polled quotes
+
+        Every stop sells `quantity` shares of one symbol when the first of
+        its exits triggers:
+
+        * `stop`: price at or below a fixed level
+        * `trail`: price falls `trail` dollars (or percent with
+          `trail_percent`) below the highest price seen since it was added
+        * `target`: price at or above a take-profit level; together with
+          `stop` or `trail` this is a bracket, whichever side hits first
+          cancels the other
+        * `exit_at`: epoch seconds after which the position is sold anyway
+
+        Per symbol, exit levels, targets and trailing peaks are each kept
+        in a sorted `quotes.Levels`, so a quote only touches the stops whose
+        level it crossed. The sell is a market order, or a limit order at
+        `limit` if one is set.
+
+        Callbacks registered with `on` get (stop, response, exception) for
+        every triggered stop. A stop stays saved while its sell is in
+        flight, and goes to `failed`, with the reason under `error`, when
+        the sell raises or is not accepted.
+    """
+
+    logger = logging.getLogger('Robinhood')
+
+    def __init__(self, client, path='stops.data', price_field='last_trade_price'):
+        self.client = client
+        self.path = path
+        self.price_field = price_field
+
+        self.stops = {}
+        self.expired = {}
+        self.selling = {}
+        self.failed = {}
+        self.lower = {}
+        self.upper = {}
+        self.peaks = {}
+        self.exits = Levels()
+        self.callbacks = []
+        self.lock = threading.RLock()
+
+        self.load()
+
+    def on(self, callback):
+        """Register callback(stop, response, exception) for triggered stops """
+
+        self.callbacks.append(callback)
+
+    def load(self, now=None):
+        """Read stops saved by `save`, replacing the ones in memory
+
+            Stops whose exit time is before `now` go to `expired` instead.
+            Stops that had triggered go to `failed`, as their sell may not
+            have gone through.
+        """
+
+        try:
+            with open(self.path) as stops_file:
+                stops = json.load(stops_file)
+        except (IOError, OSError, ValueError):
+            stops = []
+
+        now = time.time() if now is None else now
+        with self.lock:
+            self.stops, self.expired, self.selling, self.failed = {}, {}, {}, {}
+            self.lower, self.upper, self.peaks = {}, {}, {}
+            self.exits = Levels()
+            for stop in stops:
+                if stop.get('triggered_at') is not None:
+                    stop.setdefault('error', 'interrupted')
+                    self.failed[stop['id']] = stop
+                elif stop.get('exit_at') and stop['exit_at'] <= now:
+                    self.expired[stop['id']] = stop
+                else:
+                    self._index(stop)
+
+    def save(self):
+        """Write all stops, expired, selling and failed ones included, atomically """
+
+        with self.lock:
+            stops = sorted(list(self.stops.values()) + list(self.expired.values()) +
+                           list(self.selling.values()) + list(self.failed.values()),
+                           key=lambda s: s['created_at'])
+            data = json.dumps(stops)
+
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as stops_file:
+            stops_file.write(data)
+        os.replace(tmp, self.path)
+
+    def _index(self, stop):
+        symbol = stop['symbol']
+        self.stops[stop['id']] = stop
+
+        stop['level'] = _exit_level(stop)
+        if stop['level'] is not None:
+            self.lower.setdefault(symbol, Levels()).add(stop['level'], stop['id'])
+        if stop.get('target'):
+            self.upper.setdefault(symbol, Levels()).add(stop['target'], stop['id'])
+        if stop.get('trail'):
+            self.peaks.setdefault(symbol, Levels()).add(stop['peak'], stop['id'])
+        if stop.get('exit_at'):
+            self.exits.add(stop['exit_at'], stop['id'])
+
+    def _unindex(self, stop):
+        symbol = stop['symbol']
+        self.stops.pop(stop['id'], None)
+
+        # levels already popped by a trigger are simply not found
+        for index, level in ((self.lower, stop['level']),
+                             (self.upper, stop.get('target')),
+                             (self.peaks, stop['peak'] if stop.get('trail') else None)):
+            if level is not None and symbol in index:
+                index[symbol].remove(level, stop['id'])
+                if not len(index[symbol]):
+                    del index[symbol]
+        if stop.get('exit_at'):
+            self.exits.remove(stop['exit_at'], stop['id'])
+
+    def add(self, symbol, instrument, quantity, stop=None, limit=None, trail=None,
+            trail_percent=False, target=None, exit_at=None, price=None):
+        """Add a local stop
+
+            Args:
+                symbol (str): stock ticker
+                instrument (str): instrument URL, needed by the sell order
+                quantity (int): shares to sell
+                stop (float, optional): fixed stop level
+                limit (float, optional): sell with a limit order at this
+                    price instead of a market order
+                trail (float, optional): trailing distance
+                trail_percent (bool): `trail` is a percentage of the peak
+                target (float, optional): take-profit level
+                exit_at (float, optional): epoch seconds to exit at
+                price (float, optional): current price, the starting peak
+                    of a trailing stop
+
+            Returns:
+                (:obj:`dict`): the stop
+        """
+
+        if stop is None and trail is None and target is None and exit_at is None:
+            raise ValueError('Stop needs a stop, trail, target or exit time')
+        if int(quantity) <= 0:
+            raise ValueError('Quantity must be positive')
+        if trail is not None and (trail <= 0 or (trail_percent and trail >= 100)):
+            raise ValueError('Invalid trailing distance')
+        if stop and target and target <= stop:
+            raise ValueError('Target must be above the stop')
+        if exit_at is not None and exit_at <= time.time():
+            raise ValueError('Exit time has passed')
+
+        record = {
+            'id': uuid.uuid4().hex,
+            'symbol': symbol.upper(),
+            'instrument': instrument,
+            'quantity': int(quantity),
+            'stop': stop,
+            'limit': limit,
+            'trail': trail,
+            'trail_percent': bool(trail_percent),
+            'peak': (price or 0.0) if trail else None,
+            'target': target,
+            'exit_at': exit_at,
+            'created_at': time.time(),
+        }
+        with self.lock:
+            self._index(record)
+        self.save()
+
+        return record
+
+    def remove(self, stop_id):
+        """Remove a stop, or a failed one, without selling
+
+            Returns:
+                (:obj:`dict`): the removed stop, or None if unknown
+        """
+
+        with self.lock:
+            stop = self.stops.get(stop_id)
+            if stop is not None:
+                self._unindex(stop)
+            else:
+                stop = self.failed.pop(stop_id, None)
+        if stop is not None:
+            self.save()
+
+        return stop
+
+    def resolve_expired(self, stop_id, sell=False):
+        """Deal with a time exit that passed while the engine was not running
+
+            Args:
+                sell (bool): sell now; otherwise the stop loses its exit
+                    time and is kept if it has a stop, trail or target
+
+            Returns:
+                (:obj:`dict`): the stop, or None if unknown
+        """
+
+        with self.lock:
+            stop = self.expired.pop(stop_id, None)
+            if stop is not None and sell:
+                stop['reason'] = 'time'
+                stop['price'] = None
+                stop['triggered_at'] = time.time()
+                self.selling[stop_id] = stop
+            elif stop is not None:
+                stop['exit_at'] = None
+                if stop.get('stop') or stop.get('trail') or stop.get('target'):
+                    self._index(stop)
+        if stop is None:
+            return None
+
+        self.save()
+        if sell:
+            self._fire(stop)
+
+        return stop
+
+    def retry(self, stop_id):
+        """Send the sell of a failed stop again
+
+            Returns:
+                (:obj:`dict`): the stop, or None if unknown; still in
+                `failed` if the sell failed again
+        """
+
+        with self.lock:
+            stop = self.failed.pop(stop_id, None)
+            if stop is None:
+                return None
+            stop.pop('error', None)
+            self.selling[stop_id] = stop
+
+        self._fire(stop)
+
+        return stop
+
+    def list(self):
+        """Stops and failed stops, oldest first """
+
+        with self.lock:
+            return sorted(list(self.stops.values()) + list(self.failed.values()),
+                          key=lambda s: s['created_at'])
+
+    def symbols(self):
+        """Symbols with stops, polled by the `QuotePoller` """
+
+        with self.lock:
+            return set(stop['symbol'] for stop in self.stops.values())
+
+    def _trail(self, symbol, price):
+        """Move trailing stops of `symbol` up to a new high """
+
+        peaks = self.peaks.get(symbol)
+        if peaks is None:
+            return False
+
+        moved = peaks.raise_to(price)
+        for stop_id in moved:
+            stop = self.stops[stop_id]
+            stop['peak'] = price
+            level = _exit_level(stop)
+            if level != stop['level']:
+                lower = self.lower.setdefault(symbol, Levels())
+                if stop['level'] is not None:
+                    lower.remove(stop['level'], stop_id)
+                lower.add(level, stop_id)
+                stop['level'] = level
+
+        return bool(moved)
+
+    def _triggered(self, quotes, now):
+        """Move every stop a quote or the clock has triggered to `selling` """
+
+        fired = []
+        changed = False
+        with self.lock:
+            for symbol, quote in quotes.items():
+                try:
+                    price = float(quote[self.price_field])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if math.isnan(price) or price <= 0:
+                    continue
+
+                changed = self._trail(symbol, price) or changed
+
+                if symbol in self.lower:
+                    fired += [(i, 'stop', price) for i in self.lower[symbol].pop_at_or_above(price)]
+                if symbol in self.upper:
+                    fired += [(i, 'target', price) for i in self.upper[symbol].pop_at_or_below(price)]
+
+            fired += [(i, 'time', None) for i in self.exits.pop_at_or_below(now)]
+
+            triggered = []
+            for stop_id, reason, price in fired:
+                stop = self.stops.get(stop_id)
+                if stop is None:
+                    continue  # bracket already fired on its other side
+                self._unindex(stop)
+                stop['reason'] = reason
+                stop['price'] = price
+                stop['triggered_at'] = now
+                self.selling[stop_id] = stop
+                triggered.append(stop)
+
+        return triggered, changed or bool(triggered)
+
+    def sell(self, stop):
+        """Send the exit order of a stop
+
+            Returns:
+                (:obj:`requests.Response`): result of the order POST
+        """
+
+        if stop.get('limit'):
+            return self.client.place_limit_sell_order(instrument_URL=stop['instrument'],
+                                                      symbol=stop['symbol'],
+                                                      time_in_force='gfd',
+                                                      price=stop['limit'],
+                                                      quantity=stop['quantity'])
+
+        return self.client.place_market_sell_order(instrument_URL=stop['instrument'],
+                                                   symbol=stop['symbol'],
+                                                   time_in_force='gfd',
+                                                   quantity=stop['quantity'])
+
+    def on_quotes(self, quotes, now):
+        """Check quotes from a `QuotePoller` and sell what triggered
+
+            Returns:
+                (:obj:`list`): the triggered stops
+        """
+
+        triggered, changed = self._triggered(quotes, now)
+        if changed:
+            self.save()
+
+        for stop in triggered:
+            self._fire(stop)
+
+        return triggered
+
+    def _fire(self, stop):
+        """Sell a triggered stop, drop it once accepted and tell the callbacks """
+
+        res, error = None, None
+        try:
+            res = self.sell(stop)
+        except Exception as ex:
+            error = ex
+            self.logger.warning('stop %s sell failed: %r', stop['id'], ex)
+
+        with self.lock:
+            self.selling.pop(stop['id'], None)
+            if error is not None or res is None or res.status_code not in (200, 201):
+                stop['error'] = repr(error) if error is not None else \
+                    'HTTP {}'.format(None if res is None else res.status_code)
+                self.failed[stop['id']] = stop
+        self.save()
+
+        for callback in self.callbacks:
+            try:
+                callback(stop, res, error)
+            except Exception as ex:
+                self.logger.warning('stop callback failed: %r', ex)
@@ -1,58 +1,65 @@
-import json
-import csv
-import shelve
+"""Download the order history into `history.db` and export it
+
+Run from the repository root with `python -m Robinhood.trade_history_downloader`.
+Orders are synced incrementally, see `history.sync_orders`: after the first
+run only orders updated since the last one are downloaded, and a run that
+was interrupted picks up from its last stored page. The export is streamed
+from the database a page at a time, see `export.export_rows`, as CSV, NDJSON
+or typed columns (`--format parquet`, `npz` when pyarrow is missing).
+Positions and dividends can be exported the same way.
+"""
+
+import argparse
+import sys
 
 from Robinhood import Robinhood
+from Robinhood import export
+from Robinhood.export import FORMATS, LEVELS, api_pages, export_file
+from Robinhood.history import HistoryStore, InstrumentResolver, sync_orders
+
+
+def print_progress(stats):
+    sys.stdout.write("\r{pages} pages, {orders} orders, {pages_per_s:.1f} pages/s, "
+                     "{orders_per_s:.0f} orders/s".format(**stats))
+    sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Download the Robinhood order history')
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--level', choices=LEVELS, default='orders',
+                        help='one row per order or per execution')
+    parser.add_argument('-o', '--output', help='defaults to <level>.<format>, e.g. orders.csv')
+    parser.add_argument('--positions', action='store_true', help='also export positions.<format>')
+    parser.add_argument('--dividends', action='store_true', help='also export dividends.<format>')
+    args = parser.parse_args()
+
+    if args.format == 'parquet' and export.pa is None:
+        print("pyarrow is not installed, writing npz instead")
+        args.format = 'npz'
+
+    rb = Robinhood()
+    # !!!!!! change the username and passs, be careful when paste the code to public
+    rb.login(username="name", password="pass")
+
+    store = HistoryStore('history.db')
+    stats = sync_orders(rb, store, print_progress)
+    print("\n{new} new, {updated} updated orders in {seconds:.1f}s".format(**stats) +
+          (" (resumed)" if stats['resumed'] else ""))
+
+    resolver = InstrumentResolver(rb, store)
+    output = args.output or '{}.{}'.format(args.level, args.format)
+    rows = export_file(store.iter_orders(), resolver, output, args.format, args.level)
+    print("{} rows written to {}".format(rows, output))
+
+    for table, first_page in (('positions', args.positions and rb.positions),
+                              ('dividends', args.dividends and rb.dividends)):
+        if not first_page:
+            continue
+        output = '{}.{}'.format(table, args.format)
+        rows = export_file(api_pages(rb, first_page()), resolver, output, args.format, table)
+        print("{} rows written to {}".format(rows, output))
 
-def get_symbol_from_instrument_url(rb_client, url, db):
-    instrument = {}
-    if url in db:
-        instrument = db[url]
-    else:
-        db[url] = fetch_json_by_url(rb_client, url)
-        instrument = db[url]
-    return instrument['symbol']
-
-
-def fetch_json_by_url(rb_client, url):
-    return rb_client.session.get(url).json()
-
-
-def order_item_info(order, rb_client, db):
-    #side: .side,  price: .average_price, shares: .cumulative_quantity, instrument: .instrument, date : .last_transaction_at
-    symbol = get_symbol_from_instrument_url(rb_client, order['instrument'], db)
-    return {
-        'side': order['side'],
-        'price': order['average_price'],
-        'shares': order['cumulative_quantity'],
-        'symbol': symbol,
-        'date': order['last_transaction_at'],
-        'state': order['state']
-    }
-
-
-def get_all_history_orders(rb_client):
-    orders = []
-    past_orders = rb.order_history()
-    orders.extend(past_orders['results'])
-    while past_orders['next']:
-        print("{} order fetched".format(len(orders)))
-        next_url = past_orders['next']
-        past_orders = fetch_json_by_url(rb_client, next_url)
-        orders.extend(past_orders['results'])
-    print("{} order fetched".format(len(orders)))
-    return orders
-
-
-rb = Robinhood()
-# !!!!!! change the username and passs, be careful when paste the code to public
-rb.login(username="name", password="pass")
-past_orders = get_all_history_orders(rb)
-instruments_db = shelve.open('instruments.db')
-orders = [order_item_info(order, rb, instruments_db) for order in past_orders]
-keys = ['side', 'symbol', 'shares', 'price', 'date', 'state']
-with open('orders.csv', 'w') as output_file:
-    dict_writer = csv.DictWriter(output_file, keys)
-    dict_writer.writeheader()
-    dict_writer.writerows(orders)
 
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,30 @@
 #!/usr/bin/env python
 
-import cmd, json, re, math
+import argparse, cmd, csv, datetime, json, os, re, math, time
 import pprint
+import numpy as np
 from Robinhood import Robinhood
+from Robinhood import indicators
+from Robinhood.backtest import align
+from Robinhood.bars import BarStore
+from Robinhood.dividends import sync_dividends
+from Robinhood.history import HistoryStore, resolve_symbols, sync_orders
+from Robinhood.lots import match, summarize
+from Robinhood.orders import OrderWatcher
+from Robinhood.paper import PaperTrader
+from Robinhood.alerts import AlertEngine, BellNotifier, FileNotifier, WebhookNotifier, describe
+from Robinhood.quotes import QuotePoller
+from Robinhood.rebalance import execute, plan, read_targets, rebalance_intents
+from Robinhood.risk import portfolio_risk
+from Robinhood.screen import FundamentalsCache, field_names, screen
+from Robinhood.snapshots import SnapshotRecorder, SnapshotStore, drawdown, resample
+from Robinhood.stops import StopEngine
+from six.moves import queue
 from terminaltables import SingleTable
 from colorclass import Color
 from blessed import Terminal
 from textwrap import wrap
+from dateutil import tz
 from config import USERNAME, PASSWORD, CHALLENGE_TYPE
 
 """
@@ -19,11 +37,32 @@ to create a command line interface for interacting with Robinhood
 * `s <symbol> <quantity> <price>` : Submits a limit order to sell <quantity> stocks of <symbol> at <price>
 * `q <symbol>` : Get quote (current price) for symbol
 * `q <symbol> <call/put> <strike_price> <(optional) expiration_date YYYY-mm-dd>` : Get quote for option, all expiration dates if none specified
+* `sl <symbol> <quantity> <stop> <?limit>`, `sl trail|bracket|time ...` : Local stop, trailing stop, bracket or timed exit, `sl` lists them
+* `alert <symbol> above|below <price>`, `alert <symbol> move <?+|-><percent>%`, `alert <symbol> spread <amount|<n>bps>` : Price alerts, `alert` lists them
 * `o` : Lists all open orders
 * `c <id>` : Cancel an open order identified by <id> [<id> of a open order can be got from output of `o`]
+* `basket <file.csv>` or `basket <b|s> <symbol> <quantity> <?price>, ...` : Validates a basket of orders, then submits them concurrently
+* `rebalance <targets.csv> <?tolerance%> <?edge>` : Previews the orders that bring positions to target weights, then sends them on confirmation
+* `ca [<symbol> ...] [buy|sell] [<minutes>m]` : Cancels open orders concurrently, optionally only those matching symbol, side or age
+* `perf orders <?symbol|type|hour>` : Shows order latency and slippage percentiles
+* `pnl <?fifo|lifo> <?year> <?symbol ...>` : Realized, wash sale and unrealized P&L from the local order history, `pnl sync` downloads new orders
+* `div <?symbol|month|year> <?year>` : Dividend totals from the local dividend history, `div sync` downloads new dividends
+* `risk <?days>` : Volatility, VaR, expected shortfall, beta and concentration of current positions over stored daily bars
+* `screen <w|tag <tag>|all> <?expression>` : Screens the watchlist, a tag or every known instrument on fundamentals, e.g. `screen all pe < 20 and market_cap > 1e10`
+* `snap <?day|week|month|all>` : Equity curve and drawdown from recorded snapshots, `snap start <?seconds>|stop|now` controls the recorder
+* `ind <symbol> <indicator> <?params>` : Show sma/ema/rsi/atr/bb computed over locally stored daily bars
 * `bye` : Exit the shell
+
+Start with `--paper` (and optionally `--cash <amount>`) to paper trade: every
+order command works the same, but orders are matched locally against quotes.
 """
 
+MARKET_TZ = tz.gettz('America/New_York')
+
+# Regular session, exchange time
+MARKET_OPEN = datetime.time(9, 30)
+MARKET_CLOSE = datetime.time(16, 0)
+
 class RobinhoodShell(cmd.Cmd):
     intro = 'Welcome to the Robinhood shell. Type help or ? to list commands.\n'
     prompt = '> '
@@ -49,6 +88,37 @@ class RobinhoodShell(cmd.Cmd):
     # List of stocks in watchlist
     watchlist = []
 
+    # Directory of the local historical bar store
+    bars_dir = 'bars'
+
+    # Order latency and slippage store
+    perf_file = 'orders_perf.db'
+
+    # Account and position snapshots
+    snapshots_dir = 'snapshots'
+
+    # Benchmark for betas in `risk`
+    risk_benchmark = 'SPY'
+
+    # Fundamentals for `screen`, refetched daily
+    fundamentals_file = 'fundamentals.data'
+
+    # Local order history, also written by trade_history_downloader
+    history_file = 'history.db'
+
+    # Local stops, kept across restarts
+    stops_file = 'stops.data'
+
+    # Price alerts, kept across restarts, and where fired alerts are logged
+    alerts_file = 'alerts.data'
+    alerts_log_file = 'alerts.log'
+
+    # URL fired alerts are POSTed to, if set
+    alerts_webhook = None
+
+    # Starting cash of a paper trading session
+    paper_cash = 100000.0
+
     def _save_auth_data(self):
         auth_data = {}
         auth_data['device_token'] = self.trader.device_token
@@ -56,9 +126,20 @@ class RobinhoodShell(cmd.Cmd):
         auth_data['refresh_token'] = self.trader.refresh_token
         open(self.auth_file, 'w').write(json.dumps(auth_data))
 
-    def __init__(self):
+    def __init__(self, paper=False):
         cmd.Cmd.__init__(self)
-        self.trader = Robinhood()
+        self.paper = paper
+        if paper:
+            # Orders stay local, market data still comes from the API.
+            # Stops and order stats are kept apart from the live ones.
+            self.trader = PaperTrader(self.paper_cash)
+            self.prompt = 'paper> '
+            self.stops_file = 'paper_' + self.stops_file
+            self.perf_file = 'paper_' + self.perf_file
+            self.snapshots_dir = 'paper_' + self.snapshots_dir
+            self.history_file = 'paper_' + self.history_file
+        else:
+            self.trader = Robinhood()
 
         # Robinhood now uses 2FA
         # The workflow we use is as follows
@@ -80,6 +161,7 @@ class RobinhoodShell(cmd.Cmd):
                 del self.trader.headers['Authorization']
                 self.trader.relogin_oauth2()
                 self._save_auth_data()
+              self.trader.prewarm()
         except:
             challenge_type = 'email'
             if CHALLENGE_TYPE == 'sms':
@@ -92,6 +174,7 @@ class RobinhoodShell(cmd.Cmd):
             self.instruments_cache = json.loads(data)
             for k in self.instruments_cache:
                 self.instruments_reverse_cache[self.instruments_cache[k]] = k
+            self.trader.pretrade.add_instruments([{'symbol': k, 'url': v} for k, v in self.instruments_cache.items()])
         except:
             pass
 
@@ -101,6 +184,47 @@ class RobinhoodShell(cmd.Cmd):
         except:
             pass
 
+        self.bar_store = BarStore(self.bars_dir)
+        self.history = HistoryStore(self.history_file)
+        self.snapshots = SnapshotStore(self.snapshots_dir)
+        self.fundamentals = FundamentalsCache(self.fundamentals_file)
+        self.snapshot_recorder = SnapshotRecorder(self.trader, self.snapshots)
+        self.order_tracker = self.trader.order_tracker
+        self.order_watcher = OrderWatcher(self.trader)
+        self.unresolved_instruments = queue.Queue()
+        self.order_watcher.on(self._on_order_event)
+        self.trader.record_perf(self.perf_file, self.order_watcher)
+
+        self.quote_poller = QuotePoller(self.trader)
+        self.stop_engine = StopEngine(self.trader, self.stops_file)
+        self.stop_engine.on(self._on_stop)
+        self.quote_poller.subscribe(self.stop_engine)
+        self._resolve_expired_stops()
+
+        self.alert_engine = AlertEngine(self.alerts_file, [BellNotifier(), FileNotifier(self.alerts_log_file)])
+        if self.alerts_webhook:
+            self.alert_engine.add_notifier(WebhookNotifier(self.alerts_webhook))
+        self.quote_poller.subscribe(self.alert_engine)
+
+        if paper:
+            self.quote_poller.subscribe(self.trader)
+            self.quote_poller.start()
+        elif self.stop_engine.list() or self.alert_engine.list():
+            self.quote_poller.start()
+
+    def postcmd(self, stop, line):
+        # instruments first seen by background threads
+        while True:
+            try:
+                url = self.unresolved_instruments.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                self.get_symbol(url)
+            except Exception:
+                pass
+        return stop
+
     # nytime = parser.parse('2018-06-15T23:14:15Z').astimezone(to_zone)
     # from dateutil import parser
 
@@ -181,6 +305,14 @@ class RobinhoodShell(cmd.Cmd):
 
         print((table.table))
 
+        # Everything a snapshot needs was just fetched, unless positions
+        # span more pages: positions left out would be recorded as closed
+        if not positions.get('next'):
+            try:
+                self.snapshot_recorder.record(portfolio, account_details, positions['results'], market_data)
+            except Exception:
+                pass
+
     def do_lo(self, arg):
         'Lists current options portfolio'
         # Load Options
@@ -259,6 +391,7 @@ class RobinhoodShell(cmd.Cmd):
                 instruments = [self.get_instrument(s)['url'] for s in
                         self.watchlist]
                 raw_data = self.trader.get_stock_marketdata(instruments)
+                self.alert_engine.on_quotes(raw_data)
                 quotes_data = {}
                 for quote in raw_data:
                     day_change = float(quote['last_trade_price']) - float(quote['previous_close'])
@@ -290,9 +423,14 @@ class RobinhoodShell(cmd.Cmd):
                 print("Stock not found")
                 return
 
-            res = self.trader.place_buy_order(stock_instrument, quantity, price)
+            submitted_at = time.time()
+            try:
+                res = self.trader.place_buy_order(stock_instrument, quantity, price)
+            except ValueError as err_msg:
+                print("Bad Order: " + str(err_msg))
+                return
 
-            if not (res.status_code == 200 or res.status_code == 201):
+            if res is None or not (res.status_code == 200 or res.status_code == 201):
                 print("Error executing order")
                 try:
                     data = res.json()
@@ -301,6 +439,7 @@ class RobinhoodShell(cmd.Cmd):
                 except:
                     pass
             else:
+                self._watch_order(res.json(), submitted_at)
                 print("Done")
         else:
             print("Bad Order")
@@ -321,9 +460,14 @@ class RobinhoodShell(cmd.Cmd):
                 print("Stock not found")
                 return
 
-            res = self.trader.place_sell_order(stock_instrument, quantity, price)
+            submitted_at = time.time()
+            try:
+                res = self.trader.place_sell_order(stock_instrument, quantity, price)
+            except ValueError as err_msg:
+                print("Bad Order: " + str(err_msg))
+                return
 
-            if not (res.status_code == 200 or res.status_code == 201):
+            if res is None or not (res.status_code == 200 or res.status_code == 201):
                 print("Error executing order")
                 try:
                     data = res.json()
@@ -332,37 +476,276 @@ class RobinhoodShell(cmd.Cmd):
                 except:
                     pass
             else:
+                self._watch_order(res.json(), submitted_at)
                 print("Done")
         else:
             print("Bad Order")
 
+    def do_basket(self, arg):
+        'Submit many orders at once: basket <file.csv> or basket <b|s> <symbol> <quantity> <?price>, ...\nCSV columns: side,symbol,quantity,price (price optional)'
+        arg = arg.strip()
+        rows = []
+        if arg.lower().endswith('.csv') and os.path.isfile(arg):
+            with open(arg) as csv_file:
+                for row in csv.DictReader(csv_file):
+                    rows.append([row.get('side', ''), row.get('symbol', ''), row.get('quantity', ''), row.get('price') or ''])
+        else:
+            for part in arg.split(','):
+                fields = part.split()
+                if fields:
+                    rows.append((fields + [''] * 4)[:4])
+
+        if not rows:
+            print("Bad Order")
+            return
+
+        sides = {'b': 'buy', 'buy': 'buy', 's': 'sell', 'sell': 'sell'}
+        intents = []
+        for side, symbol, quantity, price in rows:
+            symbol = symbol.strip().upper()
+            price = price.strip()
+            intents.append({
+                'instrument': self.get_instrument(symbol) if symbol else {},
+                'quantity': quantity.strip(),
+                'price': price or 0.0,
+                'transaction': sides.get(side.strip().lower(), side),
+                'trigger': 'immediate',
+                'order': 'limit' if price else 'market',
+                'time_in_force': 'gfd',
+            })
+
+        submitted_at = time.time()
+        results = self.trader.place_basket_order(intents)
+        for result in results:
+            if result['id']:
+                self._watch_order({'id': result['id'], 'state': result['state']}, submitted_at)
+
+        self._print_basket(results, 'Basket')
+
+    def do_rebalance(self, arg):
+        'Rebalance to target weights: rebalance <targets.csv> <?tolerance %> <?edge>\nCSV columns: symbol,weight,lot (lot optional), held symbols not listed are sold'
+        parts = arg.split()
+        if not parts:
+            print("Bad arguments")
+            return
+
+        tolerance = 0.0
+        to_edge = False
+        for part in parts[1:]:
+            if part.lower() == 'edge':
+                to_edge = True
+            else:
+                try:
+                    tolerance = float(part.rstrip('%')) / 100.0
+                except ValueError:
+                    print("Bad tolerance: " + part)
+                    return
+
+        try:
+            targets = read_targets(parts[0])
+        except (IOError, ValueError) as e:
+            print("Error reading targets")
+            print(e)
+            return
+
+        held = {}
+        for position in self.trader.securities_owned()['results']:
+            symbol = self.get_symbol(position['instrument'])
+            held[symbol] = held.get(symbol, 0.0) + float(position['quantity'])
+
+        symbols = sorted(set(held) | set(targets))
+        quotes = self.quote_poller.fetch(symbols)
+        account = self.trader.get_account()
+        if 'margin_balances' in account:
+            cash = float(account['margin_balances']['unallocated_margin_cash'])
+        else:
+            cash = float(account['buying_power'])
+
+        rebalance = plan(
+            symbols,
+            [held.get(symbol, 0.0) for symbol in symbols],
+            [float((quotes.get(symbol) or {}).get('last_trade_price') or 'nan') for symbol in symbols],
+            [targets.get(symbol, (0.0, 1.0))[0] for symbol in symbols],
+            cash,
+            [targets.get(symbol, (0.0, 1.0))[1] for symbol in symbols],
+            tolerance=tolerance,
+            to_edge=to_edge)
+
+        def pct(value):
+            return '{:.2f}'.format(value * 100)
+
+        rebalance_t_data = []
+        rebalance_table = SingleTable(rebalance_t_data, 'Rebalance')
+        rebalance_table.inner_row_border = True
+        rebalance_t_data.append(["Symbol", "Last", "Shares", "Weight %", "Target %", "Drift %", "Trade", "Trade Value", "After %", "Left"])
+        for i, symbol in enumerate(symbols):
+            price = rebalance['price'][i]
+            trade = rebalance['trade'][i]
+            rebalance_t_data.append([
+                symbol,
+                'no quote' if np.isnan(price) else '{:.2f}'.format(price),
+                '{:g}'.format(rebalance['quantity'][i]),
+                pct(rebalance['weight'][i]),
+                pct(rebalance['target'][i]),
+                color_data(pct(rebalance['drift'][i])),
+                color_data('{:+g}'.format(trade)) if trade else '',
+                '{:.2f}'.format(rebalance['trade_value'][i]) if trade else '',
+                pct(rebalance['after'][i]),
+                '{:g}'.format(rebalance['fraction'][i]) if rebalance['fraction'][i] > 1e-9 else '',
+            ])
+        print((rebalance_table.table))
+        print("Equity {:.2f}, cash {:.2f} -> {:.2f}, turnover {}%".format(
+            rebalance['equity'], rebalance['cash'], rebalance['cash_after'], pct(rebalance['turnover'])))
+        if rebalance['fraction'].sum() > 1e-9:
+            print("Left: fractional shares not sold, orders are for whole shares")
+
+        instruments = dict((symbol, self.get_instrument(symbol)) for symbol, trade
+                           in zip(symbols, rebalance['trade']) if trade)
+        intents = rebalance_intents(rebalance, instruments)
+        if not intents:
+            print("Nothing to trade")
+            return
+        if input("Send {} orders? [y/N] ".format(len(intents))).strip().lower() not in ('y', 'yes'):
+            print("Not sent")
+            return
+
+        submitted_at = time.time()
+        sells, buys = execute(self.trader, intents)
+        for result in sells + buys:
+            if result['id']:
+                self._watch_order({'id': result['id'], 'state': result['state']}, submitted_at)
+
+        if sells:
+            self._print_basket(sells, 'Rebalance sells')
+        if buys:
+            self._print_basket(buys, 'Rebalance buys')
+        elif any(intent['transaction'] == 'buy' for intent in intents):
+            print("Buys not sent, not every sell filled")
+
     def do_sl(self, arg):
-        'Setup stop loss on stock sl <symbol> <quantity> <price>'
+        'Local stops, sold at market (or at <limit>) when triggered:\n' \
+        'sl <symbol> <quantity> <stop> <?limit>\n' \
+        'sl trail <symbol> <quantity> <amount|percent%>\n' \
+        'sl bracket <symbol> <quantity> <stop> <target>\n' \
+        'sl time <symbol> <quantity> <HH:MM|<minutes>m>\n' \
+        'sl : list stops, sl rm <index> : remove a stop, sl retry <index> : sell a failed stop again'
         parts = arg.split()
-        if len(parts) == 3:
-            symbol = parts[0].upper()
-            quantity = parts[1]
-            price = float(parts[2])
+        if not parts or parts[0] == 'list':
+            self._print_stops()
+            return
 
-            stock_instrument = self.trader.instruments(symbol)[0]
-            res = self.trader.place_stop_loss_order(stock_instrument, quantity, price)
+        if parts[0] in ('rm', 'retry'):
+            stops = self.stop_engine.list()
+            try:
+                stop = stops[int(parts[1]) - 1]
+            except (IndexError, ValueError):
+                print("Bad index")
+                return
+            if parts[0] == 'rm':
+                self.stop_engine.remove(stop['id'])
+                print("Done")
+            elif stop['id'] not in self.stop_engine.failed:
+                print("Stop has not failed")
+            else:
+                self.stop_engine.retry(stop['id'])
+            return
 
-            if not (res.status_code == 200 or res.status_code == 201):
-                print("Error executing order")
-                try:
-                    data = res.json()
-                    if 'detail' in data:
-                        print(data['detail'])
-                except:
-                    pass
+        kind = 'stop'
+        if parts[0] in ('trail', 'bracket', 'time'):
+            kind = parts.pop(0)
+
+        if len(parts) < 3 or (kind == 'stop' and len(parts) > 4) or (kind != 'stop' and len(parts) != 3 + (kind == 'bracket')):
+            print("Bad Order")
+            return
+
+        symbol = parts[0].upper()
+        stock_instrument = self.get_instrument(symbol)
+        if not stock_instrument['url']:
+            print("Stock not found")
+            return
+
+        try:
+            options = {}
+            if kind == 'stop':
+                options['stop'] = float(parts[2])
+                if len(parts) == 4:
+                    options['limit'] = float(parts[3])
+            elif kind == 'trail':
+                options['trail_percent'] = parts[2].endswith('%')
+                options['trail'] = float(parts[2].rstrip('%'))
+                options['price'] = float(self.trader.quote_data(symbol)['last_trade_price'])
+            elif kind == 'bracket':
+                options['stop'] = float(parts[2])
+                options['target'] = float(parts[3])
             else:
-                print("Done")
-        else:
+                options['exit_at'] = parse_exit_time(parts[2])
+                print("Exit at " + time.strftime('%Y-%m-%d %H:%M', time.localtime(options['exit_at'])))
+
+            self.stop_engine.add(symbol, stock_instrument['url'], parts[1], **options)
+        except Exception as e:
             print("Bad Order")
+            print(e)
+            return
+
+        self.quote_poller.start()
+        print("Done")
+
+    def do_alert(self, arg):
+        'Price alerts: alert <symbol> above|below <price>, alert <symbol> move <?+|-><percent>%,\n' \
+        'alert <symbol> spread <amount|<n>bps>, alert : list alerts, alert rm <index> : remove an alert'
+        parts = arg.split()
+        if not parts or parts[0] == 'list':
+            alerts = self.alert_engine.list()
+            if not alerts:
+                print("No alerts")
+                return
+
+            alert_t_data = []
+            alert_table = SingleTable(alert_t_data, 'Alerts')
+            alert_table.inner_row_border = True
+            alert_t_data.append(["index", "alert", "added"])
+            for index, alert in enumerate(alerts, 1):
+                alert_t_data.append([index, describe(alert), time.strftime('%Y-%m-%d %H:%M', time.localtime(alert['created_at']))])
+            print((alert_table.table))
+            return
+
+        if parts[0] == 'rm':
+            alerts = self.alert_engine.list()
+            try:
+                alert = alerts[int(parts[1]) - 1]
+            except (IndexError, ValueError):
+                print("Bad index")
+                return
+            self.alert_engine.remove(alert['id'])
+            print("Done")
+            return
+
+        if len(parts) != 3:
+            print("Bad alert")
+            return
+
+        symbol, kind, value = parts[0].upper(), parts[1].lower(), parts[2].lower()
+        try:
+            if kind == 'move':
+                quote = self.trader.quote_data(symbol)
+                reference = float(quote['previous_close'] or quote['last_trade_price'])
+                self.alert_engine.add(symbol, kind, value.rstrip('%'), reference=reference,
+                                      signed=value[0] in '+-')
+            elif kind == 'spread':
+                self.alert_engine.add(symbol, kind, value.replace('bps', ''), bps=value.endswith('bps'))
+            else:
+                self.alert_engine.add(symbol, kind, value)
+        except Exception as e:
+            print("Bad alert")
+            print(e)
+            return
+
+        self.quote_poller.start()
+        print("Done")
 
     def do_o(self, arg):
         'List open orders'
-        open_orders = self.trader.get_open_orders()
+        open_orders = self.order_tracker.refresh()
         if open_orders:
             open_t_data=[]
             open_table = SingleTable(open_t_data,'open List')
@@ -403,31 +786,69 @@ class RobinhoodShell(cmd.Cmd):
         except:
             pass
 
+        # Indices refer to the last `o` listing, no need to refetch it
         if order_index > 0:
-            order_index = order_index - 1
-            open_orders = self.trader.get_open_orders()
-            if order_index < len(open_orders):
-                order_id = open_orders[order_index]['id']
-            else:
+            order = self.order_tracker.by_index(order_index)
+            if order is None:
                 print("Bad index")
                 return
+        else:
+            order = self.order_tracker.orders.get(order_id)
 
-        try:
-            self.trader.cancel_order(order_id)
+        if order is None:
+            try:
+                self.trader.cancel_order(order_id)
+                print("Done")
+            except Exception as e:
+                print("Error executing cancel")
+                print(e)
+            return
+
+        result = self.trader.cancel_orders([order])[0]
+        if result['cancelled']:
+            self.order_tracker.discard([order['id']])
             print("Done")
-        except Exception as e:
+        else:
             print("Error executing cancel")
-            print(e)
+            print(result['error'])
 
     def do_ca(self, arg):
-        'Cancel all open orders'
-        open_orders = self.trader.get_open_orders()
-        for order in open_orders:
-            try:
-                self.trader.cancel_order(order['id'])
-            except Exception as e:
-                pass
-        print("Done")
+        'Cancel open orders: ca [<symbol> ...] [buy|sell] [<minutes>m]\nWith no filters every open order is cancelled, <minutes>m only cancels orders at least that old'
+        symbols = []
+        side = None
+        older_than = None
+        for part in arg.split():
+            if part.lower() in ('buy', 'sell'):
+                side = part.lower()
+            elif re.match(r'^\d+(\.\d+)?m$', part.lower()):
+                older_than = float(part[:-1]) * 60
+            else:
+                symbols.append(part.upper())
+
+        instruments = None
+        if symbols:
+            instruments = [self.get_instrument(s)['url'] for s in symbols]
+
+        open_orders = self.trader.filter_orders(self.order_tracker.refresh(), instruments, side, older_than)
+        results = self.trader.cancel_orders(open_orders)
+        self.order_tracker.discard([r['id'] for r in results if r['cancelled']])
+        if not results:
+            print("No matching open orders")
+            return
+
+        cancel_t_data = []
+        cancel_table = SingleTable(cancel_t_data, 'Cancelled')
+        cancel_table.inner_row_border = True
+        cancel_t_data.append(["symbol", "side", "id", "result", "latency ms"])
+        for result in results:
+            cancel_t_data.append([
+                self.get_symbol(result['instrument']),
+                result['side'],
+                result['id'],
+                'cancelled' if result['cancelled'] else result['error'],
+                '' if result['latency'] is None else '{:.0f}'.format(result['latency'] * 1000),
+            ])
+        print((cancel_table.table))
 
     def do_news(self,arg,show_num=5):
         if len(arg) == 0:
@@ -493,6 +914,7 @@ class RobinhoodShell(cmd.Cmd):
         else:
             instruments = [self.get_instrument(s)['url'] for s in symbols]
             raw_data = self.trader.get_stock_marketdata(instruments)
+            self.alert_engine.on_quotes(raw_data)
             quotes_data = {}
             quote_t_data=[]
             quote_table = SingleTable(quote_t_data,'Quote List')
@@ -560,6 +982,418 @@ class RobinhoodShell(cmd.Cmd):
             except:
                 print("Error getting quote for:", symbol)
 
+    def do_ind(self, arg):
+        'Technical indicator over daily bars: ind <symbol> <sma|ema|rsi|atr|bb> <?params>'
+        parts = arg.split()
+        if len(parts) < 2:
+            print("Bad arguments")
+            return
+
+        symbol = parts[0].upper()
+        name = parts[1].lower()
+
+        try:
+            self.bar_store.update(self.trader, [symbol], 'day', 'year')
+            bars = self.bar_store.read(symbol, 'day')
+            values = indicators.compute(name, bars, *parts[2:])
+        except Exception as e:
+            print("Error computing indicator")
+            print(e)
+            return
+
+        if len(bars['begins_at']) == 0:
+            print("No data for", symbol)
+            return
+
+        if not isinstance(values, tuple):
+            values = (values,)
+
+        if len(values) == 3:
+            labels = ["Lower", "Middle", "Upper"]
+        else:
+            labels = [name.upper()]
+
+        ind_t_data = []
+        ind_table = SingleTable(ind_t_data, symbol + ' ' + ' '.join(parts[1:]))
+        ind_table.inner_row_border = True
+        ind_t_data.append(["Date", "Close"] + labels)
+
+        for i in range(max(0, len(bars['begins_at']) - 10), len(bars['begins_at'])):
+            ind_t_data.append(
+                [str(bars['begins_at'][i].astype('datetime64[D]')), '{:.2f}'.format(bars['close'][i])] +
+                ['{:.2f}'.format(v[i]) for v in values])
+
+        print((ind_table.table))
+
+    def do_perf(self, arg):
+        'Order latency and slippage: perf orders <?symbol|type|hour>'
+        parts = arg.split()
+        if not parts or parts[0] != 'orders':
+            print("Usage: perf orders <?symbol|type|hour>")
+            return
+
+        groups = parts[1:] or ['symbol', 'type', 'hour']
+
+        def ms(values):
+            return ' / '.join('-' if v is None else '{:.0f}'.format(v) for v in values)
+
+        def bps(values):
+            return ' / '.join('-' if v is None else '{:.1f}'.format(v) for v in values)
+
+        for by in groups:
+            try:
+                report = self.trader.perf.report(by)
+            except ValueError as e:
+                print(e)
+                return
+
+            perf_t_data = []
+            perf_table = SingleTable(perf_t_data, 'Orders by ' + by)
+            perf_table.inner_row_border = True
+            perf_t_data.append([by, "orders", "fills", "ack ms p50/90/99", "fill ms p50/90/99",
+                                "cancel ms p50/90/99", "slippage bps mean/p50/90"])
+            for row in report:
+                perf_t_data.append([
+                    row['group'],
+                    row['orders'],
+                    row['fills'],
+                    ms(row['ack_ms']),
+                    ms(row['fill_ms']),
+                    ms(row['cancel_ms']),
+                    bps(row['slippage_bps']),
+                ])
+            print((perf_table.table))
+
+    def do_pnl(self, arg):
+        'Realized and unrealized P&L from the local order history: pnl <?fifo|lifo> <?year> <?symbol ...>, pnl sync to download new orders'
+        parts = arg.split()
+        if parts and parts[0] == 'sync':
+            try:
+                stats = sync_orders(self.trader, self.history)
+                resolve_symbols(self.trader, self.history)
+            except Exception as e:
+                print("Error syncing order history")
+                print(e)
+                return
+            print("{new} new, {updated} updated orders".format(**stats))
+            return
+
+        method = 'fifo'
+        year = None
+        symbols = []
+        for part in parts:
+            if part.lower() in ('fifo', 'lifo'):
+                method = part.lower()
+            elif part.isdigit():
+                year = int(part)
+            else:
+                symbols.append(part.upper())
+
+        fills = self.history.fills()
+        if not fills:
+            print("No order history, run pnl sync first")
+            return
+
+        realized, open_lots = match(fills, method)
+
+        # Unrealized gains use the last stored daily close, no API calls
+        prices = {}
+        for symbol in set(open_lots['symbol']):
+            close = self.bar_store.read(symbol, 'day')['close']
+            if len(close):
+                prices[symbol] = float(close[-1])
+
+        summary = summarize(realized, open_lots, prices, year)
+        if symbols:
+            summary = [row for row in summary if row['symbol'] in symbols]
+
+        def money(value):
+            return '-' if value is None else color_data('{:.2f}'.format(value))
+
+        pnl_t_data = []
+        title = 'P&L ' + method.upper() + (' ' + str(year) if year else '')
+        pnl_table = SingleTable(pnl_t_data, title)
+        pnl_table.inner_row_border = True
+        pnl_t_data.append(["Symbol", "Short Term", "Long Term", "Wash Sale", "Shares", "Cost Basis", "Last", "Unrealized"])
+        for row in summary:
+            pnl_t_data.append([
+                row['symbol'],
+                money(row['short_term']),
+                money(row['long_term']),
+                '{:.2f}'.format(row['wash_sale']) if row['wash_sale'] else '',
+                '{:g}'.format(row['open_quantity']) if row['open_quantity'] else '',
+                '{:.2f}'.format(row['open_cost']) if row['open_quantity'] else '',
+                '' if row['price'] is None else '{:.2f}'.format(row['price']),
+                money(row['unrealized']),
+            ])
+
+        known = [row['unrealized'] for row in summary if row['unrealized'] is not None]
+        pnl_t_data.append([
+            "Total",
+            money(sum(row['short_term'] for row in summary)),
+            money(sum(row['long_term'] for row in summary)),
+            '{:.2f}'.format(sum(row['wash_sale'] for row in summary)),
+            '',
+            '{:.2f}'.format(sum(row['open_cost'] for row in summary)),
+            '',
+            money(sum(known)) if known else '-',
+        ])
+        print((pnl_table.table))
+
+    def do_div(self, arg):
+        'Dividend totals from the local dividend history: div <?symbol|month|year> <?year>, div sync to download new dividends now'
+        parts = arg.split()
+        force = bool(parts) and parts[0] == 'sync'
+        # Syncs at most every few hours, otherwise shows what is stored
+        try:
+            stats = sync_dividends(self.trader, self.history, force=force)
+        except Exception as e:
+            print("Error syncing dividends")
+            print(e)
+            if force:
+                return
+        else:
+            if force:
+                print("{new} new, {updated} updated dividends".format(**stats))
+                return
+
+        by = 'symbol'
+        year = None
+        for part in parts:
+            if part.lower() in ('symbol', 'month', 'year'):
+                by = part.lower()
+            elif part.isdigit():
+                year = int(part)
+            else:
+                print("Bad div command: " + part)
+                return
+
+        totals = self.history.dividend_totals(by, year)
+        if not totals:
+            print("No dividends")
+            return
+
+        div_t_data = []
+        title = 'Dividends by ' + by + (' ' + str(year) if year else '')
+        div_table = SingleTable(div_t_data, title)
+        div_table.inner_row_border = True
+        div_t_data.append([by.capitalize(), "Count", "Received", "Pending", "Withheld"])
+        for row in totals:
+            div_t_data.append([
+                row['group'] or '-',
+                row['count'],
+                color_data('{:.2f}'.format(row['received'])),
+                '{:.2f}'.format(row['pending']) if row['pending'] else '',
+                '{:.2f}'.format(row['withheld']) if row['withheld'] else '',
+            ])
+        div_t_data.append([
+            "Total",
+            sum(row['count'] for row in totals),
+            color_data('{:.2f}'.format(sum(row['received'] for row in totals))),
+            '{:.2f}'.format(sum(row['pending'] for row in totals)),
+            '{:.2f}'.format(sum(row['withheld'] for row in totals)),
+        ])
+        print((div_table.table))
+
+    def do_risk(self, arg):
+        'Portfolio risk over stored daily bars: risk <?days>, 504 (about two years) by default'
+        parts = arg.split()
+        days = int(parts[0]) if parts and parts[0].isdigit() else 504
+
+        positions = self.trader.securities_owned()['results']
+        if not positions:
+            print("No positions")
+            return
+        quantities = {}
+        for position in positions:
+            symbol = self.get_symbol(position['instrument'])
+            quantities[symbol] = quantities.get(symbol, 0.0) + float(position['quantity'])
+
+        symbols = sorted(quantities)
+        benchmark = self.risk_benchmark
+        try:
+            # Only bars newer than the stored ones are fetched
+            self.bar_store.update(self.trader, symbols + [benchmark], 'day', '5year')
+        except Exception as e:
+            print("Error updating daily bars, using stored ones")
+            print(e)
+
+        bars = dict((symbol, self.bar_store.read(symbol, 'day')) for symbol in set(symbols + [benchmark]))
+        market = align(bars)
+        close = market['close'][:, -(days + 1):]
+        if close.shape[-1] < 2:
+            print("Not enough daily bars, need at least two")
+            return
+        rows = [market['symbols'].index(symbol) for symbol in symbols]
+        report = portfolio_risk([quantities[symbol] for symbol in symbols], close[rows],
+                                close[market['symbols'].index(benchmark)])
+
+        def pct(value):
+            return '-' if np.isnan(value) else '{:.2f}'.format(value * 100)
+
+        def number(value):
+            return '-' if np.isnan(value) else '{:.2f}'.format(value)
+
+        position_t_data = []
+        position_table = SingleTable(position_t_data, 'Position risk')
+        position_table.inner_row_border = True
+        position_t_data.append(["Symbol", "Value", "Weight %", "Volatility %", "Beta", "Risk %"])
+        held = report['positions']
+        for i in np.argsort(-held['contribution']):
+            position_t_data.append([
+                symbols[i],
+                number(held['value'][i]),
+                pct(held['weight'][i]),
+                pct(held['volatility'][i]),
+                number(held['beta'][i]),
+                pct(held['contribution'][i]),
+            ])
+        print((position_table.table))
+
+        concentration = report['concentration']
+        risk_t_data = []
+        risk_table = SingleTable(risk_t_data, 'Portfolio risk, {} days'.format(report['days']))
+        risk_t_data.append(["Value", number(report['value'])])
+        risk_t_data.append(["Volatility % (annual)", pct(report['volatility'])])
+        risk_t_data.append(["Beta vs " + benchmark, number(report['beta'])])
+        for level in sorted(report['var']):
+            label = '{:g}%'.format(level * 100)
+            risk_t_data.append(["1 day VaR " + label + " historical", number(report['var'][level])])
+            risk_t_data.append(["1 day VaR " + label + " parametric", number(report['parametric_var'][level])])
+            risk_t_data.append(["1 day expected shortfall " + label, number(report['expected_shortfall'][level])])
+        risk_t_data.append(["Largest position %", pct(concentration['largest'])])
+        risk_t_data.append(["Top 5 positions %", pct(concentration['top5'])])
+        risk_t_data.append(["Herfindahl index", '{:.4f}'.format(concentration['hhi'])])
+        risk_t_data.append(["Effective positions", '{:.1f}'.format(concentration['effective_n'])])
+        print((risk_table.table))
+
+    def do_screen(self, arg):
+        'Screen stocks on fundamentals: screen <w|tag <tag>|all> <?expression>\n' \
+        'e.g. screen tag 100-most-popular pe < 20 and market_cap > 1e10\n' \
+        'Fields: pe, pb, market_cap, div_yield, volume, average_volume, high_52_weeks, low_52_weeks, sector, industry, ...'
+        parts = arg.split(None, 1)
+        if not parts:
+            print("Bad arguments")
+            return
+
+        universe = parts[0].lower()
+        expression = parts[1] if len(parts) > 1 else ''
+        if universe in ('w', 'watchlist'):
+            symbols = list(self.watchlist)
+        elif universe == 'tag':
+            tag_parts = expression.split(None, 1)
+            if not tag_parts:
+                print("Bad arguments")
+                return
+            expression = tag_parts[1] if len(tag_parts) > 1 else ''
+            try:
+                symbols = self.trader.get_tickers_by_tag(tag_parts[0])
+            except Exception as e:
+                print("Error getting tag " + tag_parts[0])
+                print(e)
+                return
+        elif universe == 'all':
+            symbols = list(self.instruments_cache)
+        else:
+            print("Bad universe: " + parts[0])
+            return
+
+        fundamentals = self.fundamentals.load(self.trader, symbols)
+        try:
+            matches = screen(fundamentals, expression)
+            fields = [field for field in field_names(expression) if field in matches] if expression.strip() else []
+        except ValueError as e:
+            print(e)
+            return
+
+        for field in ('market_cap', 'pe_ratio'):
+            if field not in fields:
+                fields.append(field)
+
+        def cell(field, value):
+            if isinstance(value, str):
+                return value
+            if np.isnan(value):
+                return '-'
+            if field == 'market_cap':
+                return '{:.1f}B'.format(value / 1e9)
+            return '{:,.2f}'.format(value)
+
+        screen_t_data = []
+        screen_table = SingleTable(screen_t_data, 'Screen {} of {}'.format(len(matches['symbol']), len(fundamentals)))
+        screen_t_data.append(["Symbol"] + fields)
+        for i in range(min(len(matches['symbol']), 50)):
+            screen_t_data.append([matches['symbol'][i]] + [cell(field, matches[field][i]) for field in fields])
+        print((screen_table.table))
+        if len(matches['symbol']) > 50:
+            print("First 50 by market cap")
+
+    def do_snap(self, arg):
+        'Equity curve and drawdown from account snapshots: snap <?day|week|month|all>, snap start <?seconds>, snap stop, snap now'
+        parts = arg.split()
+        if parts and parts[0] == 'start':
+            if len(parts) > 1:
+                self.snapshot_recorder.interval = float(parts[1])
+            self.snapshot_recorder.start()
+            print("Recording a snapshot every {:g}s".format(self.snapshot_recorder.interval))
+            return
+        if parts and parts[0] == 'stop':
+            self.snapshot_recorder.stop()
+            print("Snapshot recording stopped")
+            return
+        if parts and parts[0] == 'now':
+            try:
+                account, positions = self.snapshot_recorder.snapshot()
+            except Exception as e:
+                print("Error taking snapshot")
+                print(e)
+                return
+            print("{} account, {} position changes recorded".format(account, positions))
+            return
+
+        spans = {
+            'day': (np.timedelta64(1, 'D'), np.timedelta64(1, 'h')),
+            'week': (np.timedelta64(7, 'D'), np.timedelta64(12, 'h')),
+            'month': (np.timedelta64(31, 'D'), np.timedelta64(2, 'D')),
+            'all': (None, None),
+        }
+        span = parts[0].lower() if parts else 'day'
+        if span not in spans:
+            print("Bad snap command: " + span)
+            return
+
+        length, every = spans[span]
+        start = None if length is None else np.datetime64(int(time.time()), 's') - length
+        times, equity = self.snapshots.equity_curve(start=start)
+        if not len(times):
+            print("No snapshots, run snap start or snap now")
+            return
+
+        if every is None:
+            every = max((times[-1] - times[0]) // 16, np.timedelta64(1, 'm'))
+        bucket_times, bucket_equity = resample(times, equity, every)
+        worst = drawdown(times, equity)
+        bucket_drawdown = worst['drawdown'][np.searchsorted(times, bucket_times, side='right') - 1]
+
+        def local(at):
+            return datetime.datetime.utcfromtimestamp(at.astype('datetime64[s]').astype(int)).replace(
+                tzinfo=tz.tzutc()).astimezone(tz.tzlocal()).strftime('%Y-%m-%d %H:%M')
+
+        snap_t_data = []
+        snap_table = SingleTable(snap_t_data, 'Equity ' + span)
+        snap_t_data.append(["Time", "Equity", "Change", "Drawdown %"])
+        for at, value, down in zip(bucket_times, bucket_equity, bucket_drawdown):
+            snap_t_data.append([
+                local(at),
+                '{:.2f}'.format(value),
+                color_data('{:.2f}'.format(value - equity[0])),
+                '{:.2f}'.format(down * 100) if down else '',
+            ])
+        print((snap_table.table))
+
+        print("Max drawdown {:.2f}% ({:.2f}) from {} to {}".format(
+            worst['max_drawdown'] * 100, worst['max_loss'], local(worst['peak_at']), local(worst['trough_at'])))
+
     def do_bye(self, arg):
         open(self.instruments_cache_file, 'w').write(json.dumps(self.instruments_cache))
         open(self.watchlist_file, 'w').write(json.dumps(self.watchlist))
@@ -567,6 +1401,91 @@ class RobinhoodShell(cmd.Cmd):
         return True
 
     # ------ utils --------
+    def _watch_order(self, order, submitted_at):
+        self.order_watcher.watch(order, submitted_at)
+        self.order_watcher.start()
+
+    def _print_basket(self, results, title):
+        basket_t_data = []
+        basket_table = SingleTable(basket_t_data, title)
+        basket_table.inner_row_border = True
+        basket_t_data.append(["index", "symbol", "side", "quantity", "state", "latency ms", "id / error"])
+        for index, result in enumerate(results, 1):
+            basket_t_data.append([
+                index,
+                result['symbol'],
+                result['side'],
+                result['quantity'],
+                result['state'],
+                '' if result['latency'] is None else '{:.0f}'.format(result['latency'] * 1000),
+                result['error'] or result['id'] or '',
+            ])
+        print((basket_table.table))
+
+    def _print_stops(self):
+        stops = self.stop_engine.list()
+        if not stops:
+            print("No stops")
+            return
+
+        stop_t_data = []
+        stop_table = SingleTable(stop_t_data, 'Stops')
+        stop_table.inner_row_border = True
+        stop_t_data.append(["index", "symbol", "quantity", "stop", "trail", "target", "exit at", "sell at", "sell",
+                            "state"])
+        for index, stop in enumerate(stops, 1):
+            trail = ''
+            if stop['trail']:
+                trail = ('{:g}%' if stop['trail_percent'] else '{:.2f}').format(stop['trail']) + \
+                    ' from {:.2f}'.format(stop['peak'])
+            stop_t_data.append([
+                index,
+                stop['symbol'],
+                stop['quantity'],
+                '' if stop['stop'] is None else '{:.2f}'.format(stop['stop']),
+                trail,
+                '' if stop['target'] is None else '{:.2f}'.format(stop['target']),
+                '' if stop['exit_at'] is None else time.strftime('%Y-%m-%d %H:%M', time.localtime(stop['exit_at'])),
+                '' if stop['level'] is None else '{:.2f}'.format(stop['level']),
+                'market' if stop['limit'] is None else 'limit {:.2f}'.format(stop['limit']),
+                'sell failed ' + stop['error'] if stop['id'] in self.stop_engine.failed else '',
+            ])
+        print((stop_table.table))
+
+    def _resolve_expired_stops(self):
+        for stop in sorted(self.stop_engine.expired.values(), key=lambda s: s['created_at']):
+            exit_at = time.strftime('%Y-%m-%d %H:%M', time.localtime(stop['exit_at']))
+            answer = input("Time exit of {} {} at {} passed while the shell was closed. Sell now? [y/N] ".format(
+                stop['quantity'], stop['symbol'], exit_at))
+            sell = answer.strip().lower() in ('y', 'yes')
+            self.stop_engine.resolve_expired(stop['id'], sell)
+            if not sell:
+                print("Time exit dropped")
+
+    def _on_stop(self, stop, res, error):
+        at = '' if stop['price'] is None else ' at {:.2f}'.format(stop['price'])
+        print('\n[stop] {} {} triggered{}, selling {}'.format(stop['symbol'], stop['reason'], at, stop['quantity']))
+        if error is not None or res is None or res.status_code not in (200, 201):
+            print('[stop] {} sell failed {}, kept for sl retry'.format(stop['symbol'], stop.get('error', '')))
+            return
+        self._watch_order(res.json(), stop['triggered_at'])
+
+    def _on_order_event(self, event, record):
+        # runs on the watcher thread: only reads the instrument cache, an
+        # instrument not cached yet is shown by order id and left to
+        # `postcmd` to look up on the main thread
+        order = record['order']
+        elapsed = (record['times'][event] - record['submitted_at']) * 1000
+        symbol = self.instruments_reverse_cache.get(order.get('instrument'))
+        if symbol is None:
+            symbol = order['id']
+            if order.get('instrument'):
+                self.unresolved_instruments.put(order['instrument'])
+        detail = ''
+        if event in ('fill', 'partial_fill'):
+            detail = ' ' + str(order.get('cumulative_quantity')) + ' @ ' + str(order.get('average_price'))
+        print('\n[order] {} {} {}{} after {:.0f} ms'.format(symbol, order.get('side', ''), event, detail, elapsed))
+
     def get_symbol(self, url):
         if not url in self.instruments_reverse_cache:
             self.add_instrument_from_url(url)
@@ -595,8 +1514,12 @@ class RobinhoodShell(cmd.Cmd):
         self.add_instrument(url, symbol)
 
     def add_instrument(self, url, symbol):
+        if self.instruments_cache.get(symbol) == url:
+            return
         self.instruments_cache[symbol] = url
         self.instruments_reverse_cache[url] = symbol
+        self.trader.pretrade.add_instruments([{'symbol': symbol, 'url': url}])
+        open(self.instruments_cache_file, 'w').write(json.dumps(self.instruments_cache))
 
 def color_data(value):
     if float(value) > 0:
@@ -619,9 +1542,32 @@ def news_box(news_src,news_date,news_summary,news_title,news_url):
 
     print((news_table.table))
 
+def parse_exit_time(value, now=None):
+    'Epoch seconds for <minutes>m from now, or HH:MM exchange time in the next session that reaches it'
+    if value.lower().endswith('m'):
+        return time.time() + float(value[:-1]) * 60
+
+    hour, minute = value.split(':')
+    at = datetime.time(int(hour), int(minute))
+    if not MARKET_OPEN <= at <= MARKET_CLOSE:
+        raise ValueError('Exit time must be within market hours, {:%H:%M}-{:%H:%M}'.format(MARKET_OPEN, MARKET_CLOSE))
+
+    now = now or datetime.datetime.now(MARKET_TZ)
+    exit_at = now.replace(hour=at.hour, minute=at.minute, second=0, microsecond=0)
+    # a time already passed today is tomorrow's, weekends skipped
+    while exit_at <= now or exit_at.weekday() >= 5:
+        exit_at += datetime.timedelta(days=1)
+    return exit_at.timestamp()
+
 def parse(arg):
     'Convert a series of zero or more numbers to an argument tuple'
     return tuple(map(int, arg.split()))
 
 if __name__ == '__main__':
-    RobinhoodShell().cmdloop()
+    parser = argparse.ArgumentParser(description='Robinhood shell')
+    parser.add_argument('--paper', action='store_true', help='paper trade: orders are matched locally, never sent')
+    parser.add_argument('--cash', type=float, default=RobinhoodShell.paper_cash, help='starting cash when paper trading')
+    args = parser.parse_args()
+
+    RobinhoodShell.paper_cash = args.cash
+    RobinhoodShell(paper=args.paper).cmdloop()